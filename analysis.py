@@ -0,0 +1,362 @@
+"""Confidence intervals and significance tests for evaluation results.
+
+Usage:
+    python analysis.py data/results/reka-core-20240415-evaluator -o analysis.json --markdown analysis.md
+
+Loads the evaluation output of every model (the .jsonl files written by
+evaluate.py) into a models x examples score matrix, and computes for each
+category:
+  - bootstrap 95% confidence intervals of each model's score,
+  - for every pair of models, the paired bootstrap confidence interval of the
+    score difference and the p-values of a paired bootstrap test and of a
+    paired sign-flip permutation test.
+
+Resamples are drawn as matrices and reduced with matrix products, so there are
+no Python loops over resamples.
+"""
+
+import json
+import sys
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+CATEGORIES = ("overall", "difficulty-hard", "difficulty-normal")
+_SKIPPED_SUFFIXES = (
+    "_summary",
+    "_summary_live",
+    "_summary_telemetry",
+    "_failed",
+    "_latency",
+)
+
+
+def _parse_args():
+    parser = ArgumentParser(
+        description="Bootstrap confidence intervals and paired significance tests across evaluation results."
+    )
+    parser.add_argument(
+        "results",
+        type=Path,
+        nargs="+",
+        help="Evaluation output .jsonl files, directories containing them, or a results_store.py store.",
+    )
+    parser.add_argument(
+        "--resamples",
+        type=int,
+        default=10_000,
+        help="Number of bootstrap resamples and permutations.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the random number generator.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=Path,
+        default=None,
+        help="Location to save the analysis as JSON.",
+    )
+    parser.add_argument(
+        "--markdown",
+        type=Path,
+        default=None,
+        help="Location to save the analysis as Markdown, printed to stdout if not specified.",
+    )
+    return parser.parse_args()
+
+
+@dataclass
+class ScoreMatrix:
+    """Scores of several models on the same examples.
+
+    `scores[i, j]` is the score of model i on example j on the 0-100 scale,
+    or NaN if the model's results don't include the example.
+    """
+
+    models: List[str]
+    example_ids: List[str]
+    categories: np.ndarray
+    scores: np.ndarray
+
+    def select(self, category: str) -> np.ndarray:
+        """Scores of the examples in a category, or all for "overall"."""
+        if category == "overall":
+            return self.scores
+        return self.scores[:, self.categories == category]
+
+
+def results_files(paths: Iterable[Path]) -> List[Path]:
+    """Expands directories into the evaluation output files they contain."""
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(
+                p
+                for p in sorted(path.glob("*.jsonl"))
+                if not p.stem.endswith(_SKIPPED_SUFFIXES)
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def load_score_matrix(paths: Iterable[Path]) -> ScoreMatrix:
+    """Loads evaluation output files, one model per file named after it.
+
+    Files without any results are skipped.
+    """
+    models = []
+    example_index: Dict[str, int] = {}
+    categories = []
+    rows = []
+    for path in paths:
+        row = {}
+        with path.open() as fh:
+            for line in fh:
+                result = json.loads(line)
+                example_id = result["example_id"]
+                if example_id not in example_index:
+                    example_index[example_id] = len(example_index)
+                    categories.append(result["category"])
+                row[example_index[example_id]] = result["score"]
+        if not row:
+            print(
+                f"❗️ Warning: skipping {path}, it has no results.",
+                file=sys.stderr,
+            )
+            continue
+        models.append(path.stem)
+        rows.append(row)
+
+    scores = np.full((len(models), len(example_index)), np.nan)
+    for i, row in enumerate(rows):
+        scores[i, list(row.keys())] = list(row.values())
+    return ScoreMatrix(
+        models=models,
+        example_ids=list(example_index),
+        categories=np.array(categories),
+        scores=25 * (scores - 1),
+    )
+
+
+def score_matrix_from_store(store) -> ScoreMatrix:
+    """Builds the score matrix from the evaluated runs of a `ResultsStore`,
+    without reading any generation or explanation text."""
+    scored = store.score >= 1
+    run_ids = np.unique(store.run[scored])
+    row_of_run = np.full(len(store.runs), -1)
+    row_of_run[run_ids] = np.arange(len(run_ids))
+    scores = np.full((len(run_ids), len(store.example_ids)), np.nan)
+    scores[row_of_run[store.run[scored]], store.example[scored]] = 25 * (
+        store.score[scored] - 1.0
+    )
+    categories = np.full(len(store.example_ids), "", dtype=object)
+    categories[store.example[scored]] = np.array(store.categories)[
+        store.category[scored]
+    ]
+    return ScoreMatrix(
+        models=[store.runs[i] for i in run_ids],
+        example_ids=store.example_ids,
+        categories=categories.astype(str),
+        scores=scores,
+    )
+
+
+def _bootstrap_weights(
+    rng: np.random.Generator, num_examples: int, resamples: int
+) -> np.ndarray:
+    """How often each example is drawn in each resample, (resamples, examples).
+
+    Drawing counts rather than indices lets every model's resampled mean be
+    computed with one matrix product.
+    """
+    return rng.multinomial(
+        num_examples, np.full(num_examples, 1 / num_examples), size=resamples
+    ).astype(np.float64)
+
+
+def _two_sided_p(null: np.ndarray, observed: np.ndarray) -> np.ndarray:
+    """P-values of `observed` against null distributions along the last axis."""
+    extreme = np.abs(null) >= np.abs(observed)[..., None]
+    return (1 + extreme.sum(axis=-1)) / (1 + null.shape[-1])
+
+
+def analyse_category(
+    scores: np.ndarray, resamples: int, rng: np.random.Generator
+) -> dict:
+    """Bootstrap and permutation statistics of one category.
+
+    Examples a model has no score for are left out of its mean, and out of
+    the comparisons involving it.
+
+    Args:
+        scores: (models, examples) scores, NaN where missing.
+        resamples: Number of bootstrap resamples and permutations.
+        rng: Random number generator.
+
+    Returns:
+        Dictionary with per-model "means" and "ci95" arrays, and per-pair
+        "diff", "diff_ci95", "p_bootstrap" and "p_permutation" arrays indexed
+        [i, j] for model i minus model j.
+    """
+    num_models, num_examples = scores.shape
+    present = ~np.isnan(scores)
+    filled = np.where(present, scores, 0.0)
+    counts = present.sum(axis=1)
+    means = filled.sum(axis=1) / np.maximum(counts, 1)
+
+    weights = _bootstrap_weights(rng, num_examples, resamples)
+    boot_means = (filled @ weights.T) / np.maximum(
+        present.astype(np.float64) @ weights.T, 1
+    )
+    ci95 = np.percentile(boot_means, [2.5, 97.5], axis=1).T
+
+    # Paired differences over the examples both models have scores for,
+    # shape (models, models, examples).
+    both = present[:, None, :] & present[None, :, :]
+    diffs = np.where(both, filled[:, None, :] - filled[None, :, :], 0.0)
+    pair_counts = np.maximum(both.sum(axis=-1), 1)
+    observed = diffs.sum(axis=-1) / pair_counts
+
+    flat_diffs = diffs.reshape(-1, num_examples)
+    flat_both = both.reshape(-1, num_examples).astype(np.float64)
+    boot_diffs = (flat_diffs @ weights.T) / np.maximum(
+        flat_both @ weights.T, 1
+    )
+    boot_diffs = boot_diffs.reshape(num_models, num_models, resamples)
+    diff_ci95 = np.moveaxis(
+        np.percentile(boot_diffs, [2.5, 97.5], axis=-1), 0, -1
+    )
+    # Bootstrap test: the resampled differences, shifted to have mean zero,
+    # approximate the distribution of the difference under the null.
+    p_bootstrap = _two_sided_p(boot_diffs - observed[..., None], observed)
+
+    signs = rng.choice(np.array([-1.0, 1.0]), size=(resamples, num_examples))
+    permuted = (flat_diffs @ signs.T).reshape(
+        num_models, num_models, resamples
+    ) / pair_counts[..., None]
+    p_permutation = _two_sided_p(permuted, observed)
+
+    return {
+        "counts": counts,
+        "means": means,
+        "ci95": ci95,
+        "diff": observed,
+        "diff_ci95": diff_ci95,
+        "p_bootstrap": p_bootstrap,
+        "p_permutation": p_permutation,
+    }
+
+
+def analyse(
+    matrix: ScoreMatrix, resamples: int = 10_000, seed: int = 0
+) -> dict:
+    """Runs `analyse_category` on each category and collects the results.
+
+    Returns:
+        JSON serializable dictionary, with "models" mapping each model to
+        its count, mean and CI per category, and "pairs" listing the
+        comparison of every pair of models per category.
+    """
+    rng = np.random.default_rng(seed)
+    models = {name: {} for name in matrix.models}
+    pairs = []
+    for category in CATEGORIES:
+        stats = analyse_category(matrix.select(category), resamples, rng)
+        for i, name in enumerate(matrix.models):
+            models[name][category] = {
+                "count": int(stats["counts"][i]),
+                "mean": round(float(stats["means"][i]), 2),
+                "ci95": [round(float(x), 2) for x in stats["ci95"][i]],
+            }
+        for i in range(len(matrix.models)):
+            for j in range(i + 1, len(matrix.models)):
+                pairs.append(
+                    {
+                        "category": category,
+                        "model_a": matrix.models[i],
+                        "model_b": matrix.models[j],
+                        "diff": round(float(stats["diff"][i, j]), 2),
+                        "diff_ci95": [
+                            round(float(x), 2)
+                            for x in stats["diff_ci95"][i, j]
+                        ],
+                        "p_bootstrap": float(stats["p_bootstrap"][i, j]),
+                        "p_permutation": float(stats["p_permutation"][i, j]),
+                    }
+                )
+    return {"resamples": resamples, "models": models, "pairs": pairs}
+
+
+def to_markdown(analysis: dict) -> str:
+    """Leaderboard with confidence intervals, and tests of adjacent models."""
+    ranked = sorted(
+        analysis["models"].items(),
+        key=lambda item: item[1]["overall"]["mean"],
+        reverse=True,
+    )
+
+    def _cell(stats: dict) -> str:
+        low, high = stats["ci95"]
+        return f"{stats['mean']:.1f} [{low:.1f}, {high:.1f}]"
+
+    lines = [
+        "| Model | all | hard | normal |",
+        "|-------|-----|------|--------|",
+    ]
+    for name, stats in ranked:
+        cells = [_cell(stats[category]) for category in CATEGORIES]
+        lines.append(f"| {name} | " + " | ".join(cells) + " |")
+
+    pairs = {
+        (pair["category"], pair["model_a"], pair["model_b"]): pair
+        for pair in analysis["pairs"]
+    }
+    lines += [
+        "",
+        "| Model | Next model | Category | Difference | p (bootstrap) | p (permutation) |",
+        "|-------|------------|----------|------------|---------------|-----------------|",
+    ]
+    for (name, _), (next_name, _) in zip(ranked, ranked[1:]):
+        for category in CATEGORIES:
+            pair = pairs.get((category, name, next_name))
+            sign = 1
+            if pair is None:
+                pair = pairs[(category, next_name, name)]
+                sign = -1
+            low, high = sorted(sign * x for x in pair["diff_ci95"])
+            lines.append(
+                f"| {name} | {next_name} | {category} | "
+                f"{sign * pair['diff']:+.1f} [{low:+.1f}, {high:+.1f}] | "
+                f"{pair['p_bootstrap']:.4f} | {pair['p_permutation']:.4f} |"
+            )
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    if len(args.results) == 1 and (args.results[0] / "columns.npz").exists():
+        from results_store import ResultsStore
+
+        matrix = score_matrix_from_store(ResultsStore(args.results[0]))
+    else:
+        files = results_files(args.results)
+        if not files:
+            sys.exit("No results files found.")
+        matrix = load_score_matrix(files)
+    analysis = analyse(matrix, resamples=args.resamples, seed=args.seed)
+    if args.output is not None:
+        with open(args.output, "w") as fid:
+            json.dump(analysis, fid, indent=2)
+    markdown = to_markdown(analysis)
+    if args.markdown is not None:
+        args.markdown.write_text(markdown)
+    else:
+        print(markdown)
@@ -0,0 +1,404 @@
+"""Benchmark the throughput of evaluation and generation, offline.
+
+Usage:
+    python benchmark.py --parallelism 1 8 32 --examples 200 --latency lognormal:0.3:0.5 --error_rate_429 0.02
+
+Runs the evaluator (`evaluate_in_parallel_with_retries`) and the
+`process_data` of every model adapter against a local mock of the provider
+APIs (models/mock_server.py), once per number of requests in flight, and
+reports examples/sec, latency percentiles and the retry overhead: extra
+requests per example. No API key or network access is needed, the examples
+and their images are generated.
+
+The latency of the evaluator is measured per example from when it is picked
+up until it is scored, so it includes retries and the wait for a free request
+slot, as the evaluator picks up to twice as many examples as it has requests
+in flight. That of the adapters is the latency of the generation call that
+succeeded, from their latency files, see models/latency.py.
+
+Gemini and local vLLM Pixtral are not covered: the mock doesn't speak the
+Gemini API, and local Pixtral doesn't make requests.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from dataclasses import asdict
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+from reka.client import AsyncReka
+
+import evaluate
+from models.base_model import BaseVisionModel
+from models.dataset import Example, iter_examples, iter_records
+from models.executor import get_circuit_breaker, keep_error_headers_client
+from models.latency import latency_path, percentile
+from models.mock_server import LatencyDistribution, MockConfig, MockServer
+from models.utils import RateLimiter
+
+_SYSTEM_PROMPT_PATH = "system_prompt.txt"
+
+
+def _openai(server: MockServer, parallelism: int) -> BaseVisionModel:
+    from models.openai_models import OpenAIModel
+
+    model = OpenAIModel("mock-gpt-4o", api_key="mock")
+    model.client = model.client.with_options(base_url=f"{server.url}/v1")
+    return model
+
+
+def _xai(server: MockServer, parallelism: int) -> BaseVisionModel:
+    from models.xai_models import XAIModel
+
+    model = XAIModel("mock-grok-vision", api_key="mock")
+    model.client = model.client.with_options(base_url=f"{server.url}/v1")
+    # Its default budget of 1 request per minute would be all that's measured,
+    # use --requests_per_second to benchmark against a quota.
+    model.rate_limiter = RateLimiter()
+    return model
+
+
+def _claude(server: MockServer, parallelism: int) -> BaseVisionModel:
+    from models.claude_models import ClaudeModel
+
+    model = ClaudeModel("mock-claude", api_key="mock")
+    model.client = model.client.with_options(base_url=server.url)
+    return model
+
+
+def _reka(server: MockServer, parallelism: int) -> BaseVisionModel:
+    from reka.client import Reka
+
+    from models.reka_models import RekaModel
+
+    model = RekaModel("mock-reka", api_key="mock")
+    model.client = Reka(
+        api_key="mock",
+        base_url=f"{server.url}/v1",
+        timeout=300,
+        httpx_client=keep_error_headers_client(),
+    )
+    return model
+
+
+def _pixtral_server(server: MockServer, parallelism: int) -> BaseVisionModel:
+    from models.pixtral_server import PixtralServer
+
+    host, port = server.url.rsplit("//", 1)[1].split(":")
+    # The whole batch is sent at once, so it sets the requests in flight.
+    return PixtralServer(
+        "mock-pixtral",
+        server_url=host,
+        server_port=port,
+        max_in_flight=parallelism,
+        system_prompt_path=_SYSTEM_PROMPT_PATH,
+    )
+
+
+# Model adapters, pointed at the mock server.
+ADAPTERS: Dict[str, Callable[[MockServer, int], BaseVisionModel]] = {
+    "openai": _openai,
+    "xai": _xai,
+    "claude": _claude,
+    "reka": _reka,
+    "pixtral_server": _pixtral_server,
+}
+TARGETS = ["evaluator"] + list(ADAPTERS)
+
+
+def _parse_args():
+    parser = ArgumentParser(description="Vibe-eval throughput benchmark.")
+    parser.add_argument(
+        "--targets",
+        nargs="+",
+        choices=TARGETS,
+        default=TARGETS,
+        help="The evaluator and model adapters to benchmark.",
+    )
+    parser.add_argument(
+        "--parallelism",
+        type=int,
+        nargs="+",
+        default=[1, 8, 32],
+        help="Numbers of requests in flight to benchmark each target with.",
+    )
+    parser.add_argument(
+        "--examples",
+        type=int,
+        default=100,
+        help="Number of examples of each run.",
+    )
+    parser.add_argument(
+        "--latency",
+        type=LatencyDistribution.parse,
+        default=LatencyDistribution("lognormal", 0.2, 0.5),
+        help=(
+            "Latency of the mock responses in seconds, as kind:value[:spread], e.g. constant:0.2, "
+            "uniform:0.1:1, exponential:0.5 or lognormal:0.5:0.4 (median and shape)."
+        ),
+    )
+    parser.add_argument(
+        "--error_rate_429",
+        type=float,
+        default=0.0,
+        help="Fraction of requests failing with a 429.",
+    )
+    parser.add_argument(
+        "--error_rate_5xx",
+        type=float,
+        default=0.0,
+        help="Fraction of requests failing with a 500, 502 or 503.",
+    )
+    parser.add_argument(
+        "--retry_after",
+        type=float,
+        default=0.1,
+        help="Seconds to ask for in the Retry-After headers of injected errors, negative to leave them out.",
+    )
+    parser.add_argument(
+        "--requests_per_second",
+        type=float,
+        default=None,
+        help="Quota of the mock server, rejecting requests beyond it with a 429.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the responses of the model adapters.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the mock latencies and injected errors.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=Path,
+        default=None,
+        help="Location to save the results as JSON.",
+    )
+    return parser.parse_args()
+
+
+@contextmanager
+def _in_directory(path: str) -> Iterator[None]:
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def write_examples(path: str, count: int, server: MockServer) -> None:
+    """Writes examples with generations, their images served by the mock."""
+    with open(path, "w") as fid:
+        for i in range(count):
+            example = Example(
+                example_id=f"bench-{i:05d}",
+                category="benchmark",
+                prompt=f"Describe image {i} in detail, then list the objects in it.",
+                reference=f"Image {i} shows a red house by a river, with a bridge.",
+                media_filename=f"{i:05d}.jpg",
+                media_url=f"{server.url}/images/{i:05d}.jpg",
+                generation=f"A red house next to a river, example {i}.",
+            )
+            fid.write(json.dumps(asdict(example)) + "\n")
+
+
+def _result(
+    target: str,
+    parallelism: int,
+    examples: int,
+    latencies: List[float],
+    wall_s: float,
+    stats: dict,
+) -> dict:
+    latencies = sorted(latencies)
+    by_status = stats["by_status"]
+    server_errors = sum(
+        count for status, count in by_status.items() if status[0] == "5"
+    )
+    return {
+        "target": target,
+        "parallelism": parallelism,
+        "examples": examples,
+        "completed": len(latencies),
+        "wall_s": round(wall_s, 3),
+        "examples_per_s": round(len(latencies) / wall_s, 2),
+        **{
+            f"latency_p{q}_s": (
+                round(percentile(latencies, q), 4) if latencies else None
+            )
+            for q in (50, 95, 99)
+        },
+        "requests": stats["requests"],
+        "rate_limited": by_status.get("429", 0),
+        "server_errors": server_errors,
+        "retry_overhead": round(stats["requests"] / examples - 1, 4),
+    }
+
+
+def run_evaluator(
+    server: MockServer, examples_path: str, parallelism: int
+) -> dict:
+    """Judges the examples with `parallelism` requests in flight."""
+    evaluate.ASYNC_CLIENT = AsyncReka(
+        api_key="mock",
+        base_url=f"{server.url}/v1",
+        timeout=300,
+        httpx_client=keep_error_headers_client(asynchronous=True),
+    )
+    get_circuit_breaker("reka").reset()
+    examples = list(iter_examples(examples_path))
+    picked_up = {}
+    latencies = []
+
+    def _pick_up() -> Iterator[Example]:
+        for example in examples:
+            picked_up[example.example_id] = time.perf_counter()
+            yield example
+
+    def _on_result(example: Example) -> None:
+        latencies.append(time.perf_counter() - picked_up[example.example_id])
+
+    start = time.perf_counter()
+    evaluate.evaluate_in_parallel_with_retries(
+        _pick_up(),
+        evaluator=evaluate.Evaluator.REKA_CORE,
+        parallelism=parallelism,
+        max_parallelism=parallelism,
+        on_result=_on_result,
+        on_failure=lambda example, error: None,
+    )
+    wall_s = time.perf_counter() - start
+    return _result(
+        "evaluator",
+        parallelism,
+        len(examples),
+        latencies,
+        wall_s,
+        server.stats(),
+    )
+
+
+def run_adapter(
+    name: str,
+    server: MockServer,
+    examples_path: str,
+    parallelism: int,
+    stream: bool = False,
+) -> dict:
+    """Generates for the examples with `parallelism` requests in flight,
+    writing to the current directory."""
+    model = ADAPTERS[name](server, parallelism)
+    model.output_file_path = f"{name}-{parallelism}.jsonl"
+    model.latency_file_path = latency_path(model.output_file_path)
+    model.executor.breaker.reset()
+    if stream and model.supports_streaming:
+        model.stream = True
+    data = model.load_data(examples_path)
+    # Models generating in batches send a whole batch at once.
+    concurrency = 1 if model.batch_size else parallelism
+    start = time.perf_counter()
+    model.process_data(data, concurrency=concurrency)
+    wall_s = time.perf_counter() - start
+    latencies = [
+        record["latency_s"] for record in iter_records(model.latency_file_path)
+    ]
+    return _result(
+        name, parallelism, len(data), latencies, wall_s, server.stats()
+    )
+
+
+def run_benchmark(
+    targets: List[str],
+    parallelisms: List[int],
+    config: MockConfig,
+    examples: int = 100,
+    stream: bool = False,
+    on_result: Optional[Callable[[dict], None]] = None,
+) -> List[dict]:
+    """Runs every target with every parallelism against a mock server.
+
+    Files are written to a temporary directory, removed at the end.
+
+    Returns:
+        A result per run, see `_result`.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as workdir, _in_directory(
+        workdir
+    ), MockServer(config) as server:
+        with open(_SYSTEM_PROMPT_PATH, "w") as fid:
+            fid.write("You are {name}, today is {today}.")
+        examples_path = "examples.jsonl"
+        write_examples(examples_path, examples, server)
+        for target in targets:
+            for parallelism in parallelisms:
+                server.reset()
+                if target == "evaluator":
+                    result = run_evaluator(server, examples_path, parallelism)
+                else:
+                    result = run_adapter(
+                        target, server, examples_path, parallelism, stream
+                    )
+                results.append(result)
+                if on_result is not None:
+                    on_result(result)
+    return results
+
+
+def to_markdown(results: List[dict]) -> str:
+    """One row per run."""
+    lines = [
+        "| target | parallelism | completed | examples/s | p50 s | p95 s | p99 s | requests | 429 | 5xx | retry overhead |",
+        "|---|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    for result in results:
+        latencies = [
+            "-" if result[key] is None else f"{result[key]:.3f}"
+            for key in ("latency_p50_s", "latency_p95_s", "latency_p99_s")
+        ]
+        lines.append(
+            f"| {result['target']} | {result['parallelism']} "
+            f"| {result['completed']}/{result['examples']} | {result['examples_per_s']:.2f} "
+            f"| {' | '.join(latencies)} | {result['requests']} | {result['rate_limited']} "
+            f"| {result['server_errors']} | {100 * result['retry_overhead']:.1f}% |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    config = MockConfig(
+        latency=args.latency,
+        error_rate_429=args.error_rate_429,
+        error_rate_5xx=args.error_rate_5xx,
+        retry_after=args.retry_after if args.retry_after >= 0 else None,
+        requests_per_second=args.requests_per_second,
+        seed=args.seed,
+    )
+    results = run_benchmark(
+        args.targets,
+        args.parallelism,
+        config,
+        examples=args.examples,
+        stream=args.stream,
+        on_result=lambda result: print(
+            f"{result['target']} x{result['parallelism']}: "
+            f"{result['examples_per_s']:.2f} examples/s",
+            file=sys.stderr,
+        ),
+    )
+    if args.output is not None:
+        with open(args.output, "w") as fid:
+            json.dump(results, fid, indent=2)
+    print(to_markdown(results))
@@ -0,0 +1,296 @@
+"""Build a data bundle for the visualizer.
+
+Usage:
+    python build_visualizer.py data/results/reka-core-20240415-evaluator -o visualizer/bundle
+    python -m http.server -d visualizer
+
+then open http://localhost:8000 and load the bundle.
+
+The bundle is a directory holding:
+  - manifest.json: the models with their mean scores per category, and for
+    every example its id, category, thumbnail and the score of every model,
+    so the visualizer can list and compare models without loading any text,
+  - shards/examples/<shard>.json: prompt, reference and media_url of the
+    examples in a shard,
+  - shards/models/<model>/<shard>.json: generation and evaluator explanation
+    of a model for the examples in a shard, so only the compared models are
+    fetched,
+  - thumbnails/<stem>-<hash>.jpg: downscaled images, named by the stem and a
+    hash of the whole media_filename so that images with the same stem don't
+    collide, full-resolution images are linked to their media_url.
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import tqdm
+
+from analysis import results_files
+from models.utils import (
+    configure_image_bundle,
+    configure_image_cache,
+    get_image_data,
+)
+
+_REPO_DIR = Path(__file__).parent
+
+
+def _parse_args():
+    parser = ArgumentParser(description="Build a visualizer data bundle.")
+    parser.add_argument(
+        "results",
+        type=Path,
+        nargs="+",
+        help="Evaluation output .jsonl files, or directories containing them.",
+    )
+    parser.add_argument(
+        "--data",
+        type=Path,
+        default=_REPO_DIR / "data/vibe-eval.v1.jsonl",
+        help="Path of the .jsonl file containing the dataset examples.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=Path,
+        default=_REPO_DIR / "visualizer/bundle",
+        help="Directory to write the bundle to.",
+    )
+    parser.add_argument(
+        "--shard_size",
+        type=int,
+        default=16,
+        help="Number of examples per shard.",
+    )
+    parser.add_argument(
+        "--thumbnail_size",
+        type=int,
+        default=768,
+        help="Maximum side of the thumbnails in pixels.",
+    )
+    parser.add_argument(
+        "--no_thumbnails",
+        action="store_true",
+        help="Don't make thumbnails, the visualizer shows images from their media_url.",
+    )
+    parser.add_argument(
+        "--images_dir",
+        type=Path,
+        default=None,
+        help="Directory with the images named by media_filename, e.g. from the release artifact.",
+    )
+    parser.add_argument(
+        "--image_cache_dir",
+        default=str(_REPO_DIR / "data/cache/images"),
+        help="Directory caching downloaded images.",
+    )
+    parser.add_argument(
+        "--image_bundle",
+        default=str(_REPO_DIR / "data/vibe-eval.v1.bundle"),
+        help="Packed image bundle to read images from, if it exists.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Number of threads making thumbnails.",
+    )
+    return parser.parse_args()
+
+
+def make_thumbnail(data: bytes, max_side: int) -> bytes:
+    """Downscales an image to fit in max_side x max_side, as JPEG."""
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    image.draft("RGB", (max_side, max_side))
+    image.thumbnail((max_side, max_side))
+    out = io.BytesIO()
+    image.convert("RGB").save(out, format="JPEG", quality=80)
+    return out.getvalue()
+
+
+def _thumbnail_name(media_filename: str) -> str:
+    digest = hashlib.sha1(media_filename.encode("utf-8")).hexdigest()[:10]
+    return f"thumbnails/{Path(media_filename).stem}-{digest}.jpg"
+
+
+def _write_json(path: Path, obj) -> None:
+    path.parent.mkdir(exist_ok=True, parents=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w") as fh:
+        json.dump(obj, fh, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def build_bundle(
+    data_path: Path,
+    results_paths: List[Path],
+    output: Path,
+    shard_size: int = 16,
+    thumbnail_size: Optional[int] = 768,
+    images_dir: Optional[Path] = None,
+    workers: int = 8,
+) -> dict:
+    """Writes the bundle, see the module docstring for its layout.
+
+    Thumbnails already in the output directory are kept, so re-building with
+    more results files only makes thumbnails for new examples. The shards of
+    an earlier build are removed, as the viewer would show those it no longer
+    has a model or example for. Nothing else in the output directory is
+    removed.
+
+    Args:
+        data_path: Dataset .jsonl file.
+        results_paths: Evaluation output files, one model per file.
+        output: Directory to write the bundle to.
+        shard_size: Number of examples per shard.
+        thumbnail_size: Maximum side of the thumbnails, or None to not make
+            any.
+        images_dir: Directory with the images named by media_filename,
+            images are fetched with models.utils.get_image_data otherwise.
+        workers: Number of threads making thumbnails.
+
+    Returns:
+        The manifest.
+    """
+    with data_path.open() as fh:
+        examples = [json.loads(line) for line in fh]
+    example_index = {ex["example_id"]: i for i, ex in enumerate(examples)}
+    shutil.rmtree(output / "shards", ignore_errors=True)
+
+    models = []
+    scores: List[List[Optional[int]]] = [[] for _ in examples]
+    for model_id, path in enumerate(results_paths):
+        shards: Dict[int, dict] = defaultdict(dict)
+        totals = defaultdict(lambda: [0, 0])
+        for row in scores:
+            row.append(None)
+        with path.open() as fh:
+            for line in fh:
+                result = json.loads(line)
+                i = example_index.get(result["example_id"])
+                if i is None:
+                    continue
+                score = result.get("score")
+                scores[i][model_id] = score
+                if score is not None:
+                    for category in (examples[i]["category"], "overall"):
+                        totals[category][0] += 1
+                        totals[category][1] += 25 * (score - 1)
+                shards[i // shard_size][result["example_id"]] = {
+                    "generation": result.get("generation", ""),
+                    "evaluator_explanation": result.get(
+                        "evaluator_explanation", ""
+                    ),
+                }
+        for shard, content in shards.items():
+            _write_json(
+                output / f"shards/models/{model_id}/{shard}.json", content
+            )
+        models.append(
+            {
+                "name": path.stem,
+                "scores": {
+                    category: round(total / count, 2)
+                    for category, (count, total) in sorted(totals.items())
+                },
+            }
+        )
+
+    for shard in range(0, len(examples), shard_size):
+        _write_json(
+            output / f"shards/examples/{shard // shard_size}.json",
+            {
+                ex["example_id"]: {
+                    "prompt": ex["prompt"],
+                    "reference": ex["reference"],
+                    "media_url": ex["media_url"],
+                }
+                for ex in examples[shard : shard + shard_size]
+            },
+        )
+
+    thumbnails = [None] * len(examples)
+    if thumbnail_size is not None:
+
+        def _thumbnail(i: int) -> Optional[str]:
+            example = examples[i]
+            name = _thumbnail_name(example["media_filename"])
+            if (output / name).exists():
+                return name
+            try:
+                if images_dir is not None:
+                    data = (
+                        images_dir / example["media_filename"]
+                    ).read_bytes()
+                else:
+                    data = bytes(get_image_data(example["media_url"]))
+                thumbnail = make_thumbnail(data, thumbnail_size)
+            except Exception as e:
+                print(
+                    f"Failed to make thumbnail for {example['example_id']}: {e!r}",
+                    file=sys.stderr,
+                )
+                return None
+            (output / "thumbnails").mkdir(exist_ok=True, parents=True)
+            tmp_path = output / (name + ".tmp")
+            tmp_path.write_bytes(thumbnail)
+            os.replace(tmp_path, output / name)
+            return name
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            thumbnails = list(
+                tqdm.tqdm(
+                    executor.map(_thumbnail, range(len(examples))),
+                    total=len(examples),
+                    desc="thumbnails",
+                )
+            )
+
+    manifest = {
+        "shard_size": shard_size,
+        "models": models,
+        "examples": [
+            {
+                "example_id": ex["example_id"],
+                "category": ex["category"],
+                "media_url": ex["media_url"],
+                "thumbnail": thumbnails[i],
+                "scores": scores[i],
+            }
+            for i, ex in enumerate(examples)
+        ],
+    }
+    _write_json(output / "manifest.json", manifest)
+    return manifest
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    configure_image_cache(args.image_cache_dir)
+    if os.path.exists(args.image_bundle):
+        configure_image_bundle(args.image_bundle)
+    files = results_files(args.results)
+    manifest = build_bundle(
+        args.data,
+        files,
+        args.output,
+        shard_size=args.shard_size,
+        thumbnail_size=None if args.no_thumbnails else args.thumbnail_size,
+        images_dir=args.images_dir,
+        workers=args.workers,
+    )
+    print(
+        f"Wrote bundle of {len(manifest['examples'])} examples and "
+        f"{len(manifest['models'])} models to {args.output}."
+    )
@@ -8,28 +8,76 @@ The generations.jsonl file is expected to contain generations in the format
 (one per line)
 
 This will output a copy of the dataset to out.jsonl with added "generation", "score" and "evaluator_explanation" fields.
+Examples are appended to out.jsonl as they are scored, so an interrupted run can be continued with --resume.
+Examples failing all retries are written to out_failed.jsonl, and can be retried with:
+    python evaluate.py --redrive -o out.jsonl
+Where the time of a run goes can be profiled with --profile, see models/profiling.py.
 """
 
-import concurrent.futures
+import asyncio
+import collections
+import hashlib
 import json
+import math
 import os
 import re
+import sqlite3
 import sys
 import time
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 from collections import defaultdict
-from dataclasses import asdict, dataclass
+from dataclasses import asdict, dataclass, field, replace
 from dotenv import load_dotenv
 from enum import Enum
 from pathlib import Path
-from typing import List, Optional
+from typing import (
+    AbstractSet,
+    Callable,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Sized,
+    Tuple,
+)
 
-from reka.client import Reka
-import requests
+from reka.client import AsyncReka
 import tqdm
 
+from models import profiling
+from models.dataset import (
+    Coverage,
+    DatasetIndex,
+    Example,
+    iter_examples,
+    iter_records,
+    join_generations,
+)
+from models.executor import (
+    ErrorKind,
+    ParseError,
+    RequestExecutor,
+    RetryPolicy,
+    classify_error,
+    describe_error,
+    get_circuit_breaker,
+    keep_error_headers_client,
+)
+from models.telemetry import (
+    BYTES_UPLOADED,
+    CACHE_LOOKUPS,
+    TOKENS,
+    serve_metrics,
+    track_request,
+    write_report,
+)
+from models.utils import RateLimiter, estimate_tokens, get_rate_limiter
+
 _REPO_DIR = Path(__file__).parent
-CLIENT = None
+_EVALUATOR_TEMPERATURE = 0.4
+ASYNC_CLIENT = None
 
 
 def _parse_args():
@@ -47,11 +95,84 @@ def _parse_args():
         choices=[e.value for e in Evaluator],
         help="The evaluator to use.",
     )
+    parser.add_argument(
+        "--cascade_evaluator",
+        type=str,
+        default=None,
+        choices=[e.value for e in Evaluator],
+        help=(
+            "Judge every example with this evaluator first, and only send those it is uncertain about to "
+            "--evaluator. The evaluator making the final judgement is recorded in the output."
+        ),
+    )
+    parser.add_argument(
+        "--cascade_uncertain_scores",
+        type=lambda value: frozenset(int(score) for score in value.split(",")),
+        default=frozenset({2, 3, 4}),
+        help="Comma separated first-stage ratings that are escalated to --evaluator.",
+    )
+    parser.add_argument(
+        "--cascade_samples",
+        type=int,
+        default=2,
+        help="Number of first-stage judgements per example, examples are escalated if they disagree.",
+    )
     parser.add_argument(
         "--parallelism",
         type=int,
         default=8,
-        help="Number of concurrent parallel requests to the Reka API to make.",
+        help=(
+            "Initial number of concurrent requests to the Reka API. The limit is adapted while running, "
+            "growing while requests succeed and backing off on rate limits or rising latency."
+        ),
+    )
+    parser.add_argument(
+        "--max_parallelism",
+        type=int,
+        default=256,
+        help="Upper bound on the number of concurrent requests to the Reka API.",
+    )
+    parser.add_argument(
+        "--rpm",
+        type=float,
+        default=None,
+        help="Requests per minute budget for the evaluator, defaults to REKA_RPM env variable if set.",
+    )
+    parser.add_argument(
+        "--tpm",
+        type=float,
+        default=None,
+        help="Estimated tokens per minute budget for the evaluator, defaults to REKA_TPM env variable if set.",
+    )
+    parser.add_argument(
+        "--cache_path",
+        type=Path,
+        default=_REPO_DIR / "data/cache/evaluator.sqlite",
+        help="SQLite file caching evaluator responses across runs.",
+    )
+    parser.add_argument(
+        "--no_cache",
+        "--no-cache",
+        action="store_true",
+        help="Don't read or write the evaluator cache.",
+    )
+    parser.add_argument(
+        "--refresh_cache",
+        "--refresh-cache",
+        action="store_true",
+        help="Ignore cached evaluator responses, but store the new ones.",
+    )
+    parser.add_argument(
+        "--cache_max_entries",
+        type=int,
+        default=1_000_000,
+        help="Evict least recently used cache entries beyond this number.",
+    )
+    parser.add_argument(
+        "--cache_max_age_days",
+        type=float,
+        default=90,
+        help="Evict cache entries created more than this many days ago.",
     )
     parser.add_argument(
         "--output",
@@ -69,36 +190,149 @@ def _parse_args():
         ),
         default=None,
     )
+    parser.add_argument(
+        "--live_summary_interval",
+        type=float,
+        default=60,
+        help=(
+            "Seconds between snapshots of the running metrics, written next to --output_summary with a '_live' "
+            "suffix while evaluating. 0 disables the snapshots."
+        ),
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=None,
+        help=(
+            "Serve telemetry in the Prometheus text format on http://127.0.0.1:<port>/metrics while evaluating. "
+            "A final report is always written next to --output_summary with a '_telemetry' suffix."
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        nargs="?",
+        const=Path(profiling.default_profile_dir("evaluate")),
+        default=None,
+        help=(
+            "Time each pipeline stage per example and profile the run with cProfile, tracemalloc and a "
+            "sampling profiler, writing the results to this directory (data/profiles/evaluate-<time> "
+            "if no directory is given). See models/profiling.py."
+        ),
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Append to --output, skipping examples it already contains.",
+    )
+    parser.add_argument(
+        "--dead_letter",
+        type=Path,
+        default=None,
+        help=(
+            "Location to save JSONL file of examples that failed all retries, if not specified defaults to --output "
+            "path with '_failed' suffix added to filename."
+        ),
+    )
+    parser.add_argument(
+        "--redrive",
+        action="store_true",
+        help="Only retry the examples in the --dead_letter file, appending them to --output.",
+    )
+    parser.add_argument(
+        "--shard",
+        type=_parse_shard,
+        default=None,
+        help=(
+            "Only evaluate shard i of N, given as 'i/N' with 0 <= i < N. Examples are assigned to shards by a "
+            "hash of their example_id, so separate machines can each evaluate one shard, see --merge."
+        ),
+    )
+    parser.add_argument(
+        "--merge",
+        type=Path,
+        nargs="+",
+        default=None,
+        help=(
+            "Merge the --output files of sharded runs into --output, checking that every example of the "
+            "generations file (or the dataset if not given) is covered exactly once."
+        ),
+    )
     parser.add_argument(
         "generations",
         type=Path,
+        nargs="?",
         help="JSONL file containing generations, with keys 'example_id' and 'generation'.",
     )
     args = parser.parse_args()
+    if args.generations is None and not (args.redrive or args.merge):
+        parser.error(
+            "the generations file is required unless using --redrive or --merge"
+        )
     args.evaluator = Evaluator(args.evaluator)
+    if args.cascade_evaluator is not None:
+        args.cascade_evaluator = Evaluator(args.cascade_evaluator)
     return args
 
 
+def _parse_shard(value: str) -> Tuple[int, int]:
+    """Parses 'i/N' into (i, N)."""
+    index, _, count = value.partition("/")
+    try:
+        shard = int(index), int(count)
+    except ValueError:
+        raise ArgumentTypeError(f"expected 'i/N', got {value!r}") from None
+    if not 0 <= shard[0] < shard[1]:
+        raise ArgumentTypeError(f"expected 0 <= i < N, got {value!r}")
+    return shard
+
+
+def _in_shard(example_id: str, shard: Tuple[int, int]) -> bool:
+    """Stable assignment of examples to shards, the same on every machine."""
+    digest = hashlib.sha256(example_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard[1] == shard[0]
+
+
 class Evaluator(Enum):
     # Use Reka Core (including image input).
     REKA_CORE = "reka-core-20240501"
+    # Faster and cheaper, used as the first stage of cascaded judging.
+    REKA_FLASH = "reka-flash-20241127"
+
+
+class UnparsableJudgement(ParseError):
+    """The evaluator response has no rating."""
 
 
 @dataclass
-class Example:
-    """An example loaded from vibe-eval, stored as jsonl in the repo."""
+class Cascade:
+    """First stage of cascaded judging.
+
+    Every example is judged `samples` times by `evaluator`. It is escalated
+    to the main evaluator if a rating is in `uncertain_scores`, can't be
+    parsed, or the samples disagree. Escalations are counted by reason.
+    """
 
-    example_id: str
-    category: str
-    prompt: str
-    reference: str
-    media_filename: str
-    media_url: str
+    evaluator: Evaluator
+    uncertain_scores: FrozenSet[int] = frozenset({2, 3, 4})
+    samples: int = 2
+    judged: int = 0
+    escalations: "collections.Counter[str]" = field(
+        default_factory=collections.Counter
+    )
 
-    # The fields below are not stored in the dataset, but are populated by this script.
-    generation: Optional[str] = None
-    score: Optional[int] = None
-    evaluator_explanation: Optional[str] = None
+    def report(self) -> str:
+        escalated = sum(self.escalations.values())
+        reasons = ", ".join(
+            f"{count} {reason}"
+            for reason, count in self.escalations.most_common()
+        )
+        rate = escalated / self.judged if self.judged else 0
+        report = (
+            f"Cascade: escalated {escalated} of {self.judged} examples "
+            f"({rate:.1%}) to the main evaluator"
+        )
+        return f"{report}: {reasons}." if reasons else f"{report}."
 
 
 _PROMPT_WITH_IMAGE = """\
@@ -146,8 +380,118 @@ def make_evaluator_prompt(example: Example, include_image: bool) -> str:
     )
 
 
-def evaluate(example: Example, evaluator: Evaluator) -> Example:
-    """Evaluates the generation and populates the score and explanation fields."""
+class JudgementCache:
+    """On-disk cache of evaluator responses, stored in SQLite.
+
+    Entries are keyed on the evaluator model, the temperature and a hash of the
+    full evaluator prompt, so any change to the prompt, reference or generation
+    is a cache miss.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_entries: int = 1_000_000,
+        max_age_days: float = 90,
+        refresh: bool = False,
+    ):
+        """
+        Args:
+            path: Location of the SQLite database, created if missing.
+            max_entries: Least recently used entries beyond this are evicted.
+            max_age_days: Entries created longer ago than this are evicted.
+            refresh: If set, lookups always miss but new responses are stored.
+        """
+        path.parent.mkdir(exist_ok=True, parents=True)
+        self._db = sqlite3.connect(str(path))
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS judgements (
+                key TEXT PRIMARY KEY,
+                evaluator TEXT NOT NULL,
+                response TEXT NOT NULL,
+                score INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS judgements_accessed_at ON judgements (accessed_at)"
+        )
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.evict()
+
+    @staticmethod
+    def key(
+        example: Example,
+        evaluator: Evaluator,
+        temperature: float,
+        sample: int = 0,
+    ) -> str:
+        """Key of a judgement, `sample` distinguishes repeated judgements."""
+        prompt = "".join(
+            message["content"] for message in _evaluator_messages(example)
+        )
+        key = [evaluator.value, temperature, prompt]
+        if sample:
+            key.append(sample)
+        digest = hashlib.sha256(json.dumps(key).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, int]]:
+        """Returns the cached (response, score), if any."""
+        if self.refresh:
+            self.misses += 1
+            CACHE_LOOKUPS.inc(cache="judgement", result="miss")
+            return None
+        row = self._db.execute(
+            "SELECT response, score FROM judgements WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            CACHE_LOOKUPS.inc(cache="judgement", result="miss")
+            return None
+        self.hits += 1
+        CACHE_LOOKUPS.inc(cache="judgement", result="hit")
+        self._db.execute(
+            "UPDATE judgements SET accessed_at = ? WHERE key = ?",
+            (time.time(), key),
+        )
+        self._db.commit()
+        return row[0], row[1]
+
+    def put(
+        self, key: str, evaluator: Evaluator, response: str, score: int
+    ) -> None:
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO judgements VALUES (?, ?, ?, ?, ?, ?)",
+            (key, evaluator.value, response, score, now, now),
+        )
+        self._db.commit()
+
+    def evict(self) -> None:
+        """Removes entries that are too old, then the least recently used ones."""
+        self._db.execute(
+            "DELETE FROM judgements WHERE created_at < ?",
+            (time.time() - self.max_age_days * 24 * 3600,),
+        )
+        self._db.execute(
+            """DELETE FROM judgements WHERE key IN (
+                SELECT key FROM judgements ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,),
+        )
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def _evaluator_messages(example: Example) -> List[dict]:
     include_image = False
     evaluator_prompt = make_evaluator_prompt(
         example, include_image=include_image
@@ -158,21 +502,20 @@ def evaluate(example: Example, evaluator: Evaluator) -> Example:
             f"Currently only supporting text-based evaluator"
         )
 
-    evaluator_response = CLIENT.chat.create(
-        model=evaluator.value,
-        messages=[
-            {
-                "content": evaluator_prompt,
-                "role": "user",
-            }
-        ],
-        temperature=0.4,
-    )
-    evaluator_response = evaluator_response.responses[0].message.content
-    re_match = re.search(r"Rating:\s*([1-5])", evaluator_response)
+    return [
+        {
+            "content": evaluator_prompt,
+            "role": "user",
+        }
+    ]
+
+
+def _populate_score(example: Example, evaluator_response: str) -> Example:
+    with profiling.stage("parse_judgement"):
+        re_match = re.search(r"Rating:\s*([1-5])", evaluator_response)
 
     if re_match is None:
-        raise ValueError(
+        raise UnparsableJudgement(
             f"Evaluator generation did not contain Rating: ([1-5]): {evaluator_response}"
         )
     example.score = int(re_match.group(1))
@@ -180,109 +523,628 @@ def evaluate(example: Example, evaluator: Evaluator) -> Example:
     return example
 
 
-def evaluate_in_parallel_with_retries(
-    examples: List[Example],
-    evaluator: Evaluator,
-    max_retries: int = 10,
-    parallelism: int = 8,
-    rate_limit_delay: int = 10,  # in seconds
-) -> List[Example]:
-    """Runs evaluation in parallel, retrying common exceptions."""
+def _record_usage(evaluator: Evaluator, evaluator_response) -> None:
+    usage = evaluator_response.usage
+    TOKENS.inc(usage.input_tokens, model=evaluator.value, direction="input")
+    TOKENS.inc(usage.output_tokens, model=evaluator.value, direction="output")
+
 
-    def _evaluate_with_retry(example: Example) -> Example:
-        latest_error: BaseException = RuntimeError()
-        for i in range(max_retries):
+async def evaluate_async(example: Example, evaluator: Evaluator) -> Example:
+    """Evaluates the generation and populates the score and explanation fields."""
+    evaluator_response = await ASYNC_CLIENT.chat.create(
+        model=evaluator.value,
+        messages=_evaluator_messages(example),
+        temperature=_EVALUATOR_TEMPERATURE,
+    )
+    _record_usage(evaluator, evaluator_response)
+    return _populate_score(
+        example, evaluator_response.responses[0].message.content
+    )
+
+
+class AdaptiveConcurrencyLimiter:
+    """Limits the number of in-flight requests, adapting the limit with AIMD.
+
+    Every successful request grows the limit by 1 / limit, so the limit grows by
+    about one per window of successful requests. A rate limit error, or a
+    smoothed latency above `latency_tolerance` times the best one seen so far,
+    multiplies the limit by `backoff_factor`. The best latency drifts up
+    towards the current one by `latency_baseline_drift` per request, so that
+    a lasting rise in latency, e.g. of longer judgements, becomes the new
+    baseline instead of holding the limit down for good. Only requests started after the
+    latest decrease can trigger another one, so a burst of 429s from a single
+    window only halves the limit once.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int = 1,
+        max_limit: int = 256,
+        backoff_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+        latency_smoothing: float = 0.1,
+        latency_baseline_drift: float = 0.01,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, initial_limit)
+        self.limit = float(min(max(initial_limit, min_limit), self.max_limit))
+        self.backoff_factor = backoff_factor
+        self.latency_tolerance = latency_tolerance
+        self.latency_smoothing = latency_smoothing
+        self.latency_baseline_drift = latency_baseline_drift
+        self.in_flight = 0
+        self._latency_ewma: Optional[float] = None
+        self._best_latency_ewma: Optional[float] = None
+        self._last_decrease = float("-inf")
+        self._waiters: "collections.deque[asyncio.Future]" = collections.deque()
+
+    async def acquire(self) -> float:
+        """Waits for a free slot, returns the start time to pass to `release`."""
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
             try:
-                return evaluate(example, evaluator=evaluator)
-            except Exception as e:
-                if (
-                    isinstance(e, requests.exceptions.HTTPError)
-                    and e.response.status_code == 429
-                ):
-                    print(
-                        f"Hit rate limit error {_exception_debug_str(e)}. Sleeping for {rate_limit_delay}s. Attempt {i + 1} of {max_retries}.",
-                        file=sys.stderr,
-                    )
-                    time.sleep(rate_limit_delay)
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
                 else:
-                    print(
-                        f"Hit error {_exception_debug_str(e)}. Attempt {i + 1} of {max_retries}.",
-                        file=sys.stderr,
-                    )
-                latest_error = e
-        raise latest_error
+                    # We were woken up for a slot we won't use, pass it on.
+                    self._wake_waiters()
+                raise
+        self.in_flight += 1
+        return time.monotonic()
 
-    out = []
-    with concurrent.futures.ThreadPoolExecutor(
-        max_workers=parallelism
-    ) as executor:
-        futures = {
-            executor.submit(_evaluate_with_retry, example)
-            for example in examples
-        }
-        for future in tqdm.tqdm(
-            concurrent.futures.as_completed(futures), total=len(examples)
+    def release(self, start_time: float, overloaded: bool = False) -> None:
+        """Frees a slot and adapts the limit.
+
+        Args:
+            start_time: The value returned by the matching `acquire`.
+            overloaded: Whether the request failed with a rate limit error.
+        """
+        self.in_flight -= 1
+        now = time.monotonic()
+        if not overloaded:
+            overloaded = self._record_latency(now - start_time)
+        if overloaded:
+            if start_time > self._last_decrease:
+                self.limit = max(
+                    self.min_limit, self.limit * self.backoff_factor
+                )
+                self._last_decrease = now
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake_waiters()
+
+    def _record_latency(self, latency: float) -> bool:
+        """Updates the latency estimate, returns whether latency is too high."""
+        if self._latency_ewma is None:
+            self._latency_ewma = latency
+        else:
+            self._latency_ewma += self.latency_smoothing * (
+                latency - self._latency_ewma
+            )
+        if (
+            self._best_latency_ewma is None
+            or self._latency_ewma < self._best_latency_ewma
+        ):
+            self._best_latency_ewma = self._latency_ewma
+        else:
+            self._best_latency_ewma += self.latency_baseline_drift * (
+                self._latency_ewma - self._best_latency_ewma
+            )
+        return (
+            self._latency_ewma
+            > self.latency_tolerance * self._best_latency_ewma
+        )
+
+    def _wake_waiters(self) -> None:
+        free_slots = int(self.limit) - self.in_flight
+        while free_slots > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free_slots -= 1
+
+
+class RunningMetrics:
+    """Running per-category means of the scores, with 95% confidence intervals.
+
+    Uses Welford's algorithm, so adding an example is O(1) regardless of how
+    many have been scored. Scores are on the 0-100 scale used in the summary.
+    If `snapshot_path` is given, the metrics are written there as JSON at most
+    every `snapshot_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        snapshot_path: Optional[Path] = None,
+        snapshot_interval: float = 60,
+    ):
+        # category -> [count, mean, sum of squared differences from the mean]
+        self._stats = defaultdict(lambda: [0, 0.0, 0.0])
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._last_snapshot = time.monotonic()
+
+    def add(self, example: Example) -> None:
+        value = 25 * (example.score - 1)
+        for category in (example.category, "overall"):
+            stats = self._stats[category]
+            stats[0] += 1
+            delta = value - stats[1]
+            stats[1] += delta / stats[0]
+            stats[2] += delta * (value - stats[1])
+        if (
+            self.snapshot_path is not None
+            and time.monotonic() - self._last_snapshot
+            >= self.snapshot_interval
         ):
+            self.write_snapshot()
+
+    def summary(self) -> dict:
+        """Count, mean and 95% confidence interval of each category."""
+        results = {}
+        for category, (count, mean, m2) in sorted(self._stats.items()):
+            stderr = math.sqrt(m2 / (count - 1) / count) if count > 1 else 0
+            results[category] = {
+                "count": count,
+                "mean": round(mean, 2),
+                "ci95": [
+                    round(max(0.0, mean - 1.96 * stderr), 2),
+                    round(min(100.0, mean + 1.96 * stderr), 2),
+                ],
+            }
+        return results
+
+    def format(self) -> str:
+        """Short description for the progress bar."""
+        parts = []
+        for category, stats in self.summary().items():
+            half_width = (stats["ci95"][1] - stats["ci95"][0]) / 2
+            name = category.replace("difficulty-", "")
+            parts.append(
+                f"{name}={stats['mean']:.1f}±{half_width:.1f} (n={stats['count']})"
+            )
+        return ", ".join(parts)
+
+    def write_snapshot(self) -> None:
+        self._last_snapshot = time.monotonic()
+        self.snapshot_path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.snapshot_path.with_name(
+            self.snapshot_path.name + ".tmp"
+        )
+        with open(tmp_path, "w") as fid:
+            json.dump({"time": time.time(), **self.summary()}, fid)
+        os.replace(tmp_path, self.snapshot_path)
+
+
+async def _evaluate_all_async(
+    examples: Iterable[Example],
+    evaluator: Evaluator,
+    max_retries: int,
+    parallelism: int,
+    max_parallelism: int,
+    rate_limit_delay: float,
+    cache: Optional[JudgementCache],
+    rate_limiter: Optional[RateLimiter],
+    on_result: Callable[[Example], None],
+    on_failure: Optional[Callable[[Example, BaseException], None]],
+    total: Optional[int],
+    metrics: Optional[RunningMetrics] = None,
+    cascade: Optional[Cascade] = None,
+) -> None:
+    limiter = AdaptiveConcurrencyLimiter(
+        initial_limit=parallelism, max_limit=max_parallelism
+    )
+    policy = RetryPolicy(
+        max_attempts=max_retries, rate_limit_delay=rate_limit_delay
+    )
+    executor = RequestExecutor(
+        policy, get_circuit_breaker("reka"), name=evaluator.value
+    )
+    # Unparsable first-stage judgements are escalated rather than retried.
+    first_stage_executor = RequestExecutor(
+        replace(policy, retry_parse_errors=False),
+        executor.breaker,
+        name=cascade.evaluator.value if cascade is not None else "",
+    )
+
+    async def _evaluate_with_retry(
+        example: Example,
+        evaluator: Evaluator,
+        sample: int = 0,
+        escalate_unparsable: bool = False,
+    ) -> Optional[Example]:
+        """Judges with retries. If `escalate_unparsable` is set, returns None
+        on an unparsable judgement rather than retrying."""
+        if cache is not None:
+            cache_key = cache.key(
+                example, evaluator, _EVALUATOR_TEMPERATURE, sample
+            )
+            with profiling.stage("cache_lookup"):
+                cached = cache.get(cache_key)
+            if cached is not None:
+                example.evaluator_explanation, example.score = cached
+                return example
+
+        async def _attempt() -> Example:
+            content = _evaluator_messages(example)[0]["content"]
+            if rate_limiter is not None:
+                await rate_limiter.wait_if_needed_async(
+                    estimate_tokens(content)
+                )
+            start_time = await limiter.acquire()
+            overloaded = False
             try:
-                out.append(future.result())
+                BYTES_UPLOADED.inc(len(content.encode()), kind="prompt")
+                with profiling.stage("provider_call"), track_request(
+                    evaluator.value
+                ):
+                    return await evaluate_async(example, evaluator=evaluator)
             except Exception as e:
-                for future in futures:
-                    future.cancel()
-                raise RuntimeError from e
+                overloaded = classify_error(e) is ErrorKind.RATE_LIMIT
+                raise
+            finally:
+                limiter.release(start_time, overloaded=overloaded)
 
-    return out
+        try:
+            example = await (
+                first_stage_executor if escalate_unparsable else executor
+            ).call_async(_attempt, label=example.example_id)
+        except UnparsableJudgement:
+            if escalate_unparsable:
+                return None
+            raise
+        if cache is not None:
+            cache.put(
+                cache_key,
+                evaluator,
+                example.evaluator_explanation,
+                example.score,
+            )
+        return example
 
+    async def _first_stage(example: Example) -> Optional[str]:
+        """Judges with the cascade's evaluator, returning why the example
+        should be escalated, or None if the first judgement is final."""
+        cascade.judged += 1
+        first = None
+        for sample in range(cascade.samples):
+            judged = await _evaluate_with_retry(
+                example, cascade.evaluator, sample, escalate_unparsable=True
+            )
+            if judged is None:
+                return "unparsable"
+            if example.score in cascade.uncertain_scores:
+                return "uncertain"
+            if first is None:
+                first = example.score, example.evaluator_explanation
+            elif example.score != first[0]:
+                return "disagreement"
+        example.score, example.evaluator_explanation = first
+        return None
 
-def _exception_debug_str(e: BaseException) -> str:
-    """Generates a string representation of the exception chain."""
-    exception_chain = [e]
-    while e.__cause__ is not None:
-        exception_chain.append(e.__cause__)
-        e = e.__cause__
-    return " <- ".join(repr(exc) for exc in exception_chain)
+    async def _judge(example: Example) -> Example:
+        with profiling.example(example.example_id):
+            if cascade is not None:
+                reason = await _first_stage(example)
+                if reason is None:
+                    example.evaluator = cascade.evaluator.value
+                    return example
+                cascade.escalations[reason] += 1
+                example.escalation_reason = reason
+            example = await _evaluate_with_retry(example, evaluator)
+            example.evaluator = evaluator.value
+            return example
 
+    pending = set()
+    progress = tqdm.tqdm(total=total)
 
-def _read_examples(data_fname: Path, generations_fname: Path) -> List[Example]:
-    """Create initial Example objects with blank evaluator scores."""
-    id_to_example = {}
-    id_to_generation = {}
+    def _handle_done(done) -> None:
+        for task in done:
+            example = task_to_example.pop(task)
+            try:
+                result = task.result()
+            except Exception as e:
+                if on_failure is None:
+                    raise RuntimeError from e
+                on_failure(example, e)
+            else:
+                with profiling.example(result.example_id):
+                    on_result(result)
+                if metrics is not None:
+                    metrics.add(result)
+                    progress.set_postfix_str(metrics.format(), refresh=False)
+            progress.update()
 
-    with data_fname.open() as fh:
-        for line in fh:
-            example = Example(**json.loads(line))
-            id_to_example[example.example_id] = example
+    # Only keep a bounded number of examples in memory, pulling more from
+    # `examples` as tasks complete.
+    max_pending = 2 * max_parallelism
+    task_to_example = {}
+    try:
+        for example in examples:
+            if len(pending) >= max_pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                _handle_done(done)
+            task = asyncio.ensure_future(_judge(example))
+            task_to_example[task] = example
+            pending.add(task)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            _handle_done(done)
+    finally:
+        progress.close()
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+def evaluate_in_parallel_with_retries(
+    examples: Iterable[Example],
+    evaluator: Evaluator,
+    max_retries: int = 10,
+    parallelism: int = 8,
+    max_parallelism: int = 256,
+    rate_limit_delay: float = 10,  # in seconds
+    cache: Optional[JudgementCache] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    on_result: Optional[Callable[[Example], None]] = None,
+    on_failure: Optional[Callable[[Example, BaseException], None]] = None,
+    metrics: Optional[RunningMetrics] = None,
+    cascade: Optional[Cascade] = None,
+    total: Optional[int] = None,
+) -> List[Example]:
+    """Runs evaluation concurrently on an asyncio loop, retrying failed requests.
+
+    Requests are retried up to `max_retries` attempts by a
+    `models.executor.RequestExecutor`: rate limits back off exponentially from
+    `rate_limit_delay` unless the response says how long to wait, transient
+    errors back off from 1s, unparsable judgements are retried straight away
+    and other client errors aren't retried. Repeated failures open the Reka
+    circuit breaker, pausing all requests.
+
+    The number of in-flight requests starts at `parallelism` and is adapted
+    between 1 and `max_parallelism`, see `AdaptiveConcurrencyLimiter`. Examples
+    found in `cache` are scored without calling the evaluator. Requests wait
+    for `rate_limiter`, if given, before being sent.
+
+    `examples` is consumed lazily. If `on_result` is given, each scored example
+    is passed to it as soon as it completes and nothing is returned, otherwise
+    the scored examples are returned in completion order. If `on_failure` is
+    given, examples failing all retries are passed to it with the final error
+    instead of aborting the run. If `metrics` is given, scored examples are
+    added to it and its running means are shown on the progress bar. If
+    `cascade` is given, examples are first judged by its evaluator and only
+    escalated to `evaluator` when it is uncertain, see `Cascade`. `total` is
+    the number of examples shown on the progress bar, by default the length
+    of `examples` if it has one.
+    """
+    if total is None and isinstance(examples, Sized):
+        total = len(examples)
+    out = []
+    asyncio.run(
+        _evaluate_all_async(
+            examples,
+            evaluator=evaluator,
+            max_retries=max_retries,
+            parallelism=parallelism,
+            max_parallelism=max_parallelism,
+            rate_limit_delay=rate_limit_delay,
+            cache=cache,
+            rate_limiter=rate_limiter,
+            on_result=out.append if on_result is None else on_result,
+            on_failure=on_failure,
+            total=total,
+            metrics=metrics,
+            cascade=cascade,
+        )
+    )
+    return out
+
+
+def _read_examples(
+    data_fname: Path,
+    generations_fname: Path,
+    skip_ids: AbstractSet[str] = frozenset(),
+) -> Iterator[Example]:
+    """Create initial Example objects with blank evaluator scores.
+
+    Generations are streamed and matched to the dataset through its byte
+    offset index, so neither file is held in memory. Examples whose ids are
+    in `skip_ids` are not yielded.
+    """
+    with profiling.stage("dataset_index"):
+        dataset = DatasetIndex(str(data_fname))
     print(
-        f"Read {len(id_to_example)} examples from {data_fname}.",
+        f"Read {len(dataset)} examples from {data_fname}.",
         file=sys.stderr,
     )
 
-    with generations_fname.open() as fh:
-        for line in fh:
-            obj = json.loads(line)
-            id_to_generation[obj["example_id"]] = obj["generation"]
+    coverage = Coverage()
+    try:
+        yield from join_generations(
+            dataset, str(generations_fname), skip_ids, coverage
+        )
+    finally:
+        dataset.close()
     print(
-        f"Read {len(id_to_generation)} examples from {generations_fname}.",
+        f"Read {len(coverage.seen)} examples from {generations_fname}.",
         file=sys.stderr,
     )
 
-    if len(id_to_generation) < len(id_to_example):
-        print(f"❗️ Warning: Missing generations for some examples in dataset.")
+    for example_id in sorted(coverage.duplicates):
+        print(
+            f"❗️ Warning: Duplicate generation for {example_id}, kept the first one.",
+            file=sys.stderr,
+        )
+    if coverage.unknown:
+        print(
+            f"❗️ Warning: Skipped {len(coverage.unknown)} generations for examples not in the dataset, "
+            f"e.g. {min(coverage.unknown)}.",
+            file=sys.stderr,
+        )
+    if coverage.missing:
+        print(
+            f"❗️ Warning: Missing generations for {len(coverage.missing)} examples in dataset."
+        )
 
-    examples = []
-    for example_id, generation in id_to_generation.items():
-        kwargs = asdict(id_to_example[example_id])
-        kwargs["generation"] = generation
-        examples.append(Example(**kwargs))
 
-    return examples
+def _count_examples(
+    data_fname: Path,
+    generations_fname: Path,
+    skip_ids: AbstractSet[str] = frozenset(),
+    shard: Optional[Tuple[int, int]] = None,
+) -> int:
+    """Number of examples `_read_examples` yields, then filtered by `shard`,
+    for the progress bar."""
+    dataset = DatasetIndex(str(data_fname))
+    dataset.close()
+    seen = set()
+    count = 0
+    for record in iter_records(str(generations_fname)):
+        example_id = record["example_id"]
+        if example_id in seen:
+            continue
+        seen.add(example_id)
+        if example_id not in dataset or example_id in skip_ids:
+            continue
+        if shard is None or _in_shard(example_id, shard):
+            count += 1
+    return count
 
 
-def _write_examples(examples: List[Example], output_path: Path) -> None:
-    output_path.parent.mkdir(exist_ok=True, parents=True)
-    with open(output_path, "w") as fh:
-        for example in examples:
-            fh.write(json.dumps(asdict(example), ensure_ascii=False) + "\n")
-    print(f"Output {len(examples)} examples to {output_path}.")
+def _read_written_examples(output_path: Path) -> Iterator[Example]:
+    """Streams the examples from an evaluation output file."""
+    return iter_examples(str(output_path))
+
+
+def _completed_example_ids(output_path: Path) -> Set[str]:
+    """Returns the ids already in `output_path`, for resuming a run.
+
+    A partially written last line, left behind if the previous run was killed
+    mid-write, is truncated away so that appending to the file is safe.
+    """
+    completed_ids = set()
+    if not output_path.exists():
+        return completed_ids
+    with output_path.open("rb+") as fh:
+        valid_size = 0
+        for line in fh:
+            if not line.endswith(b"\n"):
+                break
+            completed_ids.add(json.loads(line)["example_id"])
+            valid_size += len(line)
+        fh.truncate(valid_size)
+    return completed_ids
+
+
+class _JsonlAppender:
+    """Appends JSON lines to a file, flushed and fsync'd after every line."""
+
+    def __init__(self, path: Path, mode: str = "a"):
+        path.parent.mkdir(exist_ok=True, parents=True)
+        self._fh = open(path, mode)
+        self.count = 0
+
+    def write(self, obj: dict) -> None:
+        with profiling.stage("write_output"):
+            self._fh.write(json.dumps(obj, ensure_ascii=False) + "\n")
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+        self.count += 1
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+def _prepare_redrive(dead_letter_path: Path) -> Path:
+    """Moves the dead-letter file aside so that examples failing again can be
+    written to it, returning the path of the examples to retry.
+
+    If an earlier redrive was interrupted, its pending examples are kept and
+    the examples it dead-lettered again are merged into them, so no example
+    is lost. Examples that were scored are skipped like with --resume.
+
+    Raises:
+        FileNotFoundError: If there is nothing to redrive.
+    """
+    redrive_path = dead_letter_path.with_name(
+        dead_letter_path.name + ".redrive"
+    )
+    if not redrive_path.exists():
+        if not dead_letter_path.exists():
+            raise FileNotFoundError(
+                f"No dead-letter file {dead_letter_path} to redrive."
+            )
+        os.replace(dead_letter_path, redrive_path)
+        return redrive_path
+    print(
+        f"Resuming the interrupted redrive of {redrive_path}.", file=sys.stderr
+    )
+    if dead_letter_path.exists():
+        pending_ids = {
+            record["example_id"] for record in iter_records(str(redrive_path))
+        }
+        writer = _JsonlAppender(redrive_path, mode="a")
+        for record in iter_records(str(dead_letter_path)):
+            if record["example_id"] not in pending_ids:
+                pending_ids.add(record["example_id"])
+                writer.write(record)
+        writer.close()
+        dead_letter_path.unlink()
+    return redrive_path
+
+
+def _merge_shards(
+    shard_paths: List[Path], output_path: Path, expected_ids: Iterable[str]
+) -> bool:
+    """Combines the outputs of sharded runs into one output file.
+
+    Every expected id must be in exactly one shard output. Gaps and
+    duplicates are reported, keeping the first result of duplicated ids.
+
+    Returns:
+        Whether the shards covered every expected id exactly once.
+    """
+    expected_ids = set(expected_ids)
+    seen_ids = set()
+    duplicates = set()
+    unexpected = set()
+    writer = _JsonlAppender(output_path, mode="w")
+    for path in shard_paths:
+        count = 0
+        for record in iter_records(str(path)):
+            example_id = record["example_id"]
+            if example_id in seen_ids:
+                duplicates.add(example_id)
+                continue
+            seen_ids.add(example_id)
+            if example_id not in expected_ids:
+                unexpected.add(example_id)
+            writer.write(record)
+            count += 1
+        print(f"Merged {count} examples from {path}.", file=sys.stderr)
+    writer.close()
+
+    missing = expected_ids - seen_ids
+    for example_ids, problem in [
+        (duplicates, "are in more than one shard output, kept the first"),
+        (unexpected, "are not among the expected examples"),
+        (missing, "are missing from the shard outputs"),
+    ]:
+        if example_ids:
+            print(
+                f"❗️ Warning: {len(example_ids)} examples {problem}, e.g. {min(example_ids)}.",
+                file=sys.stderr,
+            )
+    print(f"Output {writer.count} examples to {output_path}.")
+    return not (duplicates or unexpected or missing)
 
 
 def _mean(scores: List[int]) -> float:
@@ -290,7 +1152,12 @@ def _mean(scores: List[int]) -> float:
     return sum(25 * (score - 1) for score in scores) / len(scores)
 
 
-def _summarise_metrics(examples: List[Example]) -> None:
+def _summarise_metrics(examples: Iterable[Example]) -> dict:
+    """Prints and returns the mean score per category and overall.
+
+    Only the `category` and `score` of the examples are used, so the
+    `ScoreRecord`s of a results_store.py store work as well.
+    """
     category_to_scores = defaultdict(list)
     for example in examples:
         category_to_scores[example.category].append(example.score)
@@ -303,37 +1170,178 @@ def _summarise_metrics(examples: List[Example]) -> None:
         print(f"| {category.ljust(18)} | {score_str.ljust(12)} |")
         results[category] = float(score_str)
 
-    overall_score = _mean([example.score for example in examples])
+    overall_score = _mean(
+        [score for scores in category_to_scores.values() for score in scores]
+    )
     score_str = f"{overall_score:.2f}"
     print(f"| ALL                | {score_str.ljust(12)} |\n")
     results["overall"] = float(score_str)
     return results
 
 
+def _with_suffix(path: Path, suffix: str) -> Path:
+    """Adds a suffix to the filename, e.g. out.jsonl -> out_summary.jsonl."""
+    out_base, out_ext = os.path.splitext(path)
+    return Path(out_base + suffix + out_ext)
+
+
+def _write_summary(output_path: Path, summary_path: Optional[Path]) -> None:
+    summary = _summarise_metrics(_read_written_examples(output_path))
+
+    # Write summary of metrics to file.
+    if summary_path is None:
+        summary_path = _with_suffix(output_path, "_summary")
+
+    with open(summary_path, "w") as fid:
+        json.dump(summary, fid)
+
+
 if __name__ == "__main__":
     args = _parse_args()
 
+    if args.merge:
+        if args.generations is not None:
+            dataset = DatasetIndex(str(args.data))
+            expected_ids = [
+                record["example_id"]
+                for record in iter_records(str(args.generations))
+                if record["example_id"] in dataset
+            ]
+        else:
+            expected_ids = DatasetIndex(str(args.data)).ids()
+        complete = _merge_shards(args.merge, args.output, expected_ids)
+        _write_summary(args.output, args.output_summary)
+        sys.exit(0 if complete else 1)
+
+    if args.profile is not None:
+        profiling.start_profiling(str(args.profile))
+
     load_dotenv()
-    CLIENT = Reka(api_key=os.environ["REKA_API_KEY"])
-    if args.output.exists():
+    # The Reka SDK's errors don't keep the response headers, this client
+    # keeps them for the executor to honour Retry-After.
+    ASYNC_CLIENT = AsyncReka(
+        api_key=os.environ["REKA_API_KEY"],
+        timeout=300,
+        httpx_client=keep_error_headers_client(asynchronous=True),
+    )
+    cache = None
+    if not args.no_cache:
+        cache = JudgementCache(
+            args.cache_path,
+            max_entries=args.cache_max_entries,
+            max_age_days=args.cache_max_age_days,
+            refresh=args.refresh_cache,
+        )
+    dead_letter_path = args.dead_letter or _with_suffix(
+        args.output, "_failed"
+    )
+    generations_path = args.generations
+    if args.redrive:
+        # Retry only the dead-lettered examples.
+        try:
+            generations_path = _prepare_redrive(dead_letter_path)
+        except FileNotFoundError as e:
+            sys.exit(f"❗️ {e}")
+
+    out_summary = args.output_summary
+    if out_summary is None:
+        out_summary = _with_suffix(args.output, "_summary")
+    live_summary_path = None
+    if args.live_summary_interval > 0:
+        live_summary_path = _with_suffix(out_summary, "_live")
+    metrics = RunningMetrics(live_summary_path, args.live_summary_interval)
+    if args.metrics_port is not None:
+        serve_metrics(args.metrics_port)
+
+    completed_ids = set()
+    if args.resume or args.redrive:
+        completed_ids = _completed_example_ids(args.output)
+        if completed_ids:
+            for example in _read_written_examples(args.output):
+                metrics.add(example)
+        print(
+            f"Resuming, skipping {len(completed_ids)} examples already in {args.output}.",
+            file=sys.stderr,
+        )
+    elif args.output.exists():
         print(
             f"❗️ Warning: --output {args.output} already exists. Will overwrite.",
             file=sys.stderr,
         )
-    examples = _read_examples(args.data, args.generations)
-    examples = evaluate_in_parallel_with_retries(
-        examples=examples,
-        evaluator=args.evaluator,
-        parallelism=args.parallelism,
+
+    writer = _JsonlAppender(
+        args.output, mode="a" if args.resume or args.redrive else "w"
     )
-    _write_examples(examples, args.output)
-    summary = _summarise_metrics(examples)
+    dead_letter = _JsonlAppender(dead_letter_path, mode="w")
 
-    # Write summary of metrics to file.
-    out_summary = args.output_summary
-    if out_summary is None:
-        out_base, out_ext = os.path.splitext(args.output)
-        out_summary = out_base + "_summary" + out_ext
+    def _dead_letter(example: Example, error: BaseException) -> None:
+        print(
+            f"Giving up on {example.example_id}: {describe_error(error)}",
+            file=sys.stderr,
+        )
+        dead_letter.write(
+            {
+                "example_id": example.example_id,
+                "generation": example.generation,
+                "error": describe_error(error),
+            }
+        )
 
-    with open(out_summary, "w") as fid:
-        json.dump(summary, fid)
+    cascade = None
+    if args.cascade_evaluator is not None:
+        cascade = Cascade(
+            args.cascade_evaluator,
+            uncertain_scores=args.cascade_uncertain_scores,
+            samples=args.cascade_samples,
+        )
+    total = _count_examples(
+        args.data, generations_path, completed_ids, args.shard
+    )
+    examples = _read_examples(args.data, generations_path, completed_ids)
+    if args.shard is not None:
+        examples = (e for e in examples if _in_shard(e.example_id, args.shard))
+    try:
+        evaluate_in_parallel_with_retries(
+            examples=examples,
+            evaluator=args.evaluator,
+            parallelism=args.parallelism,
+            max_parallelism=args.max_parallelism,
+            cache=cache,
+            rate_limiter=get_rate_limiter("reka", args.rpm, args.tpm),
+            on_result=lambda example: writer.write(asdict(example)),
+            on_failure=_dead_letter,
+            metrics=metrics,
+            cascade=cascade,
+            total=total,
+        )
+    finally:
+        # Also written when interrupted, to profile part of a long run.
+        stage_table = profiling.stop_profiling()
+        if stage_table is not None:
+            print(stage_table, file=sys.stderr)
+            print(f"Profile written to {args.profile}.", file=sys.stderr)
+    writer.close()
+    if cascade is not None:
+        print(cascade.report(), file=sys.stderr)
+    dead_letter.close()
+    if cache is not None:
+        print(
+            f"Evaluator cache: {cache.hits} hits, {cache.misses} misses.",
+            file=sys.stderr,
+        )
+        cache.close()
+    if args.redrive:
+        generations_path.unlink()
+    print(f"Output {writer.count} examples to {args.output}.")
+    if dead_letter.count:
+        print(
+            f"❗️ Warning: {dead_letter.count} examples failed and were written to {dead_letter_path}. "
+            f"Retry them with --redrive.",
+            file=sys.stderr,
+        )
+    else:
+        dead_letter_path.unlink()
+    if live_summary_path is not None and live_summary_path.exists():
+        live_summary_path.unlink()
+    _write_summary(args.output, out_summary)
+    write_report(str(_with_suffix(out_summary, "_telemetry")))
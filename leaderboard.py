@@ -0,0 +1,213 @@
+"""Build the leaderboard from evaluation results.
+
+Usage:
+    python leaderboard.py data/results/reka-core-20240415-evaluator --markdown leaderboard.md -o leaderboard.json
+
+Per-category aggregates of every results file are kept in an index
+(data/cache/leaderboard_index.json by default) along with the file's size,
+modification time and content hash. Only files that were added or changed
+since the last build are read again, so adding a model to a large leaderboard
+only costs reading that model's results.
+"""
+
+import hashlib
+import json
+import os
+import sys
+from argparse import ArgumentParser
+from decimal import ROUND_HALF_UP, Decimal
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from analysis import results_files
+
+_REPO_DIR = Path(__file__).parent
+_INDEX_VERSION = 1
+# Leaderboard columns and the categories they aggregate.
+COLUMNS = {
+    "all": "overall",
+    "hard": "difficulty-hard",
+    "normal": "difficulty-normal",
+}
+
+
+def _parse_args():
+    parser = ArgumentParser(description="Vibe-eval leaderboard.")
+    parser.add_argument(
+        "results",
+        type=Path,
+        nargs="*",
+        default=[_REPO_DIR / "data/results/reka-core-20240415-evaluator"],
+        help="Evaluation output .jsonl files, or directories containing them.",
+    )
+    parser.add_argument(
+        "--index",
+        type=Path,
+        default=_REPO_DIR / "data/cache/leaderboard_index.json",
+        help="Index of the aggregates of each results file, updated in place.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=Path,
+        default=None,
+        help="Location to save the leaderboard as JSON.",
+    )
+    parser.add_argument(
+        "--markdown",
+        type=Path,
+        default=None,
+        help="Location to save the leaderboard as Markdown, printed to stdout if not specified.",
+    )
+    return parser.parse_args()
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def aggregate_results(path: Path) -> Dict[str, List[float]]:
+    """Count and sum of the 0-100 scores in a results file, per category."""
+    aggregates = {"overall": [0, 0.0]}
+    with path.open() as fh:
+        for line in fh:
+            result = json.loads(line)
+            value = 25 * (result["score"] - 1)
+            for category in (result["category"], "overall"):
+                count_sum = aggregates.setdefault(category, [0, 0.0])
+                count_sum[0] += 1
+                count_sum[1] += value
+    return aggregates
+
+
+class LeaderboardIndex:
+    """Per-category aggregates of results files, persisted as JSON.
+
+    A file is re-read only if its size or modification time changed and its
+    content hash no longer matches the indexed one.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._entries: Dict[str, dict] = {}
+        if path.exists():
+            with path.open() as fh:
+                index = json.load(fh)
+            if index.get("version") == _INDEX_VERSION:
+                self._entries = index["entries"]
+        self._dirty = False
+
+    def update(self, files: Iterable[Path]) -> List[Path]:
+        """Brings the index up to date with `files`.
+
+        Files no longer in `files` are dropped from the index.
+
+        Returns:
+            The files whose aggregates were recomputed.
+        """
+        recomputed = []
+        entries = {}
+        for path in files:
+            key = str(path.resolve())
+            stat = path.stat()
+            entry = self._entries.get(key)
+            if (
+                entry is None
+                or entry["size"] != stat.st_size
+                or entry["mtime_ns"] != stat.st_mtime_ns
+            ):
+                sha256 = _file_sha256(path)
+                if entry is None or entry["sha256"] != sha256:
+                    entry = {
+                        "model": path.stem,
+                        "sha256": sha256,
+                        "aggregates": aggregate_results(path),
+                    }
+                    recomputed.append(path)
+                entry = {
+                    **entry,
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                }
+                self._dirty = True
+            entries[key] = entry
+        if entries.keys() != self._entries.keys():
+            self._dirty = True
+        self._entries = entries
+        return recomputed
+
+    def save(self) -> None:
+        """Writes the index, if it changed since it was loaded."""
+        if not self._dirty:
+            return
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("w") as fh:
+            json.dump(
+                {"version": _INDEX_VERSION, "entries": self._entries}, fh
+            )
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+    def leaderboard(self) -> List[dict]:
+        """Models sorted by overall score, with their score per column."""
+        rows = []
+        for entry in self._entries.values():
+            if not entry["aggregates"]["overall"][0]:
+                continue
+            row = {"model": entry["model"]}
+            for column, category in COLUMNS.items():
+                count, total = entry["aggregates"].get(category, [0, 0.0])
+                # Rounded like the _summary files written by evaluate.py.
+                row[column] = round(total / count, 2) if count else None
+            rows.append(row)
+        return sorted(rows, key=lambda row: row["all"], reverse=True)
+
+
+def _round_half_up(score: float) -> str:
+    """Formats with one decimal, 52.25 -> 52.3 as in the README table."""
+    return str(Decimal(str(score)).quantize(Decimal("0.1"), ROUND_HALF_UP))
+
+
+def to_markdown(rows: List[dict]) -> str:
+    """Leaderboard in the layout of the README table."""
+    width = max([len("Model")] + [len(row["model"]) for row in rows])
+    lines = [
+        f"| {'Model'.ljust(width)} | all    | hard  | normal|",
+        f"|-{'-' * width}-|--------|-------|-------|",
+    ]
+    for row in rows:
+        cells = [
+            "-" if row[column] is None else _round_half_up(row[column])
+            for column in COLUMNS
+        ]
+        lines.append(
+            f"| {row['model'].ljust(width)} | {cells[0].ljust(6)} "
+            f"| {cells[1].ljust(5)} | {cells[2].ljust(5)} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    index = LeaderboardIndex(args.index)
+    recomputed = index.update(results_files(args.results))
+    index.save()
+    print(
+        f"Recomputed aggregates of {len(recomputed)} results files.",
+        file=sys.stderr,
+    )
+
+    rows = index.leaderboard()
+    if args.output is not None:
+        with open(args.output, "w") as fid:
+            json.dump(rows, fid, indent=2)
+    markdown = to_markdown(rows)
+    if args.markdown is not None:
+        args.markdown.write_text(markdown)
+    else:
+        print(markdown)
@@ -1,14 +1,44 @@
 # models/base_model.py
+import functools
 import json
-import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from tqdm import tqdm
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from abc import ABC, abstractmethod
+from . import profiling
+from .dataset import iter_records
+from .executor import RequestExecutor, RetryPolicy, describe_error, get_circuit_breaker
+from .image_processing import prepare_image
+from .latency import LatencyTimer, latency_path
+from .telemetry import BYTES_UPLOADED, TOKENS, track_request
+from .utils import ImagePrefetcher, RateLimiter, estimate_tokens
 
 class BaseVisionModel(ABC):
     """Base class for vision-language models."""
     
+    # Name of the image profile in image_processing.PROFILES, for models whose
+    # generate_response uploads images with prepare_image rather than passing
+    # the URL to the provider. Such images are worth prefetching.
+    image_profile: Optional[str] = None
+
+    # Number of examples to pass to generate_batch at once, for models that can
+    # generate many responses more efficiently in a single call.
+    batch_size: Optional[int] = None
+
+    # Whether to stream responses with stream_response, recording the time to
+    # first token in the latency file, see models/latency.py.
+    stream: bool = False
+
+    # Provider of the API, e.g. "reka", naming the circuit breaker shared with
+    # its other clients, such as the evaluator, see executor.get_circuit_breaker.
+    # Defaults to the class name.
+    provider: Optional[str] = None
+
+    # Client-side quota of the provider, waited for before each request, see
+    # utils.get_rate_limiter.
+    rate_limiter: Optional[RateLimiter] = None
+
     def __init__(self, model_name: str):
         """Initialize the vision model.
         
@@ -17,6 +47,8 @@ class BaseVisionModel(ABC):
         """
         self.model_name = model_name
         self.output_file_path = f"data/generations/{model_name.lower().replace('/', '-')}.jsonl"
+        self.latency_file_path = latency_path(self.output_file_path)
+        self.telemetry_file_path = f"{os.path.splitext(self.output_file_path)[0]}_telemetry.json"
         if os.path.isfile(self.output_file_path):
             # Warning and prompt for user confirmation
             print(f"Warning: The output file '{self.output_file_path}' already exists and may be overwritten.")
@@ -26,11 +58,16 @@ class BaseVisionModel(ABC):
                 exit(1)
         os.makedirs(os.path.dirname(self.output_file_path), exist_ok=True)
         self.max_retries = 3
+        self.executor = RequestExecutor(
+            RetryPolicy(max_attempts=self.max_retries),
+            get_circuit_breaker(self.provider or type(self).__name__),
+            name=model_name,
+        )
 
     def load_data(self, data_path: str) -> List[Dict]:
-        with open(data_path, "r") as fid:
-            data = fid.readlines()
-        return [json.loads(x) for x in data]
+        """Load the dataset records, see models/dataset.py."""
+        with profiling.stage("dataset_load"):
+            return list(iter_records(data_path))
 
     @abstractmethod
     def generate_response(self, example: Dict[str, Any]) -> str:
@@ -44,27 +81,221 @@ class BaseVisionModel(ABC):
         """
         pass
 
-    def process_examples(self, data_path: str = "data/vibe-eval.v1.jsonl"):
+    def batch_provider(self):
+        """Get the provider batch API to submit bulk jobs to, see batch_jobs.py.
+        
+        Raises:
+            NotImplementedError: If the model doesn't support batch jobs
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support batch jobs")
+
+    @property
+    def supports_streaming(self) -> bool:
+        return type(self).stream_response is not BaseVisionModel.stream_response
+
+    def stream_response(self, example: Dict[str, Any], timer: LatencyTimer) -> str:
+        """Generate a response, streaming it from the provider, used instead of generate_response when self.stream is set.
+
+        Args:
+            example: Dictionary containing at least 'media_url' and 'prompt' keys
+            timer: Timer of the call, to call first_token on when the first text
+                arrives, and to set output_tokens on if the provider reports usage
+
+        Returns:
+            str: The whole generated response
+
+        Raises:
+            NotImplementedError: If the model doesn't support streaming
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support streaming")
+
+    def _generate_timed(self, example: Dict[str, Any], timer: LatencyTimer) -> str:
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait_if_needed(estimate_tokens(example["prompt"], num_images=1))
+            # The wait for the quota isn't part of the latency of the request.
+            timer.restart()
+        BYTES_UPLOADED.inc(len(example["prompt"].encode()), kind="prompt")
+        with profiling.example(example["example_id"]), profiling.stage("provider_call"), track_request(self.model_name):
+            if self.stream:
+                return self.stream_response(example, timer)
+            return self.generate_response(example)
+
+    def _finish_timer(self, example: Dict[str, Any], timer: LatencyTimer, response: str, retries: int = 0) -> Dict[str, Any]:
+        """The latency record of a generation, also counting its tokens in the telemetry."""
+        record = timer.finish(example, response, retries=retries)
+        TOKENS.inc(estimate_tokens(example["prompt"], num_images=1), model=self.model_name, direction="input")
+        TOKENS.inc(record["output_tokens"], model=self.model_name, direction="output")
+        return record
+
+    def _generate_with_retries_timed(self, example: Dict[str, Any]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """generate_with_retries, also returning the latency record of the attempt that succeeded."""
+        example_id = example["example_id"]
+        timers = []
+
+        def _attempt() -> str:
+            timers.append(LatencyTimer())
+            return self._generate_timed(example, timers[-1])
+
+        try:
+            response = self.executor.call(_attempt, label=example_id)
+        except Exception as e:
+            print(f"Failed generation for {example_id}, error: {describe_error(e)}")
+            return None, None
+        return response, self._finish_timer(example, timers[-1], response, retries=len(timers) - 1)
+
+    def generate_with_retries(self, example: Dict[str, Any]) -> Optional[str]:
+        """Call generate_response, retrying failures with self.executor, see models/executor.py.
+
+        Returns:
+            The generated response, or None if every attempt failed or the error isn't retryable
+        """
+        return self._generate_with_retries_timed(example)[0]
+
+    def generate_batch(
+        self, examples: List[Dict[str, Any]], timers: Optional[List[LatencyTimer]] = None
+    ) -> List[Optional[str]]:
+        """Generate responses for several examples at once.
+        
+        Used instead of generate_response when batch_size is set. The default
+        implementation just calls generate_response for each example.
+        
+        Args:
+            examples: Examples to generate responses for
+            timers: Timers of the examples, for implementations that can time
+                them individually, otherwise they time the whole batch
+            
+        Returns:
+            Responses in the same order as examples, None for failed ones
+        """
+        timers = timers or [LatencyTimer() for _ in examples]
+        return [self._generate_timed(example, timer) for example, timer in zip(examples, timers)]
+
+    def _generate_batch_with_retries_timed(
+        self, examples: List[Dict[str, Any]]
+    ) -> List[Tuple[Optional[str], Optional[Dict[str, Any]]]]:
+        """generate_batch_with_retries, also returning the latency records."""
+        timers = [LatencyTimer() for _ in examples]
+        try:
+            responses = self.generate_batch(examples, timers)
+        except Exception as e:
+            print(f"Failed generation for batch of {len(examples)} examples, retrying individually, error: {e}")
+            responses = [None] * len(examples)
+        return [
+            self._generate_with_retries_timed(example) if response is None else (response, self._finish_timer(example, timer, response))
+            for example, timer, response in zip(examples, timers, responses)
+        ]
+
+    def generate_batch_with_retries(self, examples: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """Call generate_batch, retrying failed examples one by one.
+
+        Returns:
+            Responses in the same order as examples, None for those where
+            every attempt failed
+        """
+        return [response for response, _ in self._generate_batch_with_retries_timed(examples)]
+
+    def process_examples(
+        self,
+        data_path: str = "data/vibe-eval.v1.jsonl",
+        concurrency: int = 1,
+        ordered: bool = False,
+        prefetch: int = 0,
+    ):
+        """Generate responses for the dataset and write them to the output file.
+
+        Args:
+            data_path: Path of the dataset .jsonl file
+            concurrency: Number of generate_response calls to run in parallel
+            ordered: Write generations in dataset order, buffering those that
+                complete early, rather than in completion order
+            prefetch: Number of upcoming examples to download and normalize
+                images for in the background, for models with an image_profile
+        """
         data = self.load_data(data_path)
+        self.process_data(data, concurrency=concurrency, ordered=ordered, prefetch=prefetch)
+
+    def process_data(
+        self,
+        data: List[Dict],
+        concurrency: int = 1,
+        ordered: bool = False,
+        prefetch: int = 0,
+        progress_position: Optional[int] = None,
+    ):
+        """Generate responses for loaded examples, see process_examples.
+
+        Args:
+            data: Examples loaded with load_data, which may be shared with
+                other models running at the same time
+            progress_position: Line of the progress bar, when several models
+                show progress at once
+        """
+        prefetcher = None
+        if prefetch > 0 and self.image_profile is not None:
+            prefetcher = ImagePrefetcher(
+                fetch=functools.partial(prepare_image, profile_name=self.image_profile)
+            )
+        # Examples are submitted to the pool in chunks of batch_size when the
+        # model supports batching, and one by one otherwise.
+        chunk_size = self.batch_size or 1
+
+        def _generate_chunk(start: int) -> List[Tuple[Optional[str], Optional[Dict[str, Any]]]]:
+            chunk = data[start:start + chunk_size]
+            if self.batch_size:
+                return self._generate_batch_with_retries_timed(chunk)
+            return [self._generate_with_retries_timed(chunk[0])]
+
+        # Bound the number of chunks submitted or waiting in the reorder
+        # buffer, so that a slow chunk holds back at most this many finished
+        # ones when writing in dataset order.
+        max_pending = 4 * concurrency
         
-        with open(self.output_file_path, "w") as fid:
-            for example in tqdm(data):
-                example_id = example["example_id"]
-                retries = 0
-                while retries < self.max_retries:
-                    try:
-                        response = self.generate_response(example)
-                        gen = {
-                            "example_id": example_id,
-                            "generation": response
-                        }
-                        fid.write(json.dumps(gen) + "\n")
-                        fid.flush()
-                        break
-                    except Exception as e:
-                        retries += 1
-                        if retries == 3:
-                            print(f"Failed generation for {example_id} after {self.max_retries} retries, error: {e}")
-                        else:
-                            print(f"Retry {retries}/3 for {example_id}, error: {e}")
-                            time.sleep(5)
\ No newline at end of file
+        with open(self.output_file_path, "w") as fid, \
+                open(self.latency_file_path, "w") as latency_fid, \
+                ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # Only this thread writes to the files, worker threads just generate.
+            def _write(example_id: str, result: Tuple[Optional[str], Optional[Dict[str, Any]]]):
+                response, latency = result
+                if response is None:
+                    return
+                gen = {
+                    "example_id": example_id,
+                    "generation": response
+                }
+                with profiling.example(example_id), profiling.stage("write_output"):
+                    fid.write(json.dumps(gen) + "\n")
+                    fid.flush()
+                    latency_fid.write(json.dumps(latency) + "\n")
+
+            progress = tqdm(total=len(data), desc=self.model_name, position=progress_position)
+            pending = {}
+            reorder_buffer = {}
+            next_to_write = 0
+            next_to_submit = 0
+            while True:
+                while next_to_submit < len(data) and len(pending) + len(reorder_buffer) < max_pending:
+                    pending[executor.submit(_generate_chunk, next_to_submit)] = next_to_submit
+                    next_to_submit += chunk_size
+                if prefetcher is not None:
+                    upcoming = data[next_to_submit:next_to_submit + prefetch]
+                    prefetcher.prefetch(example["media_url"] for example in upcoming)
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start = pending.pop(future)
+                    results = future.result()
+                    progress.update(len(results))
+                    if not ordered:
+                        for index, result in enumerate(results, start):
+                            _write(data[index]["example_id"], result)
+                        continue
+                    reorder_buffer[start] = results
+                    while next_to_write in reorder_buffer:
+                        results = reorder_buffer.pop(next_to_write)
+                        for index, result in enumerate(results, next_to_write):
+                            _write(data[index]["example_id"], result)
+                        next_to_write += len(results)
+            progress.close()
+        if prefetcher is not None:
+            prefetcher.shutdown()
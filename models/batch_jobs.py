@@ -0,0 +1,286 @@
+"""
+Generate with provider batch APIs, as one bulk job instead of many calls.
+
+Batch jobs have higher throughput limits and are cheaper than interactive
+calls, but can take hours to complete. Models supporting them implement
+build_request (the body of one interactive request) and batch_provider.
+Providers limit the number of requests and the size of a job, so a dataset
+is split into as many jobs as needed. Submitted jobs are saved, so that an
+interrupted run can be resumed.
+"""
+
+import io
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .executor import RequestExecutor, RetryPolicy
+
+
+class BatchProvider(ABC):
+    """Submits bulk jobs to a provider's batch API and fetches their results."""
+
+    # Limits of the provider on the requests of a job, and on their size in
+    # bytes, as measured by request_size.
+    max_requests: int = 10_000
+    max_bytes: int = 100 * 1024 * 1024
+
+    def request_size(self, custom_id: str, body: Dict[str, Any]) -> int:
+        """Bytes a request takes in a job."""
+        return len(json.dumps({"custom_id": custom_id, "params": body}).encode("utf-8"))
+
+    @abstractmethod
+    def submit(self, requests: Dict[str, Dict[str, Any]]) -> str:
+        """Submit a job.
+
+        Args:
+            requests: Request bodies, as built by the model's build_request,
+                keyed by custom ids to match them to results
+
+        Returns:
+            str: ID of the submitted job
+        """
+
+    @abstractmethod
+    def is_done(self, job_id: str) -> bool:
+        """Whether the job has finished, successfully or not."""
+
+    @abstractmethod
+    def results(self, job_id: str) -> Dict[str, Optional[str]]:
+        """Get the generated text of a finished job, by custom id.
+
+        Failed requests map to None or are missing.
+        """
+
+
+class OpenAIBatchProvider(BatchProvider):
+    """OpenAI batch API, https://platform.openai.com/docs/guides/batch."""
+
+    max_requests = 50_000
+    max_bytes = 200 * 1024 * 1024
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def _line(custom_id: str, body: Dict[str, Any]) -> str:
+        return json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body})
+
+    def request_size(self, custom_id: str, body: Dict[str, Any]) -> int:
+        # Lines of the input file, with their newline.
+        return len(self._line(custom_id, body).encode("utf-8")) + 1
+
+    def submit(self, requests: Dict[str, Dict[str, Any]]) -> str:
+        lines = [self._line(custom_id, body) for custom_id, body in requests.items()]
+        batch_file = self.client.files.create(
+            file=("batch.jsonl", io.BytesIO("\n".join(lines).encode("utf-8"))),
+            purpose="batch",
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def is_done(self, job_id: str) -> bool:
+        status = self.client.batches.retrieve(job_id).status
+        return status in {"completed", "failed", "expired", "cancelled"}
+
+    def results(self, job_id: str) -> Dict[str, Optional[str]]:
+        batch = self.client.batches.retrieve(job_id)
+        if batch.output_file_id is None:
+            return {}
+        results = {}
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if result.get("error") is None and response.get("status_code") == 200:
+                results[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+            else:
+                results[result["custom_id"]] = None
+        return results
+
+
+class AnthropicBatchProvider(BatchProvider):
+    """Anthropic message batches API, https://docs.anthropic.com/en/docs/build-with-claude/batch-processing."""
+
+    max_requests = 100_000
+    max_bytes = 256 * 1024 * 1024
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, requests: Dict[str, Dict[str, Any]]) -> str:
+        batch = self.client.messages.batches.create(
+            requests=[{"custom_id": custom_id, "params": params} for custom_id, params in requests.items()]
+        )
+        return batch.id
+
+    def is_done(self, job_id: str) -> bool:
+        return self.client.messages.batches.retrieve(job_id).processing_status == "ended"
+
+    def results(self, job_id: str) -> Dict[str, Optional[str]]:
+        results = {}
+        for entry in self.client.messages.batches.results(job_id):
+            if entry.result.type == "succeeded":
+                results[entry.custom_id] = entry.result.message.content[0].text
+            else:
+                results[entry.custom_id] = None
+        return results
+
+
+def split_requests(
+    requests: Dict[str, Dict[str, Any]], provider: BatchProvider
+) -> Iterator[Dict[str, Dict[str, Any]]]:
+    """Split requests, in order, into jobs within the limits of the provider.
+
+    Requests too large for a job of their own are left out.
+    """
+    job: Dict[str, Dict[str, Any]] = {}
+    job_bytes = 0
+    for custom_id, body in requests.items():
+        size = provider.request_size(custom_id, body)
+        if size > provider.max_bytes:
+            print(f"Request {custom_id} is too large for a batch job, {size} bytes.")
+            continue
+        if job and (len(job) >= provider.max_requests or job_bytes + size > provider.max_bytes):
+            yield job
+            job = {}
+            job_bytes = 0
+        job[custom_id] = body
+        job_bytes += size
+    if job:
+        yield job
+
+
+def batch_state_path(output_file_path: str) -> str:
+    """Path of the file keeping track of the batch jobs of a generations file while they run."""
+    return f"{os.path.splitext(output_file_path)[0]}_batch_jobs.json"
+
+
+def _load_state(path: str, data: List[Dict]) -> Dict[str, Any]:
+    """The jobs of an interrupted run for the same dataset, or a new state."""
+    example_ids = [example["example_id"] for example in data]
+    if os.path.isfile(path):
+        with open(path) as fid:
+            state = json.load(fid)
+        if state["example_ids"] == example_ids:
+            print(f"Resuming the batch jobs in {path}.")
+            return state
+        print(f"Ignoring the batch jobs in {path}, which were submitted for another dataset.")
+    return {"example_ids": example_ids, "attempts": 0, "jobs": {}, "generations": {}}
+
+
+def _save_state(path: str, state: Dict[str, Any]):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as fid:
+        json.dump(state, fid)
+    os.replace(tmp_path, path)
+
+
+def run_batch_job(
+    model,
+    data: List[Dict],
+    provider: BatchProvider,
+    max_attempts: int = 3,
+    poll_interval: float = 30,
+    max_poll_interval: float = 600,
+    sleep: Callable[[float], None] = time.sleep,
+    executor: Optional[RequestExecutor] = None,
+):
+    """Generate responses for the dataset with batch jobs and write them out.
+
+    Every example is rendered into jobs, as few as the provider's limits
+    allow, which run side by side. Examples that failed or are missing from
+    the results are re-submitted in new jobs, up to max_attempts times in
+    total. Generations are written to the model's output file in dataset
+    order.
+
+    Submitted jobs and the results collected so far are kept in a file next
+    to the output file, see batch_state_path, until the generations are
+    written. Running again after an interruption waits for the submitted jobs
+    rather than submitting them again.
+
+    Args:
+        model: Model with build_request and output_file_path
+        data: Examples loaded with load_data
+        provider: Batch API to submit jobs to
+        max_attempts: Maximum number of times to submit an example
+        poll_interval: Initial seconds between job status checks
+        max_poll_interval: Seconds between status checks are increased up to
+            this value while the jobs run
+        sleep: Function to wait between status checks
+        executor: Retries failed status checks and result downloads, by
+            default up to 8 times, backing off from poll_interval
+    """
+    if executor is None:
+        executor = RequestExecutor(
+            RetryPolicy(max_attempts=8, base_delay=poll_interval, max_delay=max_poll_interval),
+            sleep=sleep,
+            name=model.model_name,
+        )
+    state_path = batch_state_path(model.output_file_path)
+    state = _load_state(state_path, data)
+    generations = state["generations"]
+    # Providers restrict the characters allowed in custom ids, so use the
+    # position in the dataset rather than the example_id.
+    examples = {f"example-{i}": example for i, example in enumerate(data)}
+    while True:
+        pending = {custom_id: example for custom_id, example in examples.items() if custom_id not in generations}
+        if not state["jobs"]:
+            if not pending or state["attempts"] >= max_attempts:
+                break
+            state["attempts"] += 1
+            requests = {}
+            for custom_id, example in pending.items():
+                try:
+                    requests[custom_id] = model.build_request(example)
+                except Exception as e:
+                    print(f"Failed to build request for {example['example_id']}, error: {e}")
+            for job in split_requests(requests, provider):
+                job_id = provider.submit(job)
+                # Saved straight away, for a rerun to pick the job up.
+                state["jobs"][job_id] = list(job)
+                _save_state(state_path, state)
+                print(f"Submitted batch job {job_id} with {len(job)} requests, attempt {state['attempts']}/{max_attempts}.")
+            if not state["jobs"]:
+                break
+
+        job_ids = list(state["jobs"])
+        interval = poll_interval
+        running = list(job_ids)
+        while True:
+            running = [
+                job_id for job_id in running
+                if not executor.call(provider.is_done, job_id, label=f"batch job {job_id}")
+            ]
+            if not running:
+                break
+            sleep(interval)
+            interval = min(max_poll_interval, interval * 1.5)
+
+        for job_id in job_ids:
+            results = executor.call(provider.results, job_id, label=f"results of batch job {job_id}")
+            for custom_id, text in results.items():
+                if text is not None and custom_id in examples:
+                    generations[custom_id] = text
+            del state["jobs"][job_id]
+            _save_state(state_path, state)
+        pending = {custom_id: example for custom_id, example in pending.items() if custom_id not in generations}
+        print(f"Batch jobs {', '.join(job_ids)} finished, {len(pending)} examples left without a generation.")
+
+    for example in pending.values():
+        print(f"Failed generation for {example['example_id']} after {state['attempts']} batch job attempts")
+    with open(model.output_file_path, "w") as fid:
+        for i, example in enumerate(data):
+            if f"example-{i}" in generations:
+                gen = {
+                    "example_id": example["example_id"],
+                    "generation": generations[f"example-{i}"]
+                }
+                fid.write(json.dumps(gen) + "\n")
+    if os.path.isfile(state_path):
+        os.remove(state_path)
@@ -1,30 +1,26 @@
 """Anthropic Claude vision model implementation."""
-import base64
 import anthropic
 from typing import Dict, Any
 from .base_model import BaseVisionModel
-from .utils import validate_image_url, get_image_data
+from .batch_jobs import AnthropicBatchProvider
+from .image_processing import prepare_image_base64
+from .latency import LatencyTimer
 
 class ClaudeModel(BaseVisionModel):
     """Claude vision model implementation."""
     
+    provider = "anthropic"
+    image_profile = "anthropic"
+
     def __init__(self, model_name: str, api_key: str):
         super().__init__(model_name)
-        self.client = anthropic.Anthropic(api_key=api_key)
+        # Retries are left to self.executor, the SDK's own would stack under them.
+        self.client = anthropic.Anthropic(api_key=api_key, max_retries=0)
 
-    def generate_response(self, example: Dict[str, Any]) -> str:
-        """Generate a response using Claude vision model.
-        
-        Args:
-            example: Dictionary containing media_url and prompt
-            
-        Returns:
-            str: Generated response from Claude
-        """
-        media_type, _ = validate_image_url(example["media_url"])
-        image_data = get_image_data(example["media_url"])
-        
-        message = self.client.messages.create(
+    def build_request(self, example: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the messages request parameters for an example."""
+        media_type, image_base64 = prepare_image_base64(example["media_url"], self.image_profile)
+        return dict(
             model=self.model_name,
             max_tokens=1024,
             messages=[
@@ -36,7 +32,7 @@ class ClaudeModel(BaseVisionModel):
                             "source": {
                                 "type": "base64",
                                 "media_type": media_type,
-                                "data": base64.b64encode(image_data).decode("utf-8"),
+                                "data": image_base64,
                             },
                         },
                         {"type": "text", "text": example["prompt"]},
@@ -44,4 +40,27 @@ class ClaudeModel(BaseVisionModel):
                 }
             ],
         )
-        return message.content[0].text
\ No newline at end of file
+
+    def generate_response(self, example: Dict[str, Any]) -> str:
+        """Generate a response using Claude vision model.
+        
+        Args:
+            example: Dictionary containing media_url and prompt
+            
+        Returns:
+            str: Generated response from Claude
+        """
+        message = self.client.messages.create(**self.build_request(example))
+        return message.content[0].text
+
+    def stream_response(self, example: Dict[str, Any], timer: LatencyTimer) -> str:
+        with self.client.messages.stream(**self.build_request(example)) as stream:
+            for text in stream.text_stream:
+                if text:
+                    timer.first_token()
+            message = stream.get_final_message()
+        timer.output_tokens = message.usage.output_tokens
+        return message.content[0].text
+
+    def batch_provider(self) -> "AnthropicBatchProvider":
+        return AnthropicBatchProvider(self.client)
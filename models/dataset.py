@@ -0,0 +1,188 @@
+"""
+Load the dataset and generations, shared by evaluate.py and the models.
+
+Records are streamed line by line and parsed with orjson when it is
+installed ($ pip install orjson), falling back to the json module otherwise.
+"""
+
+import json
+import os
+from dataclasses import dataclass, field, fields
+from typing import AbstractSet, Any, Dict, Iterator, List, Optional, Set
+
+from . import profiling
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+
+def _with_slots(cls):
+    """Recreate a dataclass with __slots__, like dataclass(slots=True) on Python 3.10+."""
+    names = tuple(f.name for f in fields(cls))
+    namespace = {key: value for key, value in cls.__dict__.items() if key not in names}
+    namespace.pop("__dict__", None)
+    namespace.pop("__weakref__", None)
+    namespace["__slots__"] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+@_with_slots
+@dataclass
+class Example:
+    """An example loaded from vibe-eval, stored as jsonl in the repo."""
+
+    example_id: str
+    category: str
+    prompt: str
+    reference: str
+    media_filename: str
+    media_url: str
+
+    # The fields below are not stored in the dataset, but are populated by evaluate.py.
+    generation: Optional[str] = None
+    score: Optional[int] = None
+    evaluator_explanation: Optional[str] = None
+    # Evaluator that made the final judgement, and with cascaded judging why
+    # the example was escalated to it, if it was.
+    evaluator: Optional[str] = None
+    escalation_reason: Optional[str] = None
+
+
+def iter_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream the JSON objects of a .jsonl file, skipping blank lines."""
+    with open(path, "rb") as fid:
+        for line in fid:
+            if line.strip():
+                yield _loads(line)
+
+
+def iter_examples(path: str) -> Iterator[Example]:
+    """Stream the examples of a dataset or evaluation output .jsonl file."""
+    for record in iter_records(path):
+        yield Example(**record)
+
+
+def load_examples(path: str) -> List[Example]:
+    """Load all the examples of a dataset .jsonl file."""
+    return list(iter_examples(path))
+
+
+class DatasetIndex:
+    """Byte offsets of the examples in a dataset file, by example_id.
+
+    Only the offsets are kept in memory, examples are parsed from the file
+    when looked up. The offsets are cached next to the dataset in
+    <path>.offsets.json, and rebuilt when the dataset's size or modification
+    time changes.
+    """
+
+    def __init__(self, path: str, cache: bool = True):
+        """Build or load the index.
+
+        Args:
+            path: Path of the dataset .jsonl file
+            cache: Read and write the offsets cache file
+        """
+        self.path = path
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        cache_path = f"{path}.offsets.json"
+        self._offsets: Optional[Dict[str, int]] = None
+        if cache and os.path.exists(cache_path):
+            with open(cache_path, "rb") as fid:
+                cached = _loads(fid.read())
+            if cached.get("signature") == signature:
+                self._offsets = cached["offsets"]
+        if self._offsets is None:
+            self._offsets = self._scan()
+            if cache:
+                try:
+                    with open(f"{cache_path}.tmp", "w") as fid:
+                        json.dump({"signature": signature, "offsets": self._offsets}, fid)
+                    os.replace(f"{cache_path}.tmp", cache_path)
+                except OSError as e:
+                    print(f"Failed to write dataset index {cache_path}, error: {e}")
+        self._fid = open(path, "rb")
+
+    def _scan(self) -> Dict[str, int]:
+        offsets = {}
+        with open(self.path, "rb") as fid:
+            offset = 0
+            for line in fid:
+                if line.strip():
+                    offsets[_loads(line)["example_id"]] = offset
+                offset += len(line)
+        return offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __contains__(self, example_id: str) -> bool:
+        return example_id in self._offsets
+
+    def ids(self) -> Iterator[str]:
+        """The example ids, in dataset order."""
+        return iter(self._offsets)
+
+    def get(self, example_id: str) -> Example:
+        """Read an example from the dataset file.
+
+        Raises:
+            KeyError: If the dataset has no example with this id
+        """
+        self._fid.seek(self._offsets[example_id])
+        return Example(**_loads(self._fid.readline()))
+
+    def close(self):
+        self._fid.close()
+
+
+@dataclass
+class Coverage:
+    """How the ids of a generations file match those of the dataset."""
+
+    seen: Set[str] = field(default_factory=set)
+    duplicates: Set[str] = field(default_factory=set)
+    unknown: Set[str] = field(default_factory=set)
+    missing: Set[str] = field(default_factory=set)
+
+
+def join_generations(
+    dataset: DatasetIndex,
+    generations_path: str,
+    skip_ids: AbstractSet[str] = frozenset(),
+    coverage: Optional[Coverage] = None,
+) -> Iterator[Example]:
+    """Stream the dataset examples with their generation set.
+
+    Generations are matched to the dataset as they are read, recording
+    duplicate ids (the first generation is kept), ids not in the dataset
+    (skipped) and, once the file is exhausted, dataset ids without a
+    generation in `coverage`.
+
+    Args:
+        dataset: Index of the dataset
+        generations_path: Path of a .jsonl file with "example_id" and "generation" keys
+        skip_ids: Ids of examples not to yield, e.g. those already evaluated
+        coverage: Filled in with the id coverage while streaming
+    """
+    coverage = coverage if coverage is not None else Coverage()
+    for record in iter_records(generations_path):
+        example_id = record["example_id"]
+        if example_id in coverage.seen:
+            coverage.duplicates.add(example_id)
+            continue
+        coverage.seen.add(example_id)
+        if example_id not in dataset:
+            coverage.unknown.add(example_id)
+            continue
+        if example_id in skip_ids:
+            continue
+        with profiling.stage("dataset_read"):
+            example = dataset.get(example_id)
+        example.generation = record["generation"]
+        yield example
+    coverage.missing = {example_id for example_id in dataset.ids() if example_id not in coverage.seen}
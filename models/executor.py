@@ -0,0 +1,362 @@
+"""
+Send requests to model providers with retries, shared by evaluate.py and the models.
+
+Errors are classified as rate limits, transient errors (5xx and network
+errors), permanent errors (other 4xx) and parse failures, raised as a
+`ParseError`. Permanent errors are not retried, parse failures are retried
+straight away, and the others
+after an exponential backoff with jitter, or after the delay the provider
+asked for in a Retry-After header. A circuit breaker shared by all requests
+to a provider pauses them all while the provider is failing.
+"""
+
+import asyncio
+import contextvars
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+import httpx
+
+from .telemetry import REQUESTS, RETRIES
+
+
+class ErrorKind(Enum):
+    RATE_LIMIT = "rate limit"
+    TRANSIENT = "transient"
+    PERMANENT = "permanent"
+    PARSE = "parse"
+
+
+class ParseError(ValueError):
+    """A response that couldn't be parsed, e.g. an evaluator response without a rating."""
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    """HTTP status of an error from any of the provider SDKs, requests or httpx."""
+    for obj in (error, getattr(error, "response", None)):
+        for attr in ("status_code", "status", "code"):
+            value = getattr(obj, attr, None)
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+    return None
+
+
+def classify_error(error: BaseException) -> ErrorKind:
+    """Decide whether and how an error should be retried.
+
+    Errors without an HTTP status are treated as transient, except
+    `ParseError`s, which are parse failures, and other ValueErrors, which
+    are usually raised for bad input that would fail again, so are
+    permanent. Malformed JSON, e.g. of a truncated response, is transient.
+    """
+    status = _status_code(error)
+    if status is not None:
+        if status == 429:
+            return ErrorKind.RATE_LIMIT
+        if status in (408, 409, 425) or status >= 500:
+            return ErrorKind.TRANSIENT
+        if status >= 400:
+            return ErrorKind.PERMANENT
+    if isinstance(error, ParseError):
+        return ErrorKind.PARSE
+    if isinstance(error, ValueError) and not isinstance(error, json.JSONDecodeError):
+        return ErrorKind.PERMANENT
+    return ErrorKind.TRANSIENT
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Seconds to wait before retrying, from the Retry-After headers of an error's response."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "headers", None)
+    if not headers:
+        return None
+    headers = {str(key).lower(): value for key, value in dict(headers).items()}
+    try:
+        if "retry-after-ms" in headers:
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Headers of the last error response of the running task or thread, for SDKs
+# whose errors don't keep them, see keep_error_headers_client.
+_ERROR_HEADERS: contextvars.ContextVar = contextvars.ContextVar("error_response_headers", default=None)
+
+
+def _keep_error_headers(response: httpx.Response):
+    if response.is_error:
+        _ERROR_HEADERS.set(response.headers)
+
+
+async def _keep_error_headers_async(response: httpx.Response):
+    _keep_error_headers(response)
+
+
+def keep_error_headers_client(
+    asynchronous: bool = False, timeout: float = 300, **kwargs
+) -> Union[httpx.Client, httpx.AsyncClient]:
+    """An httpx client for SDKs whose errors don't keep the response headers, like the Reka SDK's ApiError.
+
+    RequestExecutor attaches the headers of the last error response to the
+    error of a failed attempt, so that retry_after_seconds can read them:
+
+        Reka(api_key=..., timeout=300, httpx_client=keep_error_headers_client())
+
+    Other keyword arguments, e.g. transport, are passed on to the httpx client.
+    """
+    if asynchronous:
+        return httpx.AsyncClient(
+            timeout=timeout, follow_redirects=True, event_hooks={"response": [_keep_error_headers_async]}, **kwargs
+        )
+    return httpx.Client(
+        timeout=timeout, follow_redirects=True, event_hooks={"response": [_keep_error_headers]}, **kwargs
+    )
+
+
+def _attach_error_headers(error: BaseException):
+    headers = _ERROR_HEADERS.get()
+    if headers is None or getattr(getattr(error, "response", None), "headers", None) or getattr(error, "headers", None):
+        return
+    try:
+        error.headers = headers
+    except AttributeError:
+        pass
+
+
+def describe_error(error: BaseException) -> str:
+    """String representation of the exception chain."""
+    chain = [error]
+    while chain[-1].__cause__ is not None:
+        chain.append(chain[-1].__cause__)
+    return " <- ".join(repr(e) for e in chain)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How often and after how long to retry failed requests."""
+
+    max_attempts: int = 5
+    # Backoff after transient errors: base_delay * 2**(attempt - 1), capped
+    # at max_delay, of which a random half is jitter.
+    base_delay: float = 1.0
+    max_delay: float = 120.0
+    # Same for rate limits, when the response has no Retry-After header.
+    rate_limit_delay: float = 10.0
+    retry_parse_errors: bool = True
+
+    def should_retry(self, kind: ErrorKind, attempt: int) -> bool:
+        if attempt >= self.max_attempts or kind is ErrorKind.PERMANENT:
+            return False
+        return kind is not ErrorKind.PARSE or self.retry_parse_errors
+
+    def delay(self, kind: ErrorKind, attempt: int, retry_after: Optional[float] = None) -> float:
+        if kind is ErrorKind.PARSE:
+            return 0.0
+        if retry_after is not None:
+            return retry_after
+        base = self.rate_limit_delay if kind is ErrorKind.RATE_LIMIT else self.base_delay
+        delay = min(self.max_delay, base * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+class CircuitBreaker:
+    """Pauses all requests to a provider while it is failing.
+
+    Opens after failure_threshold consecutive rate limit or transient errors,
+    pausing requests for cooldown seconds. The first request after that
+    decides: a success closes the breaker, a failure opens it again straight
+    away with twice the cooldown, up to max_cooldown.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        cooldown: float = 30.0,
+        max_cooldown: float = 600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._cooldown = cooldown
+        self._open_until = 0.0
+        self._half_open = False
+
+    def wait_time(self) -> float:
+        """Seconds until requests may be sent again, 0 if the breaker is closed."""
+        with self._lock:
+            return max(0.0, self._open_until - self._clock())
+
+    def reset(self):
+        """Close the breaker and forget past failures, e.g. between benchmark runs."""
+        with self._lock:
+            self._failures = 0
+            self._cooldown = self.base_cooldown
+            self._open_until = 0.0
+            self._half_open = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._cooldown = self.base_cooldown
+            self._half_open = False
+
+    def record_failure(self, kind: ErrorKind):
+        if kind not in (ErrorKind.RATE_LIMIT, ErrorKind.TRANSIENT):
+            return
+        with self._lock:
+            now = self._clock()
+            if now < self._open_until:
+                # Requests sent before the breaker opened.
+                return
+            self._failures += 1
+            if self._half_open or self._failures >= self.failure_threshold:
+                self._open_until = now + self._cooldown
+                print(
+                    f"{self.name} is failing, pausing requests for {self._cooldown:.0f}s.",
+                    file=sys.stderr,
+                )
+                self._cooldown = min(self.max_cooldown, 2 * self._cooldown)
+                self._failures = 0
+                self._half_open = True
+
+    def pause(self, seconds: float):
+        """Hold all requests for at least this long, e.g. as asked by Retry-After."""
+        with self._lock:
+            self._open_until = max(self._open_until, self._clock() + seconds)
+
+
+_CIRCUIT_BREAKERS: Dict[str, CircuitBreaker] = {}
+_CIRCUIT_BREAKERS_LOCK = threading.Lock()
+
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    """Get the circuit breaker shared by every client of a provider."""
+    with _CIRCUIT_BREAKERS_LOCK:
+        if provider not in _CIRCUIT_BREAKERS:
+            _CIRCUIT_BREAKERS[provider] = CircuitBreaker(provider)
+        return _CIRCUIT_BREAKERS[provider]
+
+
+class RequestExecutor:
+    """Calls functions making requests, retrying them according to a RetryPolicy."""
+
+    def __init__(
+        self,
+        policy: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        sleep: Optional[Callable[[float], None]] = None,
+        name: str = "request",
+    ):
+        """Initialize the executor.
+
+        Args:
+            policy: When to retry, defaults to RetryPolicy()
+            breaker: Circuit breaker of the provider, none if not given
+            sleep: Function to wait with in call, defaults to time.sleep
+            name: Model the requests are made to, labelling their telemetry
+        """
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker
+        self._sleep = sleep
+        self.name = name
+
+    def record_outcome(self, error: Optional[Exception] = None) -> Optional[ErrorKind]:
+        """Record the outcome of a request made without call or call_async, e.g. one of a batch.
+
+        Args:
+            error: Error the request failed with, None if it succeeded
+
+        Returns:
+            The kind of the error, None if the request succeeded
+        """
+        if error is None:
+            REQUESTS.inc(model=self.name, outcome="ok")
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return None
+        _attach_error_headers(error)
+        kind = classify_error(error)
+        REQUESTS.inc(model=self.name, outcome=kind.value)
+        if self.breaker is not None:
+            self.breaker.record_failure(kind)
+            retry_after = retry_after_seconds(error)
+            if retry_after is not None and kind is not ErrorKind.PERMANENT:
+                self.breaker.pause(retry_after)
+        return kind
+
+    def _retry_delay(self, error: Exception, attempt: int, label: str) -> Optional[float]:
+        """Record a failed attempt, returning how long to wait before the next, or None to give up."""
+        kind = self.record_outcome(error)
+        retry_after = retry_after_seconds(error)
+        if not self.policy.should_retry(kind, attempt):
+            return None
+        delay = self.policy.delay(kind, attempt, retry_after)
+        RETRIES.inc(model=self.name, error=kind.value)
+        print(
+            f"Hit {kind.value} error on {label}: {describe_error(error)}. "
+            f"Attempt {attempt} of {self.policy.max_attempts}, retrying in {delay:.1f}s.",
+            file=sys.stderr,
+        )
+        return delay
+
+    def call(self, fn: Callable[..., Any], *args, label: str = "request", **kwargs) -> Any:
+        """Call fn(*args, **kwargs), retrying failures.
+
+        Raises:
+            The last error, if it isn't retried or every attempt failed
+        """
+        sleep = self._sleep or time.sleep
+        attempt = 0
+        while True:
+            if self.breaker is not None and self.breaker.wait_time() > 0:
+                sleep(self.breaker.wait_time())
+            attempt += 1
+            _ERROR_HEADERS.set(None)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, label)
+                if delay is None:
+                    raise
+                sleep(delay)
+            else:
+                self.record_outcome()
+                return result
+
+    async def call_async(self, fn: Callable[..., Awaitable[Any]], *args, label: str = "request", **kwargs) -> Any:
+        """Same as call, for coroutine functions."""
+        attempt = 0
+        while True:
+            if self.breaker is not None and self.breaker.wait_time() > 0:
+                await asyncio.sleep(self.breaker.wait_time())
+            attempt += 1
+            _ERROR_HEADERS.set(None)
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, label)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+            else:
+                self.record_outcome()
+                return result
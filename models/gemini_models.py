@@ -2,32 +2,51 @@
 $ pip install -q -U google-generativeai
 """
 
-import base64
 import google.generativeai as genai
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from .base_model import BaseVisionModel
-from .utils import RateLimiter, validate_image_url, get_image_data
+from .image_processing import prepare_image_base64
+from .latency import LatencyTimer
+from .utils import get_rate_limiter
 
 class GeminiModel(BaseVisionModel):
-    def __init__(self, model_name: str, api_key: str):
+    provider = "gemini"
+    image_profile = "gemini"
+
+    def __init__(
+        self,
+        model_name: str,
+        api_key: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
         super().__init__(model_name)
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(model_name=model_name)
-        self.rate_limiter = RateLimiter(max_requests=10, time_window=60)
+        self.rate_limiter = get_rate_limiter(
+            self.provider, requests_per_minute, tokens_per_minute
+        )
+
+    def _contents(self, example: Dict[str, Any]) -> List[Any]:
+        media_type, image_base64 = prepare_image_base64(example["media_url"], self.image_profile)
+        return [
+            {
+                "mime_type": media_type,
+                "data": image_base64,
+            },
+            example["prompt"],
+        ]
 
     def generate_response(self, example: Dict[str, Any]) -> str:
-        self.rate_limiter.wait_if_needed()
-        
-        media_type, _ = validate_image_url(example["media_url"])
-        image_data = get_image_data(example["media_url"])
-        
-        response = self.model.generate_content(
-            [
-                {
-                    "mime_type": media_type,
-                    "data": base64.b64encode(image_data).decode("utf-8"),
-                },
-                example["prompt"],
-            ]
-        )
-        return response.text
\ No newline at end of file
+        response = self.model.generate_content(self._contents(example))
+        return response.text
+
+    def stream_response(self, example: Dict[str, Any], timer: LatencyTimer) -> str:
+        response = self.model.generate_content(self._contents(example), stream=True)
+        chunks = []
+        for chunk in response:
+            if chunk.text:
+                timer.first_token()
+                chunks.append(chunk.text)
+        timer.output_tokens = response.usage_metadata.candidates_token_count
+        return "".join(chunks)
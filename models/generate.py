@@ -14,37 +14,74 @@ Examples
     # Run Claude model
     python main.py --model claude-3-opus-20240229 --data_path data/vibe-eval.v1.jsonl
 
-    # Run Pixtral server
-    python main.py --model mistralai/Pixtral-Large-Instruct-2411 --server_url localhost --server_port 8000
+    # Run Pixtral server, keeping 128 requests in flight
+    python main.py --model mistralai/Pixtral-Large-Instruct-2411 --server_url localhost --server_port 8000 --max_in_flight 128 --concurrency 2
 
     # Run X.AI model
     python main.py --model xai-vision --api_key YOUR_API_KEY
+
+    # Download all dataset images into the local cache ahead of a run,
+    # resizing them to fit Anthropic's limits
+    python main.py --prefetch_only --image_profile anthropic
+
+    # Run OpenAI model as a bulk job with the batch API
+    python main.py --model gpt-4o-2024-11-20 --batch
+
+    # Run several models at once, sharing the dataset and images
+    python main.py --model gpt-4o-2024-11-20,claude-3-5-sonnet-20241022,gemini-1.5-pro-002 --concurrency 8
+    python main.py --config models.json
+
+    # Run Claude model with 8 requests in flight, keeping dataset order
+    python main.py --model claude-3-5-sonnet-20241022 --concurrency 8 --ordered
+
+    # Stream responses to record time to first token, then summarise latency
+    python main.py --model gpt-4o-2024-11-20 --stream
+    python -m models.latency data/generations
+
+    # Profile where the time goes, per pipeline stage and with cProfile
+    python main.py --model claude-3-5-sonnet-20241022 --concurrency 8 --profile data/profiles/claude
 """
 
 import argparse
+import functools
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+from tqdm import tqdm
+from models import profiling
+from models.base_model import BaseVisionModel
+from models.batch_jobs import run_batch_job
+from models.dataset import iter_records
+from models.image_processing import configure_image_normalizer, load_profiles, prepare_image
+from models.telemetry import serve_metrics, write_report
+from models.utils import ImagePrefetcher, configure_image_bundle, configure_image_cache, get_image_data
 
 def get_model(args):
     """Initialize the appropriate model based on arguments."""
     
-    api_key = args.api_key
+    def _api_key(env_var: str):
+        return args.api_key or os.environ.get(env_var)
 
     # OpenAI models
     if args.model.startswith(("gpt-4", "o1")):
-        if not api_key:
-            api_key = os.environ.get("OPENAI_API_KEY")
         from models.openai_models import OpenAIModel
-        return OpenAIModel(args.model, api_key=api_key)
+        return OpenAIModel(args.model, api_key=_api_key("OPENAI_API_KEY"))
     
     # Gemini models
     elif args.model.startswith("gemini"):
         from models.gemini_models import GeminiModel
-        return GeminiModel(args.model)
+        return GeminiModel(
+            args.model,
+            api_key=_api_key("GEMINI_API_KEY"),
+            requests_per_minute=args.rpm,
+            tokens_per_minute=args.tpm,
+        )
     
     # Claude models
     elif args.model.startswith("claude"):
         from models.claude_models import ClaudeModel
-        return ClaudeModel(args.model)
+        return ClaudeModel(args.model, api_key=_api_key("ANTHROPIC_API_KEY"))
     
     # Pixtral models
     elif "pixtral" in args.model.lower():
@@ -53,31 +90,109 @@ def get_model(args):
             return PixtralServer(
                 args.model,
                 server_url=args.server_url,
-                server_port=args.server_port
+                server_port=args.server_port,
+                max_in_flight=args.max_in_flight,
+                stream=args.stream,
+                system_prompt_path=args.system_prompt_path,
             )
         from models.pixtral_models import PixtralModel
-        return PixtralModel(args.model)
+        return PixtralModel(args.model, batch_size=args.batch_size)
     
     # X.AI models
     elif args.model.startswith("grok"):
         from models.xai_models import XAIModel
-        return XAIModel(args.model, api_key=args.api_key)
+        return XAIModel(
+            args.model,
+            api_key=_api_key("XAI_API_KEY"),
+            requests_per_minute=args.rpm,
+            tokens_per_minute=args.tpm,
+        )
     
     # Reka models
     elif args.model.startswith("reka"):
         from models.reka_models import RekaModel
-        return RekaModel(args.model)
+        return RekaModel(args.model, api_key=_api_key("REKA_API_KEY"))
     
     else:
         raise ValueError(f"Unknown model: {args.model}")
 
+def get_model_args(args) -> List[argparse.Namespace]:
+    """Split arguments into one set per model.
+    
+    Models come from a comma separated --model, or from a --config JSON file
+    listing model names or objects overriding arguments for that model, e.g.
+    [{"model": "gemini-1.5-pro-002", "rpm": 60}, "claude-3-opus-20240229"]
+    """
+    if args.config:
+        with open(args.config, "r") as fid:
+            entries = json.load(fid)
+    else:
+        entries = [name.strip() for name in args.model.split(",") if name.strip()]
+    model_args = []
+    for entry in entries:
+        overrides = {"model": entry} if isinstance(entry, str) else entry
+        model_args.append(argparse.Namespace(**{**vars(args), **overrides}))
+    return model_args
+
+def run_models(models: List[BaseVisionModel], data: List[Dict], model_args: List[argparse.Namespace]):
+    """Run several models at once over the same data.
+    
+    Each model generates on its own worker pool, so the providers' requests are
+    interleaved and each provider is only held back by its own rate limiter.
+    
+    Args:
+        models: Models to run
+        data: Examples loaded from the dataset, shared by all models
+        model_args: Arguments for each model, from get_model_args
+    """
+    with ThreadPoolExecutor(max_workers=len(models)) as executor:
+        futures = {
+            executor.submit(
+                model.process_data,
+                data,
+                concurrency=margs.concurrency,
+                ordered=margs.ordered,
+                prefetch=margs.prefetch,
+                progress_position=position,
+            ): model
+            for position, (model, margs) in enumerate(zip(models, model_args))
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed generation with {futures[future].model_name}, error: {e}")
+
+def prefetch_images(data_path: str, image_profile: Optional[str] = None, num_workers: int = 16):
+    """Download the images of every example into the image cache.
+    
+    If image_profile is given, the images are also normalized for it.
+    """
+    media_urls = [record["media_url"] for record in iter_records(data_path)]
+    fetch = get_image_data
+    if image_profile is not None:
+        fetch = functools.partial(prepare_image, profile_name=image_profile)
+    prefetcher = ImagePrefetcher(num_workers=num_workers, fetch=fetch)
+    futures = prefetcher.prefetch(media_urls)
+    failed = 0
+    for future in tqdm(as_completed(futures), total=len(futures)):
+        if future.exception() is not None:
+            print(f"Failed to prefetch image: {future.exception()}")
+            failed += 1
+    prefetcher.shutdown()
+    print(f"Prefetched {len(futures) - failed}/{len(futures)} images.")
+
 def main():
     parser = argparse.ArgumentParser(description="Run vision models on evaluation data")
     
     parser.add_argument(
         "--model",
-        required=True,
-        help="Model name/identifier"
+        help="Model name/identifier, or several comma separated ones to run at once"
+    )
+    parser.add_argument(
+        "--config",
+        default=None,
+        help="JSON file listing models to run at once, with optional per-model arguments"
     )
     parser.add_argument(
         "--data_path",
@@ -99,21 +214,173 @@ def main():
         default="8000",
         help="Server port for Pixtral server"
     )
+    parser.add_argument(
+        "--max_in_flight",
+        type=int,
+        default=64,
+        help="Maximum number of concurrent requests to the Pixtral server"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream responses, recording the time to first token in the latency file next to the generations"
+    )
+    parser.add_argument(
+        "--system_prompt_path",
+        default=None,
+        help="Local SYSTEM_PROMPT.txt for the Pixtral server, instead of downloading it from the hub"
+    )
+    parser.add_argument(
+        "--rpm",
+        type=float,
+        default=None,
+        help="Requests per minute budget, defaults to <PROVIDER>_RPM env variable or the provider default"
+    )
+    parser.add_argument(
+        "--tpm",
+        type=float,
+        default=None,
+        help="Estimated tokens per minute budget, defaults to <PROVIDER>_TPM env variable if set"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of examples to generate in parallel"
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Generate with the provider's batch API as bulk jobs (OpenAI and Claude models)"
+    )
+    parser.add_argument(
+        "--batch_poll_interval",
+        type=float,
+        default=30,
+        help="Initial seconds between batch job status checks, backing off while the job runs"
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=64,
+        help="Number of examples per call for models generating in batches (Pixtral with vLLM)"
+    )
+    parser.add_argument(
+        "--ordered",
+        action="store_true",
+        help="With --concurrency, write generations in dataset order"
+    )
+    parser.add_argument(
+        "--image_cache_dir",
+        default="data/cache/images",
+        help="Directory to cache downloaded images in, empty to disable caching"
+    )
+    parser.add_argument(
+        "--image_bundle",
+        default="data/vibe-eval.v1.bundle",
+        help="Packed image bundle to read images from when it exists, see models/image_bundle.py"
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=8,
+        help="Number of upcoming examples to download images for in the background"
+    )
+    parser.add_argument(
+        "--prefetch_only",
+        action="store_true",
+        help="Only download the dataset images into --image_cache_dir, then exit"
+    )
+    parser.add_argument(
+        "--image_profile",
+        default=None,
+        help="With --prefetch_only, also normalize images for this profile, e.g. anthropic"
+    )
+    parser.add_argument(
+        "--image_profiles",
+        default=None,
+        help="JSON file adding or overriding image profiles, e.g. {\"anthropic\": {\"max_side\": 1568}}"
+    )
+    parser.add_argument(
+        "--normalized_image_cache_dir",
+        default="data/cache/normalized_images",
+        help="Directory to cache images normalized for provider limits in, empty to disable caching"
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=None,
+        help="Serve telemetry in the Prometheus text format on http://127.0.0.1:<port>/metrics while generating"
+    )
+    parser.add_argument(
+        "--image_workers",
+        type=int,
+        default=None,
+        help="Number of processes normalizing images, defaults to the CPU count"
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=profiling.default_profile_dir("generate"),
+        default=None,
+        help="Time each pipeline stage per example and profile the run with cProfile, tracemalloc and a sampling "
+             "profiler, writing the results to this directory (data/profiles/generate-<time> if no directory is "
+             "given), see models/profiling.py"
+    )
 
     args = parser.parse_args()
+    if not args.model and not args.config and not args.prefetch_only:
+        parser.error("--model or --config is required")
 
-    # Set API keys from environment if not provided
-    if not args.api_key:
-        if "OPENAI_API_KEY" in os.environ:
-            args.api_key = os.environ["OPENAI_API_KEY"]
-        elif "XAI_API_KEY" in os.environ:
-            args.api_key = os.environ["XAI_API_KEY"]
+    configure_image_cache(args.image_cache_dir)
+    if args.image_bundle and os.path.isfile(args.image_bundle):
+        configure_image_bundle(args.image_bundle)
+    if args.image_profiles:
+        load_profiles(args.image_profiles)
+    configure_image_normalizer(args.normalized_image_cache_dir, args.image_workers)
+    if args.prefetch_only:
+        prefetch_images(args.data_path, image_profile=args.image_profile)
+        return
 
-    # Initialize model
-    model = get_model(args)
+    if args.metrics_port is not None:
+        serve_metrics(args.metrics_port)
+    if args.profile is not None:
+        profiling.start_profiling(args.profile)
+
+    # Initialize models
+    model_args = get_model_args(args)
+    models = [get_model(margs) for margs in model_args]
+    for model, margs in zip(models, model_args):
+        if margs.stream and not margs.batch:
+            if not model.supports_streaming:
+                parser.error(f"{type(model).__name__} does not support --stream")
+            model.stream = True
     
     # Process examples
-    model.process_examples(args.data_path)
+    try:
+        if args.batch:
+            data = models[0].load_data(args.data_path)
+            for model in models:
+                run_batch_job(model, data, model.batch_provider(), poll_interval=args.batch_poll_interval)
+        elif len(models) == 1:
+            models[0].process_examples(
+                args.data_path,
+                concurrency=model_args[0].concurrency,
+                ordered=model_args[0].ordered,
+                prefetch=model_args[0].prefetch,
+            )
+        else:
+            data = models[0].load_data(args.data_path)
+            run_models(models, data, model_args)
+    finally:
+        # Also written when interrupted, to profile part of a long run.
+        stage_table = profiling.stop_profiling()
+        if stage_table is not None:
+            print(stage_table)
+            print(f"Profile written to {args.profile}")
+    # The telemetry covers every model run by this process, labelled by model.
+    for model in models:
+        write_report(model.telemetry_file_path)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
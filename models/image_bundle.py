@@ -0,0 +1,185 @@
+"""
+Pack the dataset images into a single file, read back zero-copy with mmap.
+
+The bundle is a shard of concatenated images, optionally followed by their
+base64 encodings, plus a JSON index (<bundle>.index.json) giving the offset,
+length, content hash, media type and size of each image by example_id,
+media_filename and media_url.
+
+Usage:
+    # From the images in the release artifact
+    python -m models.image_bundle --images_dir images -o data/vibe-eval.v1.bundle
+
+    # Downloading the images, and storing their base64 encodings too
+    python -m models.image_bundle --base64 -o data/vibe-eval.v1.bundle
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import mmap
+import os
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional
+from tqdm import tqdm
+from .dataset import iter_records
+from .image_processing import sniff_media_type
+from .utils import get_image_data
+
+
+@dataclass(frozen=True)
+class BundleEntry:
+    """Location and metadata of one image in a bundle."""
+
+    example_id: str
+    media_filename: str
+    media_url: str
+    offset: int
+    length: int
+    sha256: str
+    media_type: Optional[str]
+    width: Optional[int] = None
+    height: Optional[int] = None
+    base64_offset: Optional[int] = None
+    base64_length: Optional[int] = None
+
+
+class ImageBundle:
+    """Read-only view of a packed image bundle."""
+
+    def __init__(self, path: str):
+        """Open a bundle.
+
+        Args:
+            path: Path of the bundle shard, with its index next to it
+        """
+        self.path = path
+        with open(f"{path}.index.json", "r") as fid:
+            entries = [BundleEntry(**entry) for entry in json.load(fid)["entries"]]
+        self._entries: Dict[str, BundleEntry] = {}
+        for entry in entries:
+            self._entries[entry.example_id] = entry
+            self._entries[entry.media_filename] = entry
+            self._entries[entry.media_url] = entry
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+    def lookup(self, key: str) -> Optional[BundleEntry]:
+        """Find an image by example_id, media_filename or media_url."""
+        return self._entries.get(key)
+
+    def read(self, entry: BundleEntry) -> memoryview:
+        """Get the image bytes, without copying them out of the mapping."""
+        return self._view[entry.offset:entry.offset + entry.length]
+
+    def read_base64(self, entry: BundleEntry) -> Optional[memoryview]:
+        """Get the pre-computed base64 encoding, if the bundle has one."""
+        if entry.base64_offset is None:
+            return None
+        return self._view[entry.base64_offset:entry.base64_offset + entry.base64_length]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+
+def _image_size(data: bytes):
+    try:
+        from PIL import Image
+    except ImportError:
+        return None, None
+    return Image.open(io.BytesIO(data)).size
+
+
+def pack_bundle(
+    data_path: str,
+    bundle_path: str,
+    images_dir: Optional[str] = None,
+    include_base64: bool = False,
+):
+    """Pack the images of every example in a dataset into a bundle.
+
+    Args:
+        data_path: Path of the dataset .jsonl file
+        bundle_path: Path to write the bundle shard to
+        images_dir: Directory with the images named by media_filename, e.g.
+            from the release artifact. Images are downloaded if not given
+        include_base64: Also store the base64 encoding of every image
+    """
+    examples = list(iter_records(data_path))
+
+    entries = []
+    offset = 0
+    with open(f"{bundle_path}.tmp", "wb") as out:
+        for example in tqdm(examples):
+            if images_dir is not None:
+                with open(os.path.join(images_dir, example["media_filename"]), "rb") as fid:
+                    data = fid.read()
+            else:
+                data = bytes(get_image_data(example["media_url"]))
+            width, height = _image_size(data)
+            out.write(data)
+            entries.append(
+                BundleEntry(
+                    example_id=example["example_id"],
+                    media_filename=example["media_filename"],
+                    media_url=example["media_url"],
+                    offset=offset,
+                    length=len(data),
+                    sha256=hashlib.sha256(data).hexdigest(),
+                    media_type=sniff_media_type(data),
+                    width=width,
+                    height=height,
+                )
+            )
+            offset += len(data)
+
+        if include_base64:
+            out.flush()
+            with open(f"{bundle_path}.tmp", "rb") as images:
+                for i, entry in enumerate(entries):
+                    images.seek(entry.offset)
+                    encoded = base64.b64encode(images.read(entry.length))
+                    out.write(encoded)
+                    entries[i] = BundleEntry(
+                        **{**asdict(entry), "base64_offset": offset, "base64_length": len(encoded)}
+                    )
+                    offset += len(encoded)
+
+    with open(f"{bundle_path}.index.json.tmp", "w") as fid:
+        json.dump({"entries": [asdict(entry) for entry in entries]}, fid)
+    os.replace(f"{bundle_path}.tmp", bundle_path)
+    os.replace(f"{bundle_path}.index.json.tmp", f"{bundle_path}.index.json")
+    print(f"Packed {len(entries)} images ({offset} bytes) into {bundle_path}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack dataset images into a bundle")
+    parser.add_argument(
+        "--data_path",
+        default="data/vibe-eval.v1.jsonl",
+        help="Path to evaluation data"
+    )
+    parser.add_argument(
+        "--images_dir",
+        default=None,
+        help="Directory of images named by media_filename, images are downloaded if not set"
+    )
+    parser.add_argument(
+        "--base64",
+        action="store_true",
+        help="Also store base64 encoded images, for models uploading base64 data"
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        default="data/vibe-eval.v1.bundle",
+        help="Path of the bundle to write"
+    )
+    args = parser.parse_args()
+    pack_bundle(args.data_path, args.output, args.images_dir, args.base64)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Normalize images to fit provider limits on format, bytes and pixels.
+
+$ pip install pillow
+"""
+
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, FrozenSet, Optional, Tuple, Union
+from . import profiling
+from .telemetry import BYTES_UPLOADED
+from .utils import get_image_bundle, get_image_data
+
+_MAGIC_BYTES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+
+def sniff_media_type(data: Union[bytes, memoryview]) -> Optional[str]:
+    """Detect the media type of an image from its first bytes.
+
+    Args:
+        data: Raw image data
+
+    Returns:
+        The media type, e.g. "image/png", or None if it isn't recognised
+    """
+    header = bytes(data[:16])
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    for magic, media_type in _MAGIC_BYTES:
+        if header.startswith(magic):
+            return media_type
+    return None
+
+
+@dataclass(frozen=True)
+class ImageProfile:
+    """Limits a provider places on uploaded images."""
+
+    name: str
+    max_bytes: int
+    max_side: int
+    media_types: FrozenSet[str] = frozenset({"image/jpeg", "image/png"})
+    jpeg_quality: int = 90
+
+    @property
+    def key(self) -> str:
+        """Identifies the profile and its limits, for cache keys."""
+        params = asdict(self)
+        params["media_types"] = sorted(self.media_types)
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        return f"{self.name}-{digest[:12]}"
+
+
+PROFILES: Dict[str, ImageProfile] = {
+    # Anthropic limits base64 encoded images to 5MB, i.e. 3.75MB of raw bytes.
+    "anthropic": ImageProfile(
+        name="anthropic",
+        max_bytes=5 * 1024 * 1024 * 3 // 4,
+        max_side=8000,
+        media_types=frozenset({"image/jpeg", "image/png", "image/gif", "image/webp"}),
+    ),
+    # Gemini limits inline requests to 20MB, leave room for the base64 overhead.
+    "gemini": ImageProfile(
+        name="gemini",
+        max_bytes=14 * 1024 * 1024,
+        max_side=3072,
+        media_types=frozenset({"image/jpeg", "image/png", "image/webp"}),
+    ),
+    "openai": ImageProfile(
+        name="openai",
+        max_bytes=20 * 1024 * 1024,
+        max_side=2048,
+        media_types=frozenset({"image/jpeg", "image/png", "image/gif", "image/webp"}),
+    ),
+}
+
+
+def load_profiles(path: str):
+    """Add or override profiles from a JSON file.
+
+    Args:
+        path: JSON file mapping profile names to ImageProfile fields, e.g.
+            {"anthropic": {"max_bytes": 3000000, "max_side": 1568}}
+    """
+    with open(path, "r") as fid:
+        overrides = json.load(fid)
+    for name, fields in overrides.items():
+        base = asdict(PROFILES[name]) if name in PROFILES else {}
+        base.update(fields, name=name)
+        base["media_types"] = frozenset(base.get("media_types", ImageProfile.media_types))
+        PROFILES[name] = ImageProfile(**base)
+
+
+def normalize_image(data: Union[bytes, memoryview], profile: ImageProfile) -> Tuple[str, bytes]:
+    """Transcode or downscale an image so it fits within a profile's limits.
+
+    Images already in a supported format and within the limits are returned
+    unchanged. Others are re-encoded as PNG if they are small enough and have
+    transparency, and as JPEG otherwise, lowering quality and then resolution
+    until they fit.
+
+    Args:
+        data: Raw image data
+        profile: Limits to fit within
+
+    Returns:
+        Tuple of (media_type, image data)
+    """
+    from PIL import Image
+
+    media_type = sniff_media_type(data)
+    image = Image.open(io.BytesIO(data))
+    if (
+        media_type in profile.media_types
+        and len(data) <= profile.max_bytes
+        and max(image.size) <= profile.max_side
+    ):
+        return media_type, data
+
+    image.load()
+    if max(image.size) > profile.max_side:
+        image.thumbnail((profile.max_side, profile.max_side), Image.LANCZOS)
+
+    if image.mode in ("RGBA", "LA", "P") and "image/png" in profile.media_types:
+        out = io.BytesIO()
+        image.save(out, format="PNG", optimize=True)
+        if out.tell() <= profile.max_bytes:
+            return "image/png", out.getvalue()
+
+    image = image.convert("RGB")
+    quality = profile.jpeg_quality
+    while True:
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=quality, optimize=True)
+        if out.tell() <= profile.max_bytes:
+            return "image/jpeg", out.getvalue()
+        if quality > 60:
+            quality -= 10
+        else:
+            image = image.resize((max(1, image.width * 3 // 4), max(1, image.height * 3 // 4)), Image.LANCZOS)
+
+
+_EXTENSIONS = {
+    "image/jpeg": "jpeg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/bmp": "bmp",
+}
+
+
+class ImageNormalizer:
+    """Normalizes images on a process pool, caching the results on disk.
+
+    Results are stored under `<cache_dir>/<profile key>/<image hash>.<ext>`,
+    so each image is only normalized once per profile.
+    """
+
+    def __init__(self, cache_dir: str, num_workers: Optional[int] = None):
+        """Initialize the normalizer.
+
+        Args:
+            cache_dir: Directory to cache normalized images in
+            num_workers: Number of worker processes, defaults to the CPU count
+        """
+        self.cache_dir = Path(cache_dir)
+        self._executor = ProcessPoolExecutor(max_workers=num_workers)
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], Future] = {}
+
+    def _lookup(self, profile_dir: Path, image_hash: str) -> Optional[Tuple[str, bytes]]:
+        for media_type, ext in _EXTENSIONS.items():
+            path = profile_dir / f"{image_hash}.{ext}"
+            if path.exists():
+                return media_type, path.read_bytes()
+        return None
+
+    def normalize(self, data: Union[bytes, memoryview], profile: ImageProfile) -> Tuple[str, bytes]:
+        """Normalize an image, or get the cached result.
+
+        Args:
+            data: Raw image data
+            profile: Limits to fit within
+
+        Returns:
+            Tuple of (media_type, image data)
+        """
+        image_hash = hashlib.sha256(data).hexdigest()
+        profile_dir = self.cache_dir / profile.key
+        cached = self._lookup(profile_dir, image_hash)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            future = self._pending.get((profile.key, image_hash))
+            if future is None:
+                future = self._executor.submit(normalize_image, bytes(data), profile)
+                self._pending[(profile.key, image_hash)] = future
+        try:
+            media_type, normalized = future.result()
+        finally:
+            with self._lock:
+                self._pending.pop((profile.key, image_hash), None)
+
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        path = profile_dir / f"{image_hash}.{_EXTENSIONS[media_type]}"
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(normalized)
+        os.replace(tmp_path, path)
+        return media_type, normalized
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+_NORMALIZER: Optional[ImageNormalizer] = None
+
+
+def configure_image_normalizer(cache_dir: Optional[str], num_workers: Optional[int] = None):
+    """Set up the process pool and cache used by prepare_image.
+
+    Args:
+        cache_dir: Directory to cache normalized images in, or None to
+            normalize in the calling thread without caching
+        num_workers: Number of worker processes
+    """
+    global _NORMALIZER
+    if _NORMALIZER is not None:
+        _NORMALIZER.shutdown()
+    _NORMALIZER = ImageNormalizer(cache_dir, num_workers) if cache_dir else None
+
+
+def prepare_image(media_url: str, profile_name: str) -> Tuple[str, bytes]:
+    """Fetch an image and normalize it for a provider.
+
+    Args:
+        media_url: URL of the image
+        profile_name: Name of the provider profile in PROFILES
+
+    Returns:
+        Tuple of (media_type, image data) within the profile's limits
+    """
+    data = get_image_data(media_url)
+    profile = PROFILES[profile_name]
+    with profiling.stage("image_normalize"):
+        if _NORMALIZER is not None:
+            return _NORMALIZER.normalize(data, profile)
+        return normalize_image(data, profile)
+
+
+def prepare_image_base64(media_url: str, profile_name: str) -> Tuple[str, str]:
+    """Same as prepare_image, but returning the image base64 encoded.
+
+    Uses the base64 encoding stored in the image bundle when the image there
+    already fits the profile, skipping both normalization and encoding.
+
+    Args:
+        media_url: URL of the image
+        profile_name: Name of the provider profile in PROFILES
+
+    Returns:
+        Tuple of (media_type, base64 encoded image data)
+    """
+    profile = PROFILES[profile_name]
+    bundle = get_image_bundle()
+    entry = bundle.lookup(media_url) if bundle is not None else None
+    if (
+        entry is not None
+        and entry.base64_offset is not None
+        and entry.media_type in profile.media_types
+        and entry.length <= profile.max_bytes
+        and entry.width is not None
+        and max(entry.width, entry.height) <= profile.max_side
+    ):
+        media_type, encoded = entry.media_type, str(bundle.read_base64(entry), "ascii")
+    else:
+        media_type, data = prepare_image(media_url, profile_name)
+        with profiling.stage("base64_encode"):
+            encoded = base64.b64encode(data).decode("utf-8")
+    BYTES_UPLOADED.inc(len(encoded), kind="image")
+    return media_type, encoded
@@ -0,0 +1,184 @@
+"""
+Record and summarise the latency of generation calls.
+
+Every generation written by BaseVisionModel.process_data gets a line in a
+sidecar file next to the generations, data/generations/<model>_latency.jsonl,
+with the total latency of the call, the number of output tokens, tokens per
+second and the number of retries. Models run with --stream also record the
+time to first token.
+
+Summarise them with p50/p95/p99 per model and per category:
+
+    python -m models.latency data/generations
+    python -m models.latency data/generations/gpt-4o-2024-11-20_latency.jsonl -o latency.json
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from .dataset import iter_records
+from .utils import estimate_tokens
+
+LATENCY_SUFFIX = "_latency"
+PERCENTILES = (50, 95, 99)
+METRICS = ("ttft_s", "latency_s", "tokens_per_s")
+
+
+def latency_path(output_file_path: str) -> str:
+    """Path of the sidecar latency file of a generations file."""
+    root, ext = os.path.splitext(output_file_path)
+    return f"{root}{LATENCY_SUFFIX}{ext}"
+
+
+class LatencyTimer:
+    """Times one generation call, from its creation until finish is called.
+
+    Streaming implementations call first_token when the first text of the
+    response arrives, and set output_tokens when the provider reports usage.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self._clock = clock
+        self.start = clock()
+        self.end: Optional[float] = None
+        self.ttft: Optional[float] = None
+        self.output_tokens: Optional[int] = None
+
+    def restart(self):
+        """Start timing again, e.g. once a request gets a free connection."""
+        self.start = self._clock()
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = self._clock() - self.start
+
+    def stop(self):
+        """Mark the end of the call, when finish is only called later, e.g. once a whole batch is done."""
+        if self.end is None:
+            self.end = self._clock()
+
+    def finish(self, example: Dict[str, Any], response: str, retries: int = 0) -> Dict[str, Any]:
+        """The latency record of the call.
+
+        Tokens per second are measured from the first token when it is known,
+        so they reflect decoding speed rather than queueing and prefill. The
+        output token count is estimated from the response when the provider
+        doesn't report it.
+        """
+        self.stop()
+        latency = self.end - self.start
+        output_tokens = self.output_tokens
+        estimated = output_tokens is None
+        if estimated:
+            output_tokens = estimate_tokens(response)
+        decode_time = latency - (self.ttft or 0.0)
+        return {
+            "example_id": example["example_id"],
+            "category": example.get("category"),
+            "ttft_s": None if self.ttft is None else round(self.ttft, 4),
+            "latency_s": round(latency, 4),
+            "output_tokens": output_tokens,
+            "output_tokens_estimated": estimated,
+            "tokens_per_s": round(output_tokens / decode_time, 2) if decode_time > 0 else None,
+            "retries": retries,
+        }
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Percentile q of sorted values, interpolating linearly like numpy's default."""
+    position = (len(sorted_values) - 1) * q / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def latency_files(paths: Iterable[str]) -> List[str]:
+    """Expand directories to the latency files they contain."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.endswith(f"{LATENCY_SUFFIX}.jsonl")
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def summarise(paths: Iterable[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Percentiles of each metric per model and category, including "overall".
+
+    Returns:
+        {model: {category: {"count": n, "retries": total, metric: {"p50": ..., "p95": ..., "p99": ...}}}},
+        metrics without any values, e.g. ttft_s of runs that didn't stream, are None
+    """
+    summary = {}
+    for path in latency_files(paths):
+        model = os.path.basename(path)[: -len(f"{LATENCY_SUFFIX}.jsonl")]
+        values = defaultdict(lambda: defaultdict(list))
+        counts = defaultdict(int)
+        retries = defaultdict(int)
+        for record in iter_records(path):
+            for category in (record.get("category") or "unknown", "overall"):
+                counts[category] += 1
+                retries[category] += record.get("retries", 0)
+                for metric in METRICS:
+                    if record.get(metric) is not None:
+                        values[category][metric].append(record[metric])
+        summary[model] = {}
+        for category in sorted(counts):
+            stats = {"count": counts[category], "retries": retries[category]}
+            for metric in METRICS:
+                sorted_values = sorted(values[category][metric])
+                stats[metric] = {
+                    f"p{q}": round(percentile(sorted_values, q), 4) for q in PERCENTILES
+                } if sorted_values else None
+            summary[model][category] = stats
+    return summary
+
+
+def to_markdown(summary: Dict[str, Dict[str, Dict[str, Any]]]) -> str:
+    """One row per model and category, with p50/p95/p99 of each metric."""
+    header = ["model", "category", "n", "retries"] + [f"{metric} p{q}" for metric in METRICS for q in PERCENTILES]
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    for model, categories in summary.items():
+        for category, stats in categories.items():
+            cells = [model, category, str(stats["count"]), str(stats["retries"])]
+            for metric in METRICS:
+                for q in PERCENTILES:
+                    cells.append("-" if stats[metric] is None else f"{stats[metric][f'p{q}']:.2f}")
+            lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise the latency of generation runs")
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        help="Latency files written next to the generations, or directories containing them"
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        default=None,
+        help="Location to save the summary as JSON"
+    )
+    args = parser.parse_args()
+
+    summary = summarise(args.paths)
+    if args.output is not None:
+        with open(args.output, "w") as fid:
+            json.dump(summary, fid, indent=2)
+    print(to_markdown(summary))
+
+
+if __name__ == "__main__":
+    main()
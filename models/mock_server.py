@@ -0,0 +1,498 @@
+"""
+A local mock of the provider APIs, to benchmark and test offline.
+
+Speaks the shapes of the Reka chat API (POST /v1/chat), OpenAI chat
+completions (POST /v1/chat/completions, also used by X.AI and vLLM) and
+Anthropic messages (POST /v1/messages), streamed or not, and serves generated
+images from GET /images/<name>, so examples can point their media_url at it.
+
+Responses take a latency drawn from a configurable distribution, a fraction
+of requests fail with 429 or 5xx errors, and an optional quota rejects
+requests beyond a rate with 429s, like provider rate limits:
+
+    python -m models.mock_server --port 8400 --latency lognormal:0.5:0.4 --error_rate_429 0.02 --requests_per_second 20
+
+Responses end with "Rating: <1-5>", so they parse as judgements too. See
+benchmark.py for throughput benchmarks against it.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+_WORDS = (
+    "the image shows a small red house next to a river with two trees and a bridge "
+    "in the background while people walk along the path under a cloudy sky"
+).split()
+# Chunks of a streamed response.
+_STREAM_CHUNKS = 8
+
+
+@dataclass(frozen=True)
+class LatencyDistribution:
+    """Distribution of response latencies, in seconds.
+
+    kind is one of:
+      - constant: always value
+      - uniform: between value and spread
+      - exponential: with mean value
+      - lognormal: with median value and shape spread, heavy-tailed like real providers
+    """
+
+    kind: str = "constant"
+    value: float = 0.0
+    spread: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        """Parse "kind:value[:spread]", e.g. "lognormal:0.5:0.4", or a number of seconds."""
+        parts = spec.split(":")
+        if len(parts) == 1:
+            return cls("constant", float(parts[0]))
+        if parts[0] not in ("constant", "uniform", "exponential", "lognormal") or len(parts) > 3:
+            raise ValueError(f"Invalid latency distribution {spec!r}, expected kind:value[:spread]")
+        return cls(parts[0], *map(float, parts[1:]))
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            return rng.uniform(self.value, self.spread)
+        if self.kind == "exponential":
+            return rng.expovariate(1 / self.value) if self.value > 0 else 0.0
+        if self.kind == "lognormal":
+            return rng.lognormvariate(math.log(self.value), self.spread) if self.value > 0 else 0.0
+        return self.value
+
+
+@dataclass
+class MockConfig:
+    """Behaviour of the mock server."""
+
+    latency: LatencyDistribution = field(default_factory=LatencyDistribution)
+    # Part of the latency before the first chunk of streamed responses.
+    ttft_fraction: float = 0.2
+    # Words of each response, before the rating.
+    output_words: int = 60
+    # Fractions of requests failing with 429 and 5xx errors, answered straight away.
+    error_rate_429: float = 0.0
+    error_rate_5xx: float = 0.0
+    # Seconds to ask for in the Retry-After headers of injected errors, None to leave them out.
+    retry_after: Optional[float] = None
+    # Requests per second accepted, with bursts of up to burst requests, None for no quota.
+    # Requests beyond it get a 429 with the time until the quota allows them in Retry-After.
+    requests_per_second: Optional[float] = None
+    burst: Optional[int] = None
+    # Width and height of the served images.
+    image_size: Tuple[int, int] = (1024, 768)
+    seed: Optional[int] = None
+
+
+def _response_text(prompt: str, words: int) -> str:
+    digest = hashlib.sha256(prompt.encode()).digest()
+    text = " ".join(_WORDS[(digest[i % len(digest)] + i) % len(_WORDS)] for i in range(words))
+    return f"{text}.\nRating: {1 + digest[0] % 5}"
+
+
+def _prompt_text(body: Dict[str, Any]) -> str:
+    """All text of the messages of a request, whatever the API."""
+    texts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            texts.extend(part.get("text", "") for part in content if isinstance(part, dict))
+    return "\n".join(texts)
+
+
+def _split(text: str, chunks: int) -> List[str]:
+    size = max(1, math.ceil(len(text) / chunks))
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Clients open many connections at once, which must not overflow the backlog.
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients closing their connections, e.g. once a stream is read.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockServer:
+    """The mock server, serving from a background thread once started.
+
+    Usage:
+        with MockServer(MockConfig(error_rate_429=0.05)) as server:
+            client = OpenAI(api_key="mock", base_url=f"{server.url}/v1")
+    """
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self._httpd = _MockHTTPServer((host, port), _MockHandler)
+        self._httpd.mock = self
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._image: Optional[bytes] = None
+        self.reset(config or MockConfig())
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset(self, config: Optional[MockConfig] = None):
+        """Clear the request counts and quota, optionally changing the config."""
+        with self._lock:
+            if config is not None:
+                if self._image is not None and config.image_size != self.config.image_size:
+                    self._image = None
+                self.config = config
+            self._rng = random.Random(self.config.seed)
+            self._counts: Counter = Counter()
+            self._quota_tokens = float(self._burst())
+            self._quota_time = time.monotonic()
+
+    def _burst(self) -> int:
+        if self.config.burst is not None:
+            return self.config.burst
+        return max(1, math.ceil(self.config.requests_per_second or 1))
+
+    def stats(self) -> Dict[str, Any]:
+        """Requests received so far, in total, per API and per response status."""
+        with self._lock:
+            by_api = Counter()
+            by_status = Counter()
+            for (api, status), count in self._counts.items():
+                by_api[api] += count
+                by_status[str(status)] += count
+            return {"requests": sum(by_api.values()), "by_api": dict(by_api), "by_status": dict(by_status)}
+
+    def _admit(self, api: str) -> Tuple[int, Optional[float], float]:
+        """Decide the fate of a request.
+
+        Returns:
+            (status, Retry-After seconds or None, latency of a successful response)
+        """
+        with self._lock:
+            config = self.config
+            status, retry_after = 200, None
+            if config.requests_per_second is not None:
+                now = time.monotonic()
+                self._quota_tokens = min(
+                    self._burst(), self._quota_tokens + (now - self._quota_time) * config.requests_per_second
+                )
+                self._quota_time = now
+                if self._quota_tokens >= 1:
+                    self._quota_tokens -= 1
+                else:
+                    status = 429
+                    retry_after = (1 - self._quota_tokens) / config.requests_per_second
+            if status == 200:
+                draw = self._rng.random()
+                if draw < config.error_rate_429:
+                    status, retry_after = 429, config.retry_after
+                elif draw < config.error_rate_429 + config.error_rate_5xx:
+                    status, retry_after = self._rng.choice((500, 502, 503)), config.retry_after
+            latency = config.latency.sample(self._rng)
+            self._counts[api, status] += 1
+        return status, retry_after, latency
+
+    def image(self) -> bytes:
+        """The JPEG served for every image, noise so that it compresses like a photo."""
+        with self._lock:
+            if self._image is None:
+                from PIL import Image
+
+                width, height = self.config.image_size
+                noise = Image.effect_noise((width, height), 48).convert("RGB")
+                buffer = io.BytesIO()
+                noise.save(buffer, format="JPEG", quality=90)
+                self._image = buffer.getvalue()
+            return self._image
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    # Keep connections alive like the providers do, so clients can pool them,
+    # without delaying the body written after the headers.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    _ROUTES = {
+        "/v1/chat": "reka",
+        "/v1/chat/completions": "openai",
+        "/v1/messages": "anthropic",
+    }
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if not self.path.startswith("/images/"):
+            self._send_json(404, {"error": {"message": f"No route for GET {self.path}"}})
+            return
+        self._send(200, self.server.mock.image(), "image/jpeg")
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        api = self._ROUTES.get(self.path.split("?")[0])
+        if api is None:
+            self._send_json(404, {"error": {"message": f"No route for POST {self.path}"}})
+            return
+        mock = self.server.mock
+        status, retry_after, latency = mock._admit(api)
+        if status != 200:
+            self._send_error(api, status, retry_after)
+            return
+        prompt = _prompt_text(body)
+        text = _response_text(prompt, mock.config.output_words)
+        usage = (max(1, len(prompt) // 4), len(text.split()))
+        if not body.get("stream"):
+            time.sleep(latency)
+            self._send_json(200, getattr(self, f"_{api}_response")(body, text, usage))
+            return
+        ttft = latency * mock.config.ttft_fraction
+        time.sleep(ttft)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunks = _split(text, _STREAM_CHUNKS)
+        for event in getattr(self, f"_{api}_events")(body, chunks, usage):
+            if event is None:
+                # Between text chunks.
+                time.sleep((latency - ttft) / len(chunks))
+                continue
+            self._write_chunk(event.encode())
+        self._write_chunk(b"")
+
+    def _send(self, status: int, data: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, status: int, obj: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        self._send(status, json.dumps(obj).encode(), "application/json", headers)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_error(self, api: str, status: int, retry_after: Optional[float]):
+        headers = {}
+        if retry_after is not None:
+            headers["retry-after-ms"] = str(round(retry_after * 1000))
+            headers["Retry-After"] = str(math.ceil(retry_after))
+        message = "Rate limit exceeded" if status == 429 else "Internal server error"
+        if api == "anthropic":
+            kind = "rate_limit_error" if status == 429 else "api_error"
+            obj = {"type": "error", "error": {"type": kind, "message": message}}
+        elif api == "openai":
+            obj = {"error": {"message": message, "type": "rate_limit_exceeded" if status == 429 else "server_error"}}
+        else:
+            obj = {"detail": message}
+        self._send_json(status, obj, headers)
+
+    @staticmethod
+    def _sse(obj: Dict[str, Any], event: Optional[str] = None) -> str:
+        prefix = f"event: {event}\n" if event is not None else ""
+        return f"{prefix}data: {json.dumps(obj)}\n\n"
+
+    def _reka_response(self, body: Dict[str, Any], text: str, usage: Tuple[int, int]) -> Dict[str, Any]:
+        return {
+            "id": str(uuid.uuid4()),
+            "model": body.get("model", "mock"),
+            "responses": [{"finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+            "usage": {"input_tokens": usage[0], "output_tokens": usage[1]},
+        }
+
+    def _reka_events(self, body: Dict[str, Any], chunks: List[str], usage: Tuple[int, int]) -> Iterator[Optional[str]]:
+        # Each chunk holds the whole response so far.
+        response_id, content = str(uuid.uuid4()), ""
+        for index, chunk in enumerate(chunks):
+            if index:
+                yield None
+            content += chunk
+            last = index == len(chunks) - 1
+            yield self._sse({
+                "id": response_id,
+                "model": body.get("model", "mock"),
+                "responses": [{
+                    "chunk": {"role": "assistant", "content": content},
+                    "finish_reason": "stop" if last else None,
+                }],
+                "usage": {"input_tokens": usage[0], "output_tokens": len(content.split())},
+            })
+
+    def _openai_response(self, body: Dict[str, Any], text: str, usage: Tuple[int, int]) -> Dict[str, Any]:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": usage[0], "completion_tokens": usage[1], "total_tokens": sum(usage)},
+        }
+
+    def _openai_events(self, body: Dict[str, Any], chunks: List[str], usage: Tuple[int, int]) -> Iterator[Optional[str]]:
+        base = {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+        }
+        for index, chunk in enumerate(chunks):
+            if index:
+                yield None
+            delta = {"role": "assistant", "content": chunk} if index == 0 else {"content": chunk}
+            yield self._sse({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        yield self._sse({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield self._sse({
+                **base,
+                "choices": [],
+                "usage": {"prompt_tokens": usage[0], "completion_tokens": usage[1], "total_tokens": sum(usage)},
+            })
+        yield "data: [DONE]\n\n"
+
+    def _anthropic_response(self, body: Dict[str, Any], text: str, usage: Tuple[int, int]) -> Dict[str, Any]:
+        return {
+            "id": f"msg_{uuid.uuid4().hex}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "mock"),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": usage[0], "output_tokens": usage[1]},
+        }
+
+    def _anthropic_events(self, body: Dict[str, Any], chunks: List[str], usage: Tuple[int, int]) -> Iterator[Optional[str]]:
+        message = {**self._anthropic_response(body, "", usage), "content": [], "stop_reason": None}
+        message["usage"] = {"input_tokens": usage[0], "output_tokens": 1}
+        yield self._sse({"type": "message_start", "message": message}, "message_start")
+        yield self._sse(
+            {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+            "content_block_start",
+        )
+        for index, chunk in enumerate(chunks):
+            if index:
+                yield None
+            yield self._sse(
+                {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": chunk}},
+                "content_block_delta",
+            )
+        yield self._sse({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        yield self._sse(
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                "usage": {"output_tokens": usage[1]},
+            },
+            "message_delta",
+        )
+        yield self._sse({"type": "message_stop"}, "message_stop")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local mock of the Reka, OpenAI and Anthropic APIs")
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Interface to listen on"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8400,
+        help="Port to listen on"
+    )
+    parser.add_argument(
+        "--latency",
+        type=LatencyDistribution.parse,
+        default=LatencyDistribution("lognormal", 0.5, 0.4),
+        help="Latency of responses in seconds, as kind:value[:spread], e.g. constant:0.2, uniform:0.1:1, "
+             "exponential:0.5 or lognormal:0.5:0.4 (median and shape)"
+    )
+    parser.add_argument(
+        "--error_rate_429",
+        type=float,
+        default=0.0,
+        help="Fraction of requests failing with a 429"
+    )
+    parser.add_argument(
+        "--error_rate_5xx",
+        type=float,
+        default=0.0,
+        help="Fraction of requests failing with a 500, 502 or 503"
+    )
+    parser.add_argument(
+        "--retry_after",
+        type=float,
+        default=None,
+        help="Seconds to ask for in the Retry-After headers of injected errors"
+    )
+    parser.add_argument(
+        "--requests_per_second",
+        type=float,
+        default=None,
+        help="Quota of requests per second, rejecting requests beyond it with a 429"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the latencies and injected errors"
+    )
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency,
+        error_rate_429=args.error_rate_429,
+        error_rate_5xx=args.error_rate_5xx,
+        retry_after=args.retry_after,
+        requests_per_second=args.requests_per_second,
+        seed=args.seed,
+    )
+    with MockServer(config, host=args.host, port=args.port) as server:
+        print(f"Serving the mock APIs on {server.url}, e.g. OpenAI(base_url=\"{server.url}/v1\")")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -4,24 +4,38 @@ $ pip install openai
 
 from openai import OpenAI
 from .base_model import BaseVisionModel
+from .batch_jobs import OpenAIBatchProvider
+from .latency import LatencyTimer
 from typing import Dict, Any
 
+def stream_chat_completion(client: OpenAI, request: Dict[str, Any], timer: LatencyTimer) -> str:
+    """Stream a chat completion, recording the first token and the usage on timer.
+
+    Shared with the OpenAI compatible xAI API.
+    """
+    stream = client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True})
+    chunks = []
+    for chunk in stream:
+        if chunk.usage is not None:
+            timer.output_tokens = chunk.usage.completion_tokens
+        if chunk.choices and chunk.choices[0].delta.content:
+            timer.first_token()
+            chunks.append(chunk.choices[0].delta.content)
+    return "".join(chunks)
+
 class OpenAIModel(BaseVisionModel):
     """OpenAI vision model implementation."""
+
+    provider = "openai"
+
     def __init__(self, model_name: str, api_key: str):
         super().__init__(model_name)
-        self.client = OpenAI(api_key=api_key)
+        # Retries are left to self.executor, the SDK's own would stack under them.
+        self.client = OpenAI(api_key=api_key, max_retries=0)
 
-    def generate_response(self, example: Dict[str, Any]) -> str:
-        """Generate a response for the given example.
-        
-        Args:
-            example: Dictionary containing at least 'media_url' and 'prompt' keys
-            
-        Returns:
-            str: Generated response from the model
-        """
-        response = self.client.chat.completions.create(
+    def build_request(self, example: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the chat completions request body for an example."""
+        return dict(
             model=self.model_name,
             messages=[
                 {
@@ -39,4 +53,21 @@ class OpenAIModel(BaseVisionModel):
                 }
             ],
         )
-        return response.choices[0].message.content
\ No newline at end of file
+
+    def generate_response(self, example: Dict[str, Any]) -> str:
+        """Generate a response for the given example.
+        
+        Args:
+            example: Dictionary containing at least 'media_url' and 'prompt' keys
+            
+        Returns:
+            str: Generated response from the model
+        """
+        response = self.client.chat.completions.create(**self.build_request(example))
+        return response.choices[0].message.content
+
+    def stream_response(self, example: Dict[str, Any], timer: LatencyTimer) -> str:
+        return stream_chat_completion(self.client, self.build_request(example), timer)
+
+    def batch_provider(self) -> "OpenAIBatchProvider":
+        return OpenAIBatchProvider(self.client)
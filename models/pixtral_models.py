@@ -8,13 +8,25 @@ from tqdm import tqdm
 from vllm import LLM
 from vllm.sampling_params import SamplingParams
 from .base_model import BaseVisionModel
-from typing import Dict, Any
+from .latency import LatencyTimer
+from .telemetry import BYTES_UPLOADED, track_request
+from .utils import get_image_url
+from typing import Dict, Any, List, Optional
 
 class PixtralModel(BaseVisionModel):
     """Pixtral vision model implementation."""
-    
-    def __init__(self, model_name: str):
+
+    provider = "vllm"
+
+    def __init__(self, model_name: str, batch_size: int = 64):
+        """Initialize the model.
+        
+        Args:
+            model_name: Name/identifier of the model
+            batch_size: Number of conversations to pass to vLLM at once
+        """
         super().__init__(model_name)
+        self.batch_size = batch_size
         self.sampling_params = SamplingParams(max_tokens=8192, temperature=0.7)
         self.llm = LLM(
             model=model_name,
@@ -23,6 +35,17 @@ class PixtralModel(BaseVisionModel):
             max_model_len=32768,
         )
 
+    def _conversation(self, example: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": example["prompt"]},
+                    {"type": "image_url", "image_url": {"url": get_image_url(example["media_url"])}},
+                ],
+            },
+        ]
+
     def generate_response(self, example: Dict[str, Any]) -> str:
         """Generate a response using Pixtral vision model.
         
@@ -32,14 +55,36 @@ class PixtralModel(BaseVisionModel):
         Returns:
             str: Generated response from Pixtral
         """
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": example["prompt"]},
-                    {"type": "image_url", "image_url": {"url": example["media_url"]}},
-                ],
-            },
-        ]
-        outputs = self.llm.chat(messages=messages, sampling_params=self.sampling_params)
+        outputs = self.llm.chat(messages=self._conversation(example), sampling_params=self.sampling_params)
         return outputs[0].outputs[0].text
+
+    def generate_batch(
+        self, examples: List[Dict[str, Any]], timers: Optional[List[LatencyTimer]] = None
+    ) -> List[Optional[str]]:
+        """Generate responses for several examples in one vLLM call.
+        
+        vLLM schedules all the conversations together, batching them on the
+        GPU rather than running them one at a time.
+        
+        Args:
+            examples: Examples containing media_url and prompt
+            timers: Unused, the timers time the whole vLLM call
+            
+        Returns:
+            Responses in the same order as examples, None where vLLM returned
+            no output
+        """
+        for example in examples:
+            BYTES_UPLOADED.inc(len(example["prompt"].encode()), kind="prompt")
+        # The telemetry counts the whole vLLM call as one request.
+        with track_request(self.model_name):
+            try:
+                outputs = self.llm.chat(
+                    messages=[self._conversation(example) for example in examples],
+                    sampling_params=self.sampling_params,
+                )
+            except Exception as e:
+                self.executor.record_outcome(e)
+                raise
+        self.executor.record_outcome()
+        return [output.outputs[0].text if output.outputs else None for output in outputs]
@@ -9,34 +9,86 @@ $ vllm serve mistralai/Pixtral-Large-Instruct-2411 --config-format mistral --loa
 
 """
 
-import requests
+import asyncio
 import json
-from typing import Dict, Any
+import os
+import threading
+from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
-from huggingface_hub import hf_hub_download
+import httpx
 from .base_model import BaseVisionModel
+from .latency import LatencyTimer
+from .telemetry import BYTES_UPLOADED, track_request
+from .utils import get_image_url
 
 class PixtralServer(BaseVisionModel):
-    """Pixtral server implementation."""
+    """Pixtral server implementation.
     
+    Requests are sent from an asyncio event loop running in a background
+    thread, over one pooled connection, with up to max_in_flight requests at
+    once so that the server's continuous batching stays busy. generate_batch
+    sends a whole chunk of examples concurrently.
+    """
+
+    provider = "vllm_server"
+
     def __init__(
         self, 
         model_name: str, 
         server_url: str = "127.0.0.1",
-        server_port: str = "8000"
+        server_port: str = "8000",
+        max_in_flight: int = 64,
+        stream: bool = False,
+        system_prompt_path: Optional[str] = None,
+        request_timeout: float = 600,
     ):
+        """Initialize the client.
+        
+        Args:
+            model_name: Name/identifier of the model
+            server_url: Host of the vLLM server
+            server_port: Port of the vLLM server
+            max_in_flight: Maximum number of concurrent requests to the server
+            stream: Whether to stream responses token by token
+            system_prompt_path: Local SYSTEM_PROMPT.txt to use instead of the
+                cached or downloaded one
+            request_timeout: Timeout of each request in seconds
+        """
         super().__init__(model_name)
         self.url = f"http://{server_url}:{server_port}/v1/chat/completions"
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": "Bearer token"
         }
-        self.system_prompt = self.load_system_prompt()
+        self.stream = stream
+        self.request_timeout = request_timeout
+        # Enough examples per batch to fill the server, see generate_batch.
+        self.batch_size = max_in_flight
+        self.max_in_flight = max_in_flight
+        self.system_prompt = self.load_system_prompt(system_prompt_path)
+
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
 
-    def load_system_prompt(self) -> str:
-        """Load system prompt from model files."""
-        file_path = hf_hub_download(repo_id=self.model_name, filename="SYSTEM_PROMPT.txt")
-        with open(file_path, "r") as file:
+    def load_system_prompt(self, system_prompt_path: Optional[str] = None) -> str:
+        """Load system prompt from model files.
+        
+        The prompt is downloaded from the Hugging Face hub once and then cached
+        under data/cache/system_prompts, so later runs don't need the hub.
+        """
+        if system_prompt_path is None:
+            system_prompt_path = os.path.join(
+                "data", "cache", "system_prompts", f"{self.model_name.replace('/', '-')}.txt"
+            )
+            if not os.path.isfile(system_prompt_path):
+                from huggingface_hub import hf_hub_download
+                file_path = hf_hub_download(repo_id=self.model_name, filename="SYSTEM_PROMPT.txt")
+                os.makedirs(os.path.dirname(system_prompt_path), exist_ok=True)
+                with open(file_path, "r") as src, open(system_prompt_path, "w") as dst:
+                    dst.write(src.read())
+        with open(system_prompt_path, "r") as file:
             system_prompt = file.read()
         today = datetime.today().strftime("%Y-%m-%d")
         yesterday = (datetime.today() - timedelta(days=1)).strftime("%Y-%m-%d")
@@ -45,27 +97,131 @@ class PixtralServer(BaseVisionModel):
             name=model_name, today=today, yesterday=yesterday
         )
 
-    def generate_response(self, example: Dict[str, Any]) -> str:
-        """Generate a response using Pixtral server.
-        
-        Args:
-            example: Dictionary containing media_url and prompt
-            
-        Returns:
-            str: Generated response from Pixtral server
-        """
+    def _payload(self, example: Dict[str, Any]) -> Dict[str, Any]:
         messages = [
             {"role": "system", "content": self.system_prompt},
             {
                 "role": "user",
                 "content": [
                     {"type": "text", "text": example["prompt"]},
-                    {"type": "image_url", "image_url": {"url": example["media_url"]}},
+                    {"type": "image_url", "image_url": {"url": get_image_url(example["media_url"])}},
                 ],
             },
         ]
-        payload = {"model": self.model_name, "messages": messages}
-        response = requests.post(
-            self.url, headers=self.headers, data=json.dumps(payload)
-        )
-        return response.json()["choices"][0]["message"]["content"]
\ No newline at end of file
+        payload = {"model": self.model_name, "messages": messages, "stream": self.stream}
+        if self.stream:
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    async def agenerate_response(
+        self, example: Dict[str, Any], timer: Optional[LatencyTimer] = None, track: bool = False
+    ) -> str:
+        """Generate a response using Pixtral server, from the client's event loop.
+        
+        Args:
+            example: Dictionary containing media_url and prompt
+            timer: Timer to record the first token, with stream, and the end of the request on
+            track: Whether to record the request in the telemetry, for callers
+                that don't go through _generate_timed and self.executor
+            
+        Returns:
+            str: Generated response from Pixtral server
+        """
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.request_timeout,
+                limits=httpx.Limits(max_connections=self.max_in_flight),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        async with self._semaphore:
+            if timer is not None:
+                # Time the request itself, not the wait for a free slot.
+                timer.restart()
+            if not track:
+                return await self._request(example, timer)
+            BYTES_UPLOADED.inc(len(example["prompt"].encode()), kind="prompt")
+            with track_request(self.model_name):
+                try:
+                    response = await self._request(example, timer)
+                except Exception as e:
+                    self.executor.record_outcome(e)
+                    raise
+            self.executor.record_outcome()
+            return response
+
+    async def _request(self, example: Dict[str, Any], timer: Optional[LatencyTimer]) -> str:
+        if not self.stream:
+            response = await self._client.post(self.url, headers=self.headers, json=self._payload(example))
+            response.raise_for_status()
+            body = response.json()
+            if timer is not None:
+                timer.stop()
+                timer.output_tokens = (body.get("usage") or {}).get("completion_tokens")
+            return body["choices"][0]["message"]["content"]
+
+        chunks = []
+        async with self._client.stream(
+            "POST", self.url, headers=self.headers, json=self._payload(example)
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if timer is not None and chunk.get("usage"):
+                    timer.output_tokens = chunk["usage"]["completion_tokens"]
+                if not chunk["choices"]:
+                    continue
+                delta = chunk["choices"][0].get("delta", {})
+                if timer is not None and delta.get("content"):
+                    timer.first_token()
+                chunks.append(delta.get("content") or "")
+        if timer is not None:
+            timer.stop()
+        return "".join(chunks)
+
+    def generate_response(self, example: Dict[str, Any]) -> str:
+        """Generate a response using Pixtral server.
+        
+        Args:
+            example: Dictionary containing media_url and prompt
+            
+        Returns:
+            str: Generated response from Pixtral server
+        """
+        return asyncio.run_coroutine_threadsafe(self.agenerate_response(example), self._loop).result()
+
+    def stream_response(self, example: Dict[str, Any], timer: LatencyTimer) -> str:
+        return asyncio.run_coroutine_threadsafe(self.agenerate_response(example, timer), self._loop).result()
+
+    def generate_batch(
+        self, examples: List[Dict[str, Any]], timers: Optional[List[LatencyTimer]] = None
+    ) -> List[Optional[str]]:
+        """Send requests for all examples at once, up to max_in_flight at a time.
+
+        Unlike generate_response, the requests aren't retried by self.executor,
+        but their outcomes are recorded by it in the telemetry all the same.
+        
+        Args:
+            examples: Examples containing media_url and prompt
+            timers: Timers of the examples' requests
+            
+        Returns:
+            Responses in the same order as examples, None for failed requests
+        """
+        timers = timers or [None] * len(examples)
+
+        async def _gather():
+            return await asyncio.gather(
+                *(self.agenerate_response(example, timer, track=True) for example, timer in zip(examples, timers)),
+                return_exceptions=True,
+            )
+
+        responses = asyncio.run_coroutine_threadsafe(_gather(), self._loop).result()
+        for example, response in zip(examples, responses):
+            if isinstance(response, Exception):
+                print(f"Failed generation for {example['example_id']}, error: {response}")
+        return [None if isinstance(response, Exception) else response for response in responses]
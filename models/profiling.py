@@ -0,0 +1,206 @@
+"""
+Profile where the time of a run goes, shared by evaluate.py and the models.
+
+With --profile, the pipeline stages of each example (dataset reads, image
+fetch, normalization and base64 encoding, the provider call, parsing the
+judgement, output writes) are timed, and the whole run is profiled with
+cProfile, tracemalloc and a sampling profiler. The output directory holds:
+
+  - stages.md: count, total, self time (excluding nested stages) and
+    percentiles of every stage, also printed at the end of the run,
+  - stages_by_example.jsonl: self time of each stage per example,
+  - cprofile.pstats: cProfile of the main thread, e.g. for snakeviz,
+  - stacks.folded: stacks of all threads sampled every 10ms, in the
+    collapsed format of flamegraph.pl and speedscope,
+  - tracemalloc.txt: the lines allocating the most memory, and the growth
+    since the start of the run.
+
+When profiling is off, stage() returns a shared no-op context manager, so
+the instrumentation costs a function call per stage.
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from typing import ContextManager, Dict, Iterator, List, Optional
+
+_NULL_CONTEXT = contextlib.nullcontext()
+_PROFILER: Optional["Profiler"] = None
+# Stack of [stage name, time spent in nested stages] of the running task or thread.
+_STAGES: contextvars.ContextVar = contextvars.ContextVar("profiling_stages", default=())
+_EXAMPLE_ID: contextvars.ContextVar = contextvars.ContextVar("profiling_example_id", default=None)
+
+
+def _percentile(values: List[float], q: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def stage(name: str) -> ContextManager:
+    """Time a pipeline stage, if profiling."""
+    if _PROFILER is None:
+        return _NULL_CONTEXT
+    return _PROFILER.stage(name)
+
+
+def example(example_id: str) -> ContextManager:
+    """Attribute the stages run in this context to an example, if profiling."""
+    if _PROFILER is None:
+        return _NULL_CONTEXT
+    return _example(example_id)
+
+
+@contextlib.contextmanager
+def _example(example_id: str) -> Iterator[None]:
+    token = _EXAMPLE_ID.set(example_id)
+    try:
+        yield
+    finally:
+        _EXAMPLE_ID.reset(token)
+
+
+class _StackSampler(threading.Thread):
+    """Samples the stacks of all other threads, counting them in collapsed form."""
+
+    def __init__(self, interval: float):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(frames))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Profiler:
+    """Collects stage timings and profiles, see the module docstring."""
+
+    def __init__(self, output_dir: str, sample_interval: float = 0.01):
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        # stage -> [(total, self time)]
+        self._durations: Dict[str, List[tuple]] = defaultdict(list)
+        # example_id -> stage -> self time
+        self._by_example: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._cprofile = cProfile.Profile()
+        self._sampler = _StackSampler(sample_interval)
+        self._start_snapshot = None
+
+    def start(self):
+        tracemalloc.start()
+        self._start_snapshot = tracemalloc.take_snapshot()
+        self._sampler.start()
+        self._cprofile.enable()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        frame = [name, 0.0]
+        parents = _STAGES.get()
+        token = _STAGES.set(parents + (frame,))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            total = time.perf_counter() - start
+            _STAGES.reset(token)
+            if parents:
+                parents[-1][1] += total
+            self_time = total - frame[1]
+            example_id = _EXAMPLE_ID.get()
+            with self._lock:
+                self._durations[name].append((total, self_time))
+                if example_id is not None:
+                    self._by_example[example_id][name] += self_time
+
+    def stage_table(self) -> str:
+        """Markdown table of the stages, by decreasing self time."""
+        lines = [
+            "| stage | count | total s | self s | self % | mean ms | p50 ms | p95 ms |",
+            "|---|---|---|---|---|---|---|---|",
+        ]
+        with self._lock:
+            durations = {name: list(values) for name, values in self._durations.items()}
+        all_self = sum(self_time for values in durations.values() for _, self_time in values) or 1.0
+        rows = sorted(durations.items(), key=lambda item: -sum(self_time for _, self_time in item[1]))
+        for name, values in rows:
+            totals = sorted(total for total, _ in values)
+            self_total = sum(self_time for _, self_time in values)
+            lines.append(
+                f"| {name} | {len(values)} | {sum(totals):.3f} | {self_total:.3f} | {100 * self_total / all_self:.1f} "
+                f"| {1000 * sum(totals) / len(totals):.2f} | {1000 * _percentile(totals, 50):.2f} "
+                f"| {1000 * _percentile(totals, 95):.2f} |"
+            )
+        return "\n".join(lines) + "\n"
+
+    def stop(self) -> str:
+        """Stop profiling and write the output files, returning the stage table."""
+        self._cprofile.disable()
+        self._sampler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._cprofile.dump_stats(os.path.join(self.output_dir, "cprofile.pstats"))
+        with open(os.path.join(self.output_dir, "stacks.folded"), "w") as fid:
+            for stack, count in sorted(self._sampler.stacks.items()):
+                fid.write(f"{stack} {count}\n")
+        with open(os.path.join(self.output_dir, "tracemalloc.txt"), "w") as fid:
+            fid.write("Top allocations at the end of the run:\n")
+            for stat in snapshot.statistics("lineno")[:50]:
+                fid.write(f"{stat}\n")
+            fid.write("\nGrowth since the start of the run:\n")
+            for stat in snapshot.compare_to(self._start_snapshot, "lineno")[:50]:
+                fid.write(f"{stat}\n")
+        with open(os.path.join(self.output_dir, "stages_by_example.jsonl"), "w") as fid:
+            for example_id, stages in self._by_example.items():
+                record = {"example_id": example_id, **{name: round(seconds, 6) for name, seconds in stages.items()}}
+                fid.write(json.dumps(record) + "\n")
+        table = self.stage_table()
+        with open(os.path.join(self.output_dir, "stages.md"), "w") as fid:
+            fid.write(table)
+        return table
+
+
+def start_profiling(output_dir: str, sample_interval: float = 0.01) -> Profiler:
+    """Start profiling the run, see the module docstring."""
+    global _PROFILER
+    _PROFILER = Profiler(output_dir, sample_interval)
+    _PROFILER.start()
+    return _PROFILER
+
+
+def stop_profiling() -> Optional[str]:
+    """Stop profiling and write the output files, returning the stage table, or None if not profiling."""
+    global _PROFILER
+    if _PROFILER is None:
+        return None
+    profiler, _PROFILER = _PROFILER, None
+    return profiler.stop()
+
+
+def default_profile_dir(script: str) -> str:
+    return os.path.join("data", "profiles", f"{script}-{time.strftime('%Y%m%d-%H%M%S')}")
@@ -1,14 +1,36 @@
-from typing import Dict, Any
+from typing import Dict, Any, List
 from reka.client import Reka
 from reka import ChatMessage
 from .base_model import BaseVisionModel
+from .executor import keep_error_headers_client
+from .latency import LatencyTimer
 
 class RekaModel(BaseVisionModel):
     """Reka vision model implementation."""
-    
+
+    provider = "reka"
+
     def __init__(self, model_name: str, api_key: str):
         super().__init__(model_name)
-        self.client = Reka(api_key=api_key)
+        # Keeps the headers of errors, so that Retry-After is honoured, see models/executor.py.
+        self.client = Reka(api_key=api_key, timeout=300, httpx_client=keep_error_headers_client())
+
+    def _messages(self, example: Dict[str, Any]) -> List[ChatMessage]:
+        return [
+            ChatMessage(
+                content=[
+                    {
+                        "type": "image_url",
+                        "image_url": example["media_url"],
+                    },
+                    {
+                        "type": "text",
+                        "text": example["prompt"],
+                    },
+                ],
+                role="user",
+            )
+        ]
 
     def generate_response(self, example: Dict[str, Any]) -> str:
         """Generate a response using Reka vision model.
@@ -19,22 +41,15 @@ class RekaModel(BaseVisionModel):
         Returns:
             str: Generated response from Reka
         """
-        response = self.client.chat.create(
-            messages=[
-                ChatMessage(
-                    content=[
-                        {
-                            "type": "image_url",
-                            "image_url": example["media_url"],
-                        },
-                        {
-                            "type": "text",
-                            "text": example["prompt"],
-                        },
-                    ],
-                    role="user",
-                )
-            ],
-            model=self.model_name,
-        )
+        response = self.client.chat.create(messages=self._messages(example), model=self.model_name)
         return response.responses[0].message.content
+
+    def stream_response(self, example: Dict[str, Any], timer: LatencyTimer) -> str:
+        # Each chunk holds the whole response so far, and the usage so far.
+        content = ""
+        for chunk in self.client.chat.create_stream(messages=self._messages(example), model=self.model_name):
+            if chunk.responses and chunk.responses[0].chunk.content:
+                timer.first_token()
+                content = chunk.responses[0].chunk.content
+            timer.output_tokens = chunk.usage.output_tokens
+        return content
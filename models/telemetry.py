@@ -0,0 +1,276 @@
+"""
+Counters and histograms of a run, shared by evaluate.py and the models.
+
+Metrics are kept in a process-wide registry. They can be scraped while a
+run is underway from a local HTTP endpoint in the Prometheus text format:
+
+    python evaluate.py ... --metrics_port 9100
+    curl localhost:9100/metrics
+
+and are written as a JSON report when the run finishes.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, 300)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], **extra: str) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra.items())
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def samples(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {"labels": dict(zip(self.labelnames, key)), "value": value}
+                for key, value in sorted(self._values.items())
+            ]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{self._labels(key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                # Count per bucket, without the +Inf one, then count and sum.
+                self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            counts, _, _ = self._values[key]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                counts[index] += 1
+            self._values[key][1] += 1
+            self._values[key][2] += value
+
+    def samples(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "labels": dict(zip(self.labelnames, key)),
+                    "count": count,
+                    "sum": round(total, 6),
+                    "buckets": dict(zip(map(str, self.buckets), counts)),
+                }
+                for key, (counts, count, total) in sorted(self._values.items())
+            ]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, (counts, count, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{self._labels(key, le=str(bound))} {cumulative}")
+                lines.append(f"{self.name}_bucket{self._labels(key, le='+Inf')} {count}")
+                lines.append(f"{self.name}_sum{self._labels(key)} {total}")
+                lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    """The metrics of a process."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self.start_time = time.time()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def report(self) -> Dict[str, Any]:
+        """All metrics as a JSON-serialisable dict."""
+        return {
+            "start_time": self.start_time,
+            "duration_s": round(time.time() - self.start_time, 3),
+            "metrics": {
+                metric.name: {"type": metric.type, "help": metric.help, "samples": metric.samples()}
+                for metric in self._metrics
+            },
+        }
+
+
+REGISTRY = Registry()
+
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "vibe_eval_requests_in_flight", "Requests to model providers currently in flight.", ["model"]
+)
+REQUESTS = REGISTRY.counter(
+    "vibe_eval_requests_total",
+    "Requests to model providers, by outcome: ok, or the error kind from models/executor.py.",
+    ["model", "outcome"],
+)
+REQUEST_LATENCY = REGISTRY.histogram(
+    "vibe_eval_request_latency_seconds", "Latency of requests to model providers, including failed ones.", ["model"]
+)
+RETRIES = REGISTRY.counter(
+    "vibe_eval_retries_total", "Requests retried, by the kind of error that caused the retry.", ["model", "error"]
+)
+BYTES_UPLOADED = REGISTRY.counter(
+    "vibe_eval_bytes_uploaded_total",
+    "Bytes of prompts and inline (base64 or data URL) images sent to providers.",
+    ["kind"],
+)
+TOKENS = REGISTRY.counter(
+    "vibe_eval_tokens_total",
+    "Input and output tokens, as reported by the provider or estimated.",
+    ["model", "direction"],
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "vibe_eval_cache_lookups_total", "Lookups in the judgement and image caches.", ["cache", "result"]
+)
+
+
+@contextmanager
+def track_request(model: str) -> Iterator[None]:
+    """Count a request as in flight and record its latency.
+
+    Outcomes and retries are recorded by models.executor.RequestExecutor.
+    """
+    REQUESTS_IN_FLIGHT.inc(model=model)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REQUESTS_IN_FLIGHT.dec(model=model)
+        REQUEST_LATENCY.observe(time.perf_counter() - start, model=model)
+
+
+def summarise(report: Dict[str, Any]) -> Dict[str, Any]:
+    """Headline numbers of a report: requests, 429 rate and retries per model, cache hit rates."""
+    metrics = report["metrics"]
+    models: Dict[str, Dict[str, float]] = {}
+    for sample in metrics[REQUESTS.name]["samples"]:
+        stats = models.setdefault(sample["labels"]["model"], {"requests": 0, "rate_limited": 0, "retries": 0})
+        stats["requests"] += sample["value"]
+        if sample["labels"]["outcome"] == "rate limit":
+            stats["rate_limited"] += sample["value"]
+    for sample in metrics[RETRIES.name]["samples"]:
+        stats = models.setdefault(sample["labels"]["model"], {"requests": 0, "rate_limited": 0, "retries": 0})
+        stats["retries"] += sample["value"]
+    for stats in models.values():
+        stats["rate_limited_fraction"] = round(stats["rate_limited"] / stats["requests"], 4) if stats["requests"] else 0.0
+    caches: Dict[str, Dict[str, float]] = {}
+    for sample in metrics[CACHE_LOOKUPS.name]["samples"]:
+        caches.setdefault(sample["labels"]["cache"], {"hit": 0, "miss": 0})[sample["labels"]["result"]] += sample["value"]
+    return {
+        "models": models,
+        "cache_hit_rate": {
+            cache: round(counts["hit"] / (counts["hit"] + counts["miss"]), 4) for cache, counts in caches.items()
+        },
+    }
+
+
+def write_report(path: str, registry: Registry = REGISTRY):
+    """Write the report of all metrics, with a summary of the headline numbers, as JSON."""
+    report = registry.report()
+    report["summary"] = summarise(report)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as fid:
+        json.dump(report, fid, indent=2)
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serve /metrics from a background thread, until the server's shutdown is called.
+
+    Args:
+        port: Port to listen on, 0 to pick a free one (see server_address)
+        host: Interface to listen on, only the local one by default
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.registry = registry
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
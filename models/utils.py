@@ -1,61 +1,349 @@
-from typing import Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+import asyncio
+import base64
+import hashlib
 import httpx
+import math
+import os
 from pathlib import Path
+import threading
 import time
 
-def validate_image_url(media_url: str) -> Tuple[str, str]:
-    """Validate image URL and return media type.
+from . import profiling
+from .telemetry import BYTES_UPLOADED, CACHE_LOOKUPS
+
+_HTTP_CLIENT: Optional[httpx.Client] = None
+_HTTP_CLIENT_LOCK = threading.Lock()
+
+
+def get_http_client() -> httpx.Client:
+    """Get the pooled HTTP client shared by all threads."""
+    global _HTTP_CLIENT
+    with _HTTP_CLIENT_LOCK:
+        if _HTTP_CLIENT is None:
+            _HTTP_CLIENT = httpx.Client(
+                timeout=60,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+            )
+        return _HTTP_CLIENT
+
+
+class ImageCache:
+    """Content-addressed on-disk cache of downloaded images.
+    
+    Image bytes are stored once per content hash under `blobs/`, and `urls/`
+    maps a hash of each URL to the hash of its content. Concurrent requests for
+    the same URL share a single download.
+    """
+
+    def __init__(self, cache_dir: str):
+        """Initialize the cache.
+        
+        Args:
+            cache_dir: Directory to store the cache in, created if missing
+        """
+        self.cache_dir = Path(cache_dir)
+        (self.cache_dir / "blobs").mkdir(parents=True, exist_ok=True)
+        (self.cache_dir / "urls").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._downloads: Dict[str, Future] = {}
+
+    def _url_path(self, media_url: str) -> Path:
+        return self.cache_dir / "urls" / hashlib.sha256(media_url.encode()).hexdigest()
+
+    def _blob_path(self, content_hash: str) -> Path:
+        return self.cache_dir / "blobs" / content_hash
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def lookup(self, media_url: str) -> Optional[bytes]:
+        """Get the cached image for a URL, or None if it isn't cached."""
+        try:
+            content_hash = self._url_path(media_url).read_text()
+            return self._blob_path(content_hash).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def store(self, media_url: str, data: bytes) -> str:
+        """Add an image to the cache, returning its content hash."""
+        content_hash = hashlib.sha256(data).hexdigest()
+        blob_path = self._blob_path(content_hash)
+        if not blob_path.exists():
+            self._write_atomic(blob_path, data)
+        self._write_atomic(self._url_path(media_url), content_hash.encode())
+        return content_hash
+
+    def get(self, media_url: str) -> bytes:
+        """Get an image, downloading it with the pooled client on a cache miss."""
+        data = self.lookup(media_url)
+        if data is not None:
+            CACHE_LOOKUPS.inc(cache="image", result="hit")
+            return data
+        CACHE_LOOKUPS.inc(cache="image", result="miss")
+        with self._lock:
+            download = self._downloads.get(media_url)
+            is_downloader = download is None
+            if is_downloader:
+                download = self._downloads[media_url] = Future()
+        if not is_downloader:
+            return download.result()
+        try:
+            response = get_http_client().get(media_url)
+            response.raise_for_status()
+            data = response.content
+            self.store(media_url, data)
+            download.set_result(data)
+            return data
+        except BaseException as e:
+            download.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._downloads[media_url]
+
+
+_IMAGE_CACHE: Optional[ImageCache] = None
+_IMAGE_BUNDLE = None
+
+
+def configure_image_cache(cache_dir: Optional[str]):
+    """Set the directory of the image cache used by get_image_data.
+    
+    Args:
+        cache_dir: Cache directory, or None to disable caching
+    """
+    global _IMAGE_CACHE
+    _IMAGE_CACHE = ImageCache(cache_dir) if cache_dir else None
+
+
+def configure_image_bundle(bundle_path: Optional[str]):
+    """Serve images from a packed bundle, see models/image_bundle.py.
+    
+    Args:
+        bundle_path: Path of the bundle, or None to stop using one
+    """
+    global _IMAGE_BUNDLE
+    from .image_bundle import ImageBundle
+    _IMAGE_BUNDLE = ImageBundle(bundle_path) if bundle_path else None
+
+
+def get_image_bundle():
+    """Get the configured ImageBundle, or None."""
+    return _IMAGE_BUNDLE
+
+
+def get_image_data(media_url: str) -> Union[bytes, memoryview]:
+    """Fetch image data from URL.
+    
+    Images are read from the image bundle when it contains them, see
+    configure_image_bundle. Otherwise they are served from the image cache
+    when configured, see configure_image_cache, or downloaded with a pooled
+    client.
     
     Args:
         media_url: URL of the image
         
     Returns:
-        Tuple of (media_type, extension)
+        Raw image data, as a zero-copy memoryview when read from the bundle
         
     Raises:
-        ValueError: If image extension is not supported
+        httpx.HTTPError: If image fetch fails
     """
-    ext = Path(media_url).suffix.lower()[1:]  # Remove the dot
-    if ext == "jpg":
-        ext = "jpeg"
-    if ext not in ["jpeg", "png"]:
-        raise ValueError(f"Unsupported image extension: {ext}")
-    return f"image/{ext}", ext
+    with profiling.stage("image_fetch"):
+        if _IMAGE_BUNDLE is not None:
+            entry = _IMAGE_BUNDLE.lookup(media_url)
+            if entry is not None:
+                return _IMAGE_BUNDLE.read(entry)
+        if _IMAGE_CACHE is not None:
+            return _IMAGE_CACHE.get(media_url)
+        response = get_http_client().get(media_url)
+        response.raise_for_status()
+        return response.content
 
-def get_image_data(media_url: str) -> bytes:
-    """Fetch image data from URL.
+
+def get_image_url(media_url: str) -> str:
+    """Get a URL for an image, as a data URL when it is in the image bundle.
+    
+    For models that take image URLs, so they can run without network access.
     
     Args:
         media_url: URL of the image
         
     Returns:
-        bytes: Raw image data
+        str: A base64 data URL if the bundle contains the image, else media_url
+    """
+    if _IMAGE_BUNDLE is None:
+        return media_url
+    entry = _IMAGE_BUNDLE.lookup(media_url)
+    if entry is None or entry.media_type is None:
+        return media_url
+    encoded = _IMAGE_BUNDLE.read_base64(entry)
+    if encoded is None:
+        with profiling.stage("base64_encode"):
+            encoded = base64.b64encode(_IMAGE_BUNDLE.read(entry))
+    BYTES_UPLOADED.inc(len(encoded), kind="image")
+    return f"data:{entry.media_type};base64,{str(encoded, 'ascii')}"
+
+
+class ImagePrefetcher:
+    """Downloads images into the image cache in background threads."""
+
+    def __init__(self, num_workers: int = 4, fetch: Callable[[str], Any] = get_image_data):
+        """Initialize the prefetcher.
         
-    Raises:
-        httpx.HTTPError: If image fetch fails
+        Args:
+            num_workers: Number of concurrent downloads
+            fetch: Function called on each URL, which should cache its result
+        """
+        self._executor = ThreadPoolExecutor(max_workers=num_workers)
+        self._fetch = fetch
+        self._submitted = set()
+
+    def prefetch(self, media_urls: Iterable[str]) -> List[Future]:
+        """Start downloading images that haven't been requested yet.
+        
+        Errors are not raised here, the download is retried when the image is
+        actually needed.
+        """
+        futures = []
+        for media_url in media_urls:
+            if media_url not in self._submitted:
+                self._submitted.add(media_url)
+                futures.append(self._executor.submit(self._fetch, media_url))
+        return futures
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Rough number of tokens an image costs, used to estimate request sizes.
+_TOKENS_PER_IMAGE = 1000
+
+
+def estimate_tokens(text: str, num_images: int = 0) -> int:
+    """Roughly estimate the number of tokens in a request.
+    
+    Args:
+        text: Text of the request
+        num_images: Number of images in the request
+        
+    Returns:
+        int: Estimated token count, assuming ~4 characters per token
     """
-    response = httpx.get(media_url)
-    response.raise_for_status()
-    return response.content 
+    return math.ceil(len(text) / 4) + num_images * _TOKENS_PER_IMAGE
+
+
+class _TokenBucket:
+    """Token bucket refilling continuously, which can go into debt."""
+
+    def __init__(self, per_minute: float, burst_seconds: float):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.last_refill = time.monotonic()
+
+    def reserve(self, cost: float, now: float) -> float:
+        """Take `cost` from the bucket, returning how long to wait before using it."""
+        self.level = min(
+            self.capacity, self.level + (now - self.last_refill) * self.rate
+        )
+        self.last_refill = now
+        self.level -= cost
+        return max(0.0, -self.level / self.rate)
+
 
 class RateLimiter:
-    """Rate limiter for API calls."""
+    """Thread-safe token bucket rate limiter for API calls.
+    
+    Enforces a requests-per-minute and an estimated tokens-per-minute budget.
+    Both buckets refill continuously, so calls are spread out at the allowed
+    rate rather than sent in bursts followed by long stalls. Callers reserve
+    their share of the budget under a lock and then sleep outside it, so one
+    limiter can be shared by many threads and asyncio tasks.
+    """
     
-    def __init__(self, max_requests: int, time_window: int):
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        burst_seconds: float = 1.0,
+    ):
         """Initialize rate limiter.
         
         Args:
-            max_requests: Maximum number of requests allowed
-            time_window: Time window in seconds
+            requests_per_minute: Maximum requests per minute, None for no limit
+            tokens_per_minute: Maximum estimated tokens per minute, None for no limit
+            burst_seconds: How many seconds worth of budget can be used at once
         """
-        self.max_requests = max_requests
-        self.time_window = time_window
-        self.requests = 0
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._buckets = []
+        if requests_per_minute:
+            self._buckets.append((_TokenBucket(requests_per_minute, burst_seconds), False))
+        if tokens_per_minute:
+            self._buckets.append((_TokenBucket(tokens_per_minute, burst_seconds), True))
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            delay = 0.0
+            for bucket, counts_tokens in self._buckets:
+                delay = max(delay, bucket.reserve(tokens if counts_tokens else 1, now))
+            return delay
     
-    def wait_if_needed(self):
-        """Wait if rate limit is exceeded."""
-        if self.requests >= self.max_requests:
-            time.sleep(self.time_window)
-            self.requests = 0
+    def wait_if_needed(self, tokens: int = 0):
+        """Block until a request of `tokens` estimated tokens fits in the budget."""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_if_needed_async(self, tokens: int = 0):
+        """Same as wait_if_needed, without blocking the event loop."""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Default budgets, overridden by <PROVIDER>_RPM / <PROVIDER>_TPM environment
+# variables, which are in turn overridden by explicit arguments (e.g. from the CLI).
+_DEFAULT_RATE_LIMITS = {
+    "gemini": (10, None),
+    "xai": (1, None),
+}
+_RATE_LIMITERS: Dict[Tuple[str, Optional[float], Optional[float]], RateLimiter] = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(
+    provider: str,
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+) -> RateLimiter:
+    """Get the rate limiter shared by every client of a provider with the same budget.
+    
+    Clients asking for different budgets, e.g. models of one provider with
+    their own rpm and tpm in a --config file, get separate limiters.
+
+    Args:
+        provider: Provider name, e.g. "gemini"
+        requests_per_minute: Overrides the env variable and default budget
+        tokens_per_minute: Overrides the env variable and default budget
         
-        self.requests += 1
\ No newline at end of file
+    Returns:
+        RateLimiter: The same instance for every call with the same provider and budget
+    """
+    default_rpm, default_tpm = _DEFAULT_RATE_LIMITS.get(provider, (None, None))
+    rpm = requests_per_minute or os.environ.get(f"{provider.upper()}_RPM") or default_rpm
+    tpm = tokens_per_minute or os.environ.get(f"{provider.upper()}_TPM") or default_tpm
+    key = (provider, float(rpm) if rpm else None, float(tpm) if tpm else None)
+    with _RATE_LIMITERS_LOCK:
+        if key not in _RATE_LIMITERS:
+            _RATE_LIMITERS[key] = RateLimiter(requests_per_minute=key[1], tokens_per_minute=key[2])
+        return _RATE_LIMITERS[key]
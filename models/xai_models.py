@@ -2,34 +2,39 @@
 $ pip install openai # xai lets you use openai sdk for simplicity
 """
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from openai import OpenAI
 from .base_model import BaseVisionModel
-from .utils import RateLimiter
+from .latency import LatencyTimer
+from .openai_models import stream_chat_completion
+from .utils import get_rate_limiter
 
 class XAIModel(BaseVisionModel):
     """X.AI vision model implementation."""
-    
-    def __init__(self, model_name: str, api_key: str):
+
+    provider = "xai"
+
+    def __init__(
+        self,
+        model_name: str,
+        api_key: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
         super().__init__(model_name)
+        # Retries are left to self.executor, the SDK's own would stack under them.
         self.client = OpenAI(
             base_url="https://api.x.ai/v1",
-            api_key=api_key
+            api_key=api_key,
+            max_retries=0,
+        )
+        self.rate_limiter = get_rate_limiter(
+            self.provider, requests_per_minute, tokens_per_minute
         )
-        self.rate_limiter = RateLimiter(max_requests=60, time_window=3600)
-
-    def generate_response(self, example: Dict[str, Any]) -> str:
-        """Generate a response using X.AI vision model.
-        
-        Args:
-            example: Dictionary containing media_url and prompt
-            
-        Returns:
-            str: Generated response from X.AI
-        """
-        self.rate_limiter.wait_if_needed()
 
-        response = self.client.chat.completions.create(
+    def build_request(self, example: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the chat completions request body for an example."""
+        return dict(
             model=self.model_name,
             messages=[
                 {
@@ -48,4 +53,18 @@ class XAIModel(BaseVisionModel):
             ],
             temperature=0.0,
         )
+
+    def generate_response(self, example: Dict[str, Any]) -> str:
+        """Generate a response using X.AI vision model.
+        
+        Args:
+            example: Dictionary containing media_url and prompt
+            
+        Returns:
+            str: Generated response from X.AI
+        """
+        response = self.client.chat.completions.create(**self.build_request(example))
         return response.choices[0].message.content
+
+    def stream_response(self, example: Dict[str, Any], timer: LatencyTimer) -> str:
+        return stream_chat_completion(self.client, self.build_request(example), timer)
@@ -0,0 +1,310 @@
+"""Columnar store of generations and evaluation results.
+
+Usage:
+    # Ingest results and generations files, adding to or replacing runs of the same name
+    python results_store.py ingest data/results/reka-core-20240415-evaluator data/generations -o data/results.store
+
+    # Mean score of every run per category
+    python results_store.py summary data/results.store
+
+    # Export a run back to JSONL
+    python results_store.py export data/results.store reka-core-20240415-evaluator/gpt4o-mini -o gpt4o-mini.jsonl
+
+A store is a directory holding:
+  - columns.npz: one row per (run, example) with dense `run`, `example`,
+    `category` and `score` arrays, the first three indexing into string
+    tables stored alongside, and offsets into text.bin,
+  - text.bin: the UTF-8 generations and evaluator explanations, read lazily
+    through mmap only when asked for.
+
+Aggregate queries only touch the small dense arrays, so they stay fast
+however many runs and however much text the store holds.
+"""
+
+import json
+import mmap
+import os
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+
+from analysis import results_files
+
+_COLUMNS_FILE = "columns.npz"
+_TEXT_FILE = "text.bin"
+# Score of rows from generation files, which haven't been evaluated.
+NO_SCORE = -1
+_TEXT_FIELDS = ("generation", "evaluator_explanation")
+
+
+class ScoreRecord(NamedTuple):
+    """Score of one example in a run, without any of the text."""
+
+    example_id: str
+    category: str
+    score: int
+
+
+class ResultsStore:
+    """Read-only view of a store."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with np.load(self.path / _COLUMNS_FILE) as columns:
+            self.runs: List[str] = columns["runs"].tolist()
+            self.example_ids: List[str] = columns["example_ids"].tolist()
+            self.categories: List[str] = columns["categories"].tolist()
+            self.run = columns["run"]
+            self.example = columns["example"]
+            self.category = columns["category"]
+            self.score = columns["score"]
+            self.text_offsets = columns["text_offsets"]
+        self._text: Optional[mmap.mmap] = None
+
+    def __len__(self) -> int:
+        return len(self.run)
+
+    def rows(self, run: str) -> np.ndarray:
+        """Indices of the rows of a run."""
+        return np.flatnonzero(self.run == self.runs.index(run))
+
+    def records(self, run: str) -> Iterator[ScoreRecord]:
+        """Scores of a run, e.g. for evaluate._summarise_metrics."""
+        for i in self.rows(run):
+            yield ScoreRecord(
+                example_id=self.example_ids[self.example[i]],
+                category=self.categories[self.category[i]],
+                score=int(self.score[i]),
+            )
+
+    def text(self, row: int, field: str) -> str:
+        """The generation or evaluator_explanation of a row, read lazily."""
+        if self._text is None:
+            with open(self.path / _TEXT_FILE, "rb") as fh:
+                if os.fstat(fh.fileno()).st_size == 0:
+                    return ""
+                self._text = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        start, end = self.text_offsets[row, _TEXT_FIELDS.index(field)]
+        return self._text[start:end].decode("utf-8")
+
+    def mean_scores(self) -> Dict[str, Dict[str, float]]:
+        """Mean score on the 0-100 scale of every evaluated run, per category.
+
+        Computed with bincounts over the dense arrays, without a Python loop
+        over rows.
+        """
+        scored = self.score != NO_SCORE
+        values = 25.0 * (self.score[scored] - 1)
+        runs = self.run[scored]
+        categories = self.category[scored]
+        num_runs, num_categories = len(self.runs), len(self.categories)
+
+        cells = runs * num_categories + categories
+        size = num_runs * num_categories
+        sums = np.bincount(cells, weights=values, minlength=size)
+        counts = np.bincount(cells, minlength=size)
+        sums = sums.reshape(num_runs, num_categories)
+        counts = counts.reshape(num_runs, num_categories)
+        overall_counts = counts.sum(axis=1)
+
+        results = {}
+        for i, run in enumerate(self.runs):
+            if not overall_counts[i]:
+                continue
+            results[run] = {
+                category: round(float(sums[i, j] / counts[i, j]), 2)
+                for j, category in enumerate(self.categories)
+                if counts[i, j]
+            }
+            results[run]["overall"] = round(
+                float(sums[i].sum() / overall_counts[i]), 2
+            )
+        return results
+
+
+def run_name(path: Path) -> str:
+    """Names runs by directory and file, e.g. generations/gpt4o-mini, as
+    generations and results of the same model share a file name."""
+    return f"{path.parent.name}/{path.stem}"
+
+
+def ingest(store_path: Path, files: Iterable[Path]) -> None:
+    """Adds generations or evaluation results files to a store.
+
+    Each file becomes a run named by `run_name`, replacing any run of the same
+    name already in the store. The store is created if it doesn't exist.
+    Text of the new rows is appended to text.bin, which is only rewritten
+    when runs are replaced.
+    """
+    store_path = Path(store_path)
+    files = list(files)
+    new_runs = [run_name(path) for path in files]
+
+    runs: List[str] = []
+    example_ids: List[str] = []
+    categories: List[str] = []
+    old_columns = None
+    keep = None
+    if (store_path / _COLUMNS_FILE).exists():
+        old = ResultsStore(store_path)
+        runs, example_ids, categories = (
+            old.runs,
+            old.example_ids,
+            old.categories,
+        )
+        keep = ~np.isin(
+            old.run, [runs.index(r) for r in new_runs if r in runs]
+        )
+        old_columns = old
+    store_path.mkdir(parents=True, exist_ok=True)
+
+    run_index = {run: i for i, run in enumerate(runs)}
+    example_index = {example_id: i for i, example_id in enumerate(example_ids)}
+    category_index = {category: i for i, category in enumerate(categories)}
+
+    def _index(table: Dict[str, int], values: List[str], value: str) -> int:
+        if value not in table:
+            table[value] = len(values)
+            values.append(value)
+        return table[value]
+
+    text_path = store_path / _TEXT_FILE
+    rewrite_text = keep is not None and not keep.all()
+    columns = {"run": [], "example": [], "category": [], "score": []}
+    offsets = []
+    with open(
+        str(text_path) + ".tmp" if rewrite_text else text_path,
+        "wb" if rewrite_text else "ab",
+    ) as text_fh:
+        position = text_fh.tell()
+        if old_columns is not None:
+            kept_offsets = old_columns.text_offsets[keep]
+            if rewrite_text:
+                # Copy the text of the kept rows, shifting their offsets.
+                with open(text_path, "rb") as old_text:
+                    for row_offsets in kept_offsets:
+                        shifted = []
+                        for start, end in row_offsets:
+                            old_text.seek(start)
+                            text_fh.write(old_text.read(end - start))
+                            shifted.append((position, position + end - start))
+                            position += end - start
+                        offsets.append(shifted)
+            else:
+                offsets.extend(kept_offsets.tolist())
+            for name in columns:
+                columns[name].extend(getattr(old_columns, name)[keep].tolist())
+
+        for path, run in zip(files, new_runs):
+            run_id = _index(run_index, runs, run)
+            with path.open() as fh:
+                for line in fh:
+                    result = json.loads(line)
+                    columns["run"].append(run_id)
+                    columns["example"].append(
+                        _index(
+                            example_index, example_ids, result["example_id"]
+                        )
+                    )
+                    columns["category"].append(
+                        _index(
+                            category_index,
+                            categories,
+                            result.get("category", ""),
+                        )
+                    )
+                    columns["score"].append(result.get("score", NO_SCORE))
+                    row_offsets = []
+                    for field in _TEXT_FIELDS:
+                        encoded = (result.get(field) or "").encode("utf-8")
+                        text_fh.write(encoded)
+                        row_offsets.append((position, position + len(encoded)))
+                        position += len(encoded)
+                    offsets.append(row_offsets)
+
+    tmp_columns = store_path / (_COLUMNS_FILE + ".tmp")
+    with open(tmp_columns, "wb") as fh:
+        np.savez(
+            fh,
+            runs=np.array(runs, dtype=str),
+            example_ids=np.array(example_ids, dtype=str),
+            categories=np.array(categories, dtype=str),
+            run=np.array(columns["run"], dtype=np.int32),
+            example=np.array(columns["example"], dtype=np.int32),
+            category=np.array(columns["category"], dtype=np.int16),
+            score=np.array(columns["score"], dtype=np.int8),
+            text_offsets=np.array(offsets, dtype=np.int64).reshape(
+                -1, len(_TEXT_FIELDS), 2
+            ),
+        )
+    if rewrite_text:
+        os.replace(str(text_path) + ".tmp", text_path)
+    os.replace(tmp_columns, store_path / _COLUMNS_FILE)
+
+
+def export(store: ResultsStore, run: str) -> Iterator[dict]:
+    """Rows of a run in the JSONL format they were ingested from."""
+    for i in store.rows(run):
+        row = {
+            "example_id": store.example_ids[store.example[i]],
+            "category": store.categories[store.category[i]],
+            "generation": store.text(i, "generation"),
+        }
+        if store.score[i] != NO_SCORE:
+            row["score"] = int(store.score[i])
+            row["evaluator_explanation"] = store.text(
+                i, "evaluator_explanation"
+            )
+        yield row
+
+
+def _parse_args():
+    parser = ArgumentParser(description="Columnar store of vibe-eval results.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser(
+        "ingest", help="Add generations or results files to a store."
+    )
+    ingest_parser.add_argument(
+        "inputs",
+        type=Path,
+        nargs="+",
+        help="JSONL files, or directories containing them.",
+    )
+    ingest_parser.add_argument(
+        "--store", "-o", type=Path, required=True, help="Store directory."
+    )
+
+    summary_parser = subparsers.add_parser(
+        "summary", help="Print the mean score of every run per category."
+    )
+    summary_parser.add_argument("store", type=Path, help="Store directory.")
+
+    export_parser = subparsers.add_parser(
+        "export", help="Write a run back out as JSONL."
+    )
+    export_parser.add_argument("store", type=Path, help="Store directory.")
+    export_parser.add_argument("run", help="Name of the run to export.")
+    export_parser.add_argument(
+        "--output", "-o", type=Path, required=True, help="JSONL file to write."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    if args.command == "ingest":
+        files = results_files(args.inputs)
+        ingest(args.store, files)
+        print(f"Ingested {len(files)} files into {args.store}.")
+    elif args.command == "summary":
+        json.dump(ResultsStore(args.store).mean_scores(), sys.stdout, indent=2)
+        print()
+    elif args.command == "export":
+        store = ResultsStore(args.store)
+        with open(args.output, "w") as fid:
+            for row in export(store, args.run):
+                fid.write(json.dumps(row, ensure_ascii=False) + "\n")
@@ -0,0 +1,67 @@
+import json
+
+import numpy as np
+
+from analysis import analyse, analyse_category, load_score_matrix
+
+
+def _write_results(path, scores):
+    with path.open("w") as fh:
+        for i, score in enumerate(scores):
+            category = "difficulty-hard" if i % 2 else "difficulty-normal"
+            example = {
+                "example_id": f"ex{i}",
+                "category": category,
+                "score": score,
+            }
+            fh.write(json.dumps(example) + "\n")
+
+
+def test__load_score_matrix(tmp_path):
+    _write_results(tmp_path / "a.jsonl", [5, 1, 3])
+    _write_results(tmp_path / "b.jsonl", [1, 1])
+    (tmp_path / "empty.jsonl").touch()
+
+    matrix = load_score_matrix(
+        [tmp_path / "a.jsonl", tmp_path / "b.jsonl", tmp_path / "empty.jsonl"]
+    )
+
+    assert matrix.models == ["a", "b"]
+    assert matrix.example_ids == ["ex0", "ex1", "ex2"]
+    np.testing.assert_array_equal(
+        matrix.scores, [[100, 0, 50], [0, 0, np.nan]]
+    )
+    np.testing.assert_array_equal(matrix.select("difficulty-hard"), [[0], [0]])
+
+
+def test__analyse_category():
+    rng = np.random.default_rng(0)
+    better = rng.choice([50.0, 75.0, 100.0], size=200)
+    scores = np.stack([better, better - 25, better])
+
+    stats = analyse_category(scores, resamples=2000, rng=rng)
+
+    np.testing.assert_allclose(stats["diff"][0, 1], 25)
+    assert stats["ci95"][0, 0] < stats["means"][0] < stats["ci95"][0, 1]
+    # Identical models never differ, a constant shift always does.
+    assert stats["p_permutation"][0, 2] == 1
+    assert stats["p_permutation"][0, 1] < 0.01
+    assert stats["p_bootstrap"][0, 1] < 0.01
+
+
+def test__analyse(tmp_path):
+    _write_results(tmp_path / "a.jsonl", [5, 4, 5, 4])
+    _write_results(tmp_path / "b.jsonl", [2, 1, 2, 1])
+
+    analysis = analyse(
+        load_score_matrix([tmp_path / "a.jsonl", tmp_path / "b.jsonl"]),
+        resamples=100,
+    )
+
+    assert analysis["models"]["a"]["difficulty-hard"]["mean"] == 75
+    assert analysis["models"]["b"]["overall"]["count"] == 4
+    assert {pair["category"] for pair in analysis["pairs"]} == {
+        "overall",
+        "difficulty-hard",
+        "difficulty-normal",
+    }
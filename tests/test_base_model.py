@@ -0,0 +1,176 @@
+import argparse
+import json
+import random
+import time
+
+from models.base_model import BaseVisionModel
+from models.generate import get_model_args, run_models
+
+
+class _FakeModel(BaseVisionModel):
+    def __init__(self, model_name: str, fail_ids=()):
+        super().__init__(model_name)
+        self.fail_ids = set(fail_ids)
+
+    def generate_response(self, example):
+        time.sleep(random.random() / 100)
+        if example["example_id"] in self.fail_ids:
+            raise RuntimeError("boom")
+        return example["prompt"].upper()
+
+
+def _write_dataset(path, num_examples):
+    with open(path, "w") as fh:
+        for i in range(num_examples):
+            fh.write(
+                json.dumps({"example_id": f"id{i}", "prompt": f"prompt {i}"})
+                + "\n"
+            )
+
+
+def _read_generations(model):
+    with open(model.output_file_path) as fh:
+        return [json.loads(line) for line in fh]
+
+
+def test__process_examples__ordered(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write_dataset(tmp_path / "data.jsonl", 50)
+    model = _FakeModel("fake-model")
+    model.process_examples(
+        str(tmp_path / "data.jsonl"), concurrency=8, ordered=True
+    )
+    assert _read_generations(model) == [
+        {"example_id": f"id{i}", "generation": f"PROMPT {i}"}
+        for i in range(50)
+    ]
+
+
+def test__process_examples__unordered_skips_failures(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("models.executor.time.sleep", lambda _: None)
+    _write_dataset(tmp_path / "data.jsonl", 20)
+    model = _FakeModel("fake-model", fail_ids={"id3"})
+    model.process_examples(str(tmp_path / "data.jsonl"), concurrency=4)
+    generations = _read_generations(model)
+    assert sorted(gen["example_id"] for gen in generations) == sorted(
+        f"id{i}" for i in range(20) if i != 3
+    )
+
+
+def test__run_models__shares_data(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write_dataset(tmp_path / "data.jsonl", 10)
+    model_args = get_model_args(
+        argparse.Namespace(
+            model="fake-a, fake-b",
+            config=None,
+            concurrency=2,
+            ordered=True,
+            prefetch=0,
+        )
+    )
+    assert [args.model for args in model_args] == ["fake-a", "fake-b"]
+    models = [_FakeModel(args.model) for args in model_args]
+    data = models[0].load_data(str(tmp_path / "data.jsonl"))
+    run_models(models, data, model_args)
+    for model in models:
+        assert len(_read_generations(model)) == 10
+
+
+class _FlakyStreamingModel(_FakeModel):
+    def __init__(self, model_name):
+        super().__init__(model_name)
+        self.failures = {"id1": 1}
+
+    def stream_response(self, example, timer):
+        if self.failures.get(example["example_id"]):
+            self.failures[example["example_id"]] -= 1
+            raise RuntimeError("boom")
+        timer.first_token()
+        timer.output_tokens = 7
+        return example["prompt"].upper()
+
+
+def test__process_examples__records_latency(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("models.executor.time.sleep", lambda _: None)
+    _write_dataset(tmp_path / "data.jsonl", 3)
+    model = _FlakyStreamingModel("fake-model")
+    assert model.supports_streaming
+    assert not _FakeModel("other-model").supports_streaming
+    model.stream = True
+    model.process_examples(str(tmp_path / "data.jsonl"), ordered=True)
+    with open(model.latency_file_path) as fh:
+        records = [json.loads(line) for line in fh]
+    assert [record["example_id"] for record in records] == [
+        "id0",
+        "id1",
+        "id2",
+    ]
+    assert [record["retries"] for record in records] == [0, 1, 0]
+    assert all(record["output_tokens"] == 7 for record in records)
+    assert all(
+        0 <= record["ttft_s"] <= record["latency_s"] for record in records
+    )
+
+
+class _SlowRateLimiter:
+    def wait_if_needed(self, tokens):
+        time.sleep(0.2)
+
+
+def test__process_examples__latency_excludes_rate_limit_wait(
+    tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    _write_dataset(tmp_path / "data.jsonl", 2)
+    model = _FakeModel("fake-model")
+    model.rate_limiter = _SlowRateLimiter()
+    model.process_examples(str(tmp_path / "data.jsonl"))
+    with open(model.latency_file_path) as fh:
+        records = [json.loads(line) for line in fh]
+    assert len(records) == 2
+    assert all(record["latency_s"] < 0.1 for record in records)
+
+
+class _SlowHeadModel(_FakeModel):
+    def __init__(self, model_name):
+        super().__init__(model_name)
+        self.started = []
+        self.started_before_head_finished = None
+
+    def generate_response(self, example):
+        self.started.append(example["example_id"])
+        if example["example_id"] == "id0":
+            time.sleep(0.3)
+            self.started_before_head_finished = len(self.started)
+        return example["prompt"].upper()
+
+
+def test__process_examples__ordered_bounds_reorder_buffer(
+    tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    _write_dataset(tmp_path / "data.jsonl", 40)
+    model = _SlowHeadModel("fake-model")
+    model.process_examples(
+        str(tmp_path / "data.jsonl"), concurrency=2, ordered=True
+    )
+    # While the first example is slow, at most 4 * concurrency examples are
+    # in flight or waiting to be written.
+    assert model.started_before_head_finished <= 8
+    assert len(_read_generations(model)) == 40
+
+
+def test__circuit_breaker__shared_by_provider(tmp_path, monkeypatch):
+    from models.executor import get_circuit_breaker
+    from models.reka_models import RekaModel
+
+    monkeypatch.chdir(tmp_path)
+    # The same breaker as the evaluator's, which judges with the Reka API.
+    model = RekaModel("reka-flash", api_key="mock")
+    assert model.executor.breaker is get_circuit_breaker("reka")
+    assert _FakeModel("fake-model").executor.breaker is get_circuit_breaker(
+        "_FakeModel"
+    )
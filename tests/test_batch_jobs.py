@@ -0,0 +1,125 @@
+import json
+import os
+
+import httpx
+import pytest
+
+from models.base_model import BaseVisionModel
+from models.batch_jobs import BatchProvider, batch_state_path, run_batch_job
+from models.executor import RequestExecutor, RetryPolicy
+
+
+class _LocalBatchProvider(BatchProvider):
+    """Stands in for a provider batch API, failing some requests once."""
+
+    def __init__(self, flaky_prompts=(), polls_per_job=2, poll_errors=()):
+        self.flaky_prompts = set(flaky_prompts)
+        self.polls_per_job = polls_per_job
+        self.poll_errors = list(poll_errors)
+        self.jobs = {}
+        self.polls = {}
+
+    def submit(self, requests):
+        job_id = f"job{len(self.jobs)}"
+        self.jobs[job_id] = requests
+        self.polls[job_id] = 0
+        return job_id
+
+    def is_done(self, job_id):
+        if self.poll_errors:
+            raise self.poll_errors.pop(0)
+        self.polls[job_id] += 1
+        return self.polls[job_id] > self.polls_per_job
+
+    def results(self, job_id):
+        results = {}
+        for custom_id, body in self.jobs[job_id].items():
+            if body["prompt"] in self.flaky_prompts:
+                self.flaky_prompts.remove(body["prompt"])
+                results[custom_id] = None
+            else:
+                results[custom_id] = body["prompt"].upper()
+        return results
+
+
+class _FakeModel(BaseVisionModel):
+    def build_request(self, example):
+        return {"prompt": example["prompt"]}
+
+    def generate_response(self, example):
+        raise AssertionError("Not used in batch mode")
+
+
+def test__run_batch_job__resubmits_failures(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    model = _FakeModel("fake-model")
+    data = [
+        {"example_id": f"vibe-eval/id{i}", "prompt": f"prompt {i}"}
+        for i in range(5)
+    ]
+    provider = _LocalBatchProvider(flaky_prompts={"prompt 1", "prompt 3"})
+    sleeps = []
+    run_batch_job(model, data, provider, poll_interval=10, sleep=sleeps.append)
+
+    assert [len(requests) for requests in provider.jobs.values()] == [5, 2]
+    assert sleeps == [10, 15, 10, 15]
+    with open(model.output_file_path) as fh:
+        assert [json.loads(line) for line in fh] == [
+            {"example_id": f"vibe-eval/id{i}", "generation": f"PROMPT {i}"}
+            for i in range(5)
+        ]
+
+
+def test__run_batch_job__splits_jobs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    model = _FakeModel("fake-model")
+    data = [
+        {"example_id": f"vibe-eval/id{i}", "prompt": f"prompt {i}"}
+        for i in range(7)
+    ]
+    data[3]["prompt"] = "x" * 100
+    data[5]["prompt"] = "x" * 200
+    provider = _LocalBatchProvider()
+    provider.max_requests = 3
+    provider.max_bytes = 200
+    run_batch_job(model, data, provider, sleep=lambda _: None)
+
+    # Jobs are split by request count and by size, and the request too large
+    # for any job is left out.
+    assert [list(requests) for requests in provider.jobs.values()] == [
+        ["example-0", "example-1", "example-2"],
+        ["example-3"],
+        ["example-4", "example-6"],
+    ]
+    with open(model.output_file_path) as fh:
+        assert [json.loads(line)["example_id"] for line in fh] == [
+            f"vibe-eval/id{i}" for i in range(7) if i != 5
+        ]
+
+
+def test__run_batch_job__resumes_submitted_jobs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    model = _FakeModel("fake-model")
+    data = [
+        {"example_id": f"vibe-eval/id{i}", "prompt": f"prompt {i}"}
+        for i in range(3)
+    ]
+    # Transient errors checking on a job are retried.
+    provider = _LocalBatchProvider(
+        poll_errors=[httpx.ConnectError("reset"), RuntimeError("interrupted")]
+    )
+    executor = RequestExecutor(
+        RetryPolicy(max_attempts=2), sleep=lambda _: None
+    )
+    with pytest.raises(RuntimeError):
+        run_batch_job(
+            model, data, provider, sleep=lambda _: None, executor=executor
+        )
+    assert list(provider.jobs) == ["job0"]
+    assert os.path.isfile(batch_state_path(model.output_file_path))
+
+    run_batch_job(model, data, provider, sleep=lambda _: None)
+    assert list(provider.jobs) == ["job0"]
+    with open(model.output_file_path) as fh:
+        assert len(fh.readlines()) == 3
+    assert not os.path.isfile(batch_state_path(model.output_file_path))
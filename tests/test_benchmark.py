@@ -0,0 +1,45 @@
+import pytest
+
+from benchmark import run_benchmark, to_markdown
+from models.mock_server import LatencyDistribution, MockConfig
+
+
+def test__run_benchmark():
+    # The OpenAI adapter uses its SDK, Pixtral fetches the images the mock
+    # renders with PIL.
+    pytest.importorskip("openai")
+    pytest.importorskip("PIL")
+    config = MockConfig(
+        latency=LatencyDistribution("constant", 0.01),
+        error_rate_429=0.2,
+        retry_after=0.01,
+        seed=0,
+    )
+    results = run_benchmark(
+        ["evaluator", "openai", "pixtral_server"],
+        [1, 4],
+        config,
+        examples=6,
+        stream=True,
+    )
+    assert [(r["target"], r["parallelism"]) for r in results] == [
+        ("evaluator", 1),
+        ("evaluator", 4),
+        ("openai", 1),
+        ("openai", 4),
+        ("pixtral_server", 1),
+        ("pixtral_server", 4),
+    ]
+    for result in results:
+        assert result["completed"] == 6
+        assert result["examples_per_s"] > 0
+        assert (
+            result["latency_p50_s"]
+            <= result["latency_p95_s"]
+            <= result["latency_p99_s"]
+        )
+        # Every rejected request was retried.
+        assert result["requests"] == 6 + result["rate_limited"]
+        assert result["retry_overhead"] == round(result["rate_limited"] / 6, 4)
+
+    assert len(to_markdown(results).splitlines()) == 2 + len(results)
@@ -0,0 +1,132 @@
+import io
+import json
+
+import pytest
+
+from build_visualizer import build_bundle
+
+
+def _write_jsonl(path, rows):
+    with path.open("w") as fh:
+        for row in rows:
+            fh.write(json.dumps(row) + "\n")
+
+
+def test__build_bundle(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    examples = [
+        {
+            "example_id": f"ex{i}",
+            "category": "difficulty-normal",
+            "prompt": f"Prompt {i}",
+            "reference": f"Reference {i}",
+            "media_filename": f"ex{i}.png",
+            "media_url": f"https://example.com/ex{i}.png",
+        }
+        for i in range(3)
+    ]
+    examples[1]["media_filename"] = "ex0.jpg"
+    _write_jsonl(tmp_path / "data.jsonl", examples)
+    images_dir = tmp_path / "images"
+    images_dir.mkdir()
+    for example, size in zip(examples, [(400, 200), (200, 400), (400, 200)]):
+        Image.new("RGB", size).save(images_dir / example["media_filename"])
+    _write_jsonl(
+        tmp_path / "model.jsonl",
+        [
+            {
+                "example_id": "ex2",
+                "generation": "Generation",
+                "score": 5,
+                "evaluator_explanation": "Explanation",
+            }
+        ],
+    )
+
+    output = tmp_path / "bundle"
+    manifest = build_bundle(
+        tmp_path / "data.jsonl",
+        [tmp_path / "model.jsonl"],
+        output,
+        shard_size=2,
+        thumbnail_size=100,
+        images_dir=images_dir,
+    )
+
+    assert manifest["models"] == [
+        {
+            "name": "model",
+            "scores": {"difficulty-normal": 100.0, "overall": 100.0},
+        }
+    ]
+    assert [ex["scores"] for ex in manifest["examples"]] == [
+        [None],
+        [None],
+        [5],
+    ]
+    assert json.loads((output / "shards/models/0/1.json").read_text()) == {
+        "ex2": {
+            "generation": "Generation",
+            "evaluator_explanation": "Explanation",
+        }
+    }
+    assert list(
+        json.loads((output / "shards/examples/0.json").read_text())
+    ) == [
+        "ex0",
+        "ex1",
+    ]
+    thumbnail = output / manifest["examples"][0]["thumbnail"]
+    assert Image.open(io.BytesIO(thumbnail.read_bytes())).size == (100, 50)
+    # Images with the same stem get their own thumbnails.
+    thumbnails = [ex["thumbnail"] for ex in manifest["examples"]]
+    assert len(set(thumbnails)) == 3
+    assert Image.open(output / thumbnails[1]).size == (50, 100)
+
+
+def test__build_bundle__removes_stale_shards(tmp_path):
+    examples = [
+        {
+            "example_id": f"ex{i}",
+            "category": "difficulty-normal",
+            "prompt": f"Prompt {i}",
+            "reference": f"Reference {i}",
+            "media_filename": f"ex{i}.png",
+            "media_url": f"https://example.com/ex{i}.png",
+        }
+        for i in range(2)
+    ]
+    _write_jsonl(tmp_path / "data.jsonl", examples)
+    for name in ("a", "b"):
+        _write_jsonl(
+            tmp_path / f"{name}.jsonl",
+            [{"example_id": "ex0", "generation": name, "score": 3}],
+        )
+    output = tmp_path / "bundle"
+    # Only the shards are removed, e.g. not a models package next to them.
+    (output / "models").mkdir(parents=True)
+    (output / "models/utils.py").write_text("")
+    build_bundle(
+        tmp_path / "data.jsonl",
+        [tmp_path / "a.jsonl", tmp_path / "b.jsonl"],
+        output,
+        shard_size=1,
+        thumbnail_size=None,
+    )
+    assert (output / "shards/models/1/0.json").exists()
+
+    build_bundle(
+        tmp_path / "data.jsonl",
+        [tmp_path / "b.jsonl"],
+        output,
+        shard_size=2,
+        thumbnail_size=None,
+    )
+    assert sorted(
+        path.relative_to(output).as_posix()
+        for path in output.glob("shards/**/*.json")
+    ) == ["shards/examples/0.json", "shards/models/0/0.json"]
+    assert (output / "models/utils.py").exists()
+    assert json.loads((output / "shards/models/0/0.json").read_text()) == {
+        "ex0": {"generation": "b", "evaluator_explanation": ""}
+    }
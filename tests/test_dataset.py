@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from models.dataset import (
+    Coverage,
+    DatasetIndex,
+    Example,
+    join_generations,
+    load_examples,
+)
+
+
+def _example(example_id):
+    return {
+        "example_id": example_id,
+        "category": "difficulty-normal",
+        "prompt": f"Prompt {example_id}",
+        "reference": "Reference",
+        "media_filename": f"{example_id}.jpg",
+        "media_url": f"https://example.com/{example_id}.jpg",
+    }
+
+
+def _write_jsonl(path, rows):
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+
+
+def test__example():
+    example = Example(**_example("a"))
+    assert not hasattr(example, "__dict__")
+    assert example.generation is None
+    with pytest.raises(AttributeError):
+        example.extra = "Not a field"
+
+
+def test__dataset_index(tmp_path):
+    path = tmp_path / "data.jsonl"
+    _write_jsonl(path, [_example("a"), _example("b"), _example("c")])
+
+    index = DatasetIndex(str(path))
+    assert (tmp_path / "data.jsonl.offsets.json").exists()
+    assert list(index.ids()) == ["a", "b", "c"]
+    assert index.get("b") == Example(**_example("b"))
+
+    # Rebuilt when the dataset changes.
+    _write_jsonl(path, [_example("a"), _example("d")])
+    index = DatasetIndex(str(path))
+    assert "d" in index and "b" not in index
+    assert index.get("d") == load_examples(str(path))[1]
+
+
+def test__join_generations(tmp_path):
+    _write_jsonl(
+        tmp_path / "data.jsonl", [_example(i) for i in ("a", "b", "c", "d")]
+    )
+    _write_jsonl(
+        tmp_path / "generations.jsonl",
+        [
+            {"example_id": "b", "generation": "first"},
+            {"example_id": "b", "generation": "second"},
+            {"example_id": "x", "generation": "unknown"},
+            {"example_id": "c", "generation": "skipped"},
+            {"example_id": "a", "generation": "A"},
+        ],
+    )
+    coverage = Coverage()
+    examples = list(
+        join_generations(
+            DatasetIndex(str(tmp_path / "data.jsonl"), cache=False),
+            str(tmp_path / "generations.jsonl"),
+            skip_ids={"c"},
+            coverage=coverage,
+        )
+    )
+
+    assert [(e.example_id, e.generation) for e in examples] == [
+        ("b", "first"),
+        ("a", "A"),
+    ]
+    assert coverage.duplicates == {"b"}
+    assert coverage.unknown == {"x"}
+    assert coverage.missing == {"d"}
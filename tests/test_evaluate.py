@@ -1,4 +1,18 @@
-from evaluate import Example, make_evaluator_prompt
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from reka.core.api_error import ApiError
+
+import evaluate
+from evaluate import (
+    AdaptiveConcurrencyLimiter,
+    Example,
+    JudgementCache,
+    RunningMetrics,
+    make_evaluator_prompt,
+)
 
 
 def test__make_evaluator_prompt__no_include_image():
@@ -63,3 +77,350 @@ Explanation: (your explanation)
 Rating: (int)\
 """
     )
+
+
+def _fake_response(content: str):
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(
+        responses=[SimpleNamespace(message=message)],
+        usage=SimpleNamespace(input_tokens=100, output_tokens=20),
+    )
+
+
+def test__adaptive_concurrency_limiter__additive_increase():
+    limiter = AdaptiveConcurrencyLimiter(
+        initial_limit=4, max_limit=8, latency_tolerance=float("inf")
+    )
+
+    async def _run():
+        for _ in range(4):
+            start_time = await limiter.acquire()
+            limiter.release(start_time)
+
+    asyncio.run(_run())
+    assert limiter.limit == pytest.approx(5.0, abs=0.1)
+    assert limiter.in_flight == 0
+
+
+def test__adaptive_concurrency_limiter__one_decrease_per_window():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=16)
+
+    async def _run():
+        start_times = [await limiter.acquire() for _ in range(16)]
+        for start_time in start_times:
+            limiter.release(start_time, overloaded=True)
+
+    asyncio.run(_run())
+    assert limiter.limit == 8
+
+
+def test__adaptive_concurrency_limiter__recovers_from_latency_step(
+    monkeypatch,
+):
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(
+        evaluate, "time", SimpleNamespace(monotonic=lambda: clock.now)
+    )
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+
+    def _request(latency):
+        limiter.in_flight += 1
+        start_time = clock.now
+        clock.now += latency
+        limiter.release(start_time)
+
+    for _ in range(100):
+        _request(1.0)
+    # Judgements take 5 times longer from now on, and stay that way.
+    limits = []
+    for _ in range(300):
+        _request(5.0)
+        limits.append(limiter.limit)
+    # The limit was cut while latency rose, then grew back once the higher
+    # latency became the baseline.
+    assert min(limits) < 8
+    assert limiter.limit > 16
+
+
+def test__evaluate_in_parallel_with_retries(monkeypatch):
+    calls = []
+
+    class _FakeChat:
+        async def create(self, model, messages, temperature):
+            calls.append(model)
+            if len(calls) == 1:
+                raise ApiError(status_code=429, body="slow down")
+            return _fake_response("Explanation: fine\nRating: 4")
+
+    monkeypatch.setattr(
+        evaluate, "ASYNC_CLIENT", SimpleNamespace(chat=_FakeChat())
+    )
+    examples = [
+        Example(
+            example_id=f"test{i}",
+            category="test",
+            prompt="User prompt.",
+            reference="Reference answer.",
+            media_filename="not-used",
+            media_url="not-used",
+            generation="Model generation",
+        )
+        for i in range(5)
+    ]
+    out = evaluate.evaluate_in_parallel_with_retries(
+        examples,
+        evaluator=evaluate.Evaluator.REKA_CORE,
+        parallelism=2,
+        rate_limit_delay=0,
+    )
+    assert sorted(example.example_id for example in out) == [
+        f"test{i}" for i in range(5)
+    ]
+    assert all(example.score == 4 for example in out)
+    assert len(calls) == 6
+
+
+def _make_example(example_id: str, generation: str = "Model generation"):
+    return Example(
+        example_id=example_id,
+        category="test",
+        prompt="User prompt.",
+        reference="Reference answer.",
+        media_filename="not-used",
+        media_url="not-used",
+        generation=generation,
+    )
+
+
+def test__judgement_cache(tmp_path):
+    cache = JudgementCache(tmp_path / "cache.sqlite", max_entries=2)
+    evaluator = evaluate.Evaluator.REKA_CORE
+    key = JudgementCache.key(_make_example("a"), evaluator, 0.4)
+    assert key == JudgementCache.key(_make_example("b"), evaluator, 0.4)
+    assert key != JudgementCache.key(_make_example("a"), evaluator, 0.0)
+    assert key != JudgementCache.key(
+        _make_example("a", generation="Other generation"), evaluator, 0.4
+    )
+
+    assert cache.get(key) is None
+    cache.put(key, evaluator, "Rating: 5", 5)
+    assert cache.get(key) == ("Rating: 5", 5)
+    for other_key in ["x", "y"]:
+        cache.put(other_key, evaluator, "Rating: 1", 1)
+    assert cache.get(key) == ("Rating: 5", 5)
+    cache.evict()
+    assert cache.get("x") is None
+    assert cache.get(key) == ("Rating: 5", 5)
+    cache.close()
+
+    refreshing_cache = JudgementCache(
+        tmp_path / "cache.sqlite", refresh=True
+    )
+    assert refreshing_cache.get(key) is None
+    refreshing_cache.close()
+
+
+def test__evaluate_in_parallel_with_retries__on_failure(monkeypatch):
+    class _FakeChat:
+        async def create(self, model, messages, temperature):
+            if "fail" in messages[0]["content"]:
+                return _fake_response("Explanation: no rating")
+            return _fake_response("Explanation: fine\nRating: 2")
+
+    monkeypatch.setattr(
+        evaluate, "ASYNC_CLIENT", SimpleNamespace(chat=_FakeChat())
+    )
+    scored, failed = [], []
+    out = evaluate.evaluate_in_parallel_with_retries(
+        (
+            _make_example(f"test{i}", generation="fail" if i == 1 else "ok")
+            for i in range(3)
+        ),
+        evaluator=evaluate.Evaluator.REKA_CORE,
+        max_retries=2,
+        on_result=scored.append,
+        on_failure=lambda example, error: failed.append(example.example_id),
+    )
+    assert out == []
+    assert sorted(example.example_id for example in scored) == [
+        "test0",
+        "test2",
+    ]
+    assert failed == ["test1"]
+
+
+def test__completed_example_ids__truncates_partial_line(tmp_path):
+    output_path = tmp_path / "out.jsonl"
+    output_path.write_text(
+        '{"example_id": "a"}\n{"example_id": "b"}\n{"example_id": "c", "gen'
+    )
+    assert evaluate._completed_example_ids(output_path) == {"a", "b"}
+    assert output_path.read_text() == (
+        '{"example_id": "a"}\n{"example_id": "b"}\n'
+    )
+
+
+def test__running_metrics(tmp_path):
+    snapshot_path = tmp_path / "out_summary_live.json"
+    metrics = RunningMetrics(snapshot_path, snapshot_interval=0)
+    for score in [1, 3, 5, 5]:
+        example = _make_example("a")
+        example.score = score
+        metrics.add(example)
+
+    summary = metrics.summary()
+    assert summary["overall"]["count"] == 4
+    assert summary["overall"]["mean"] == 62.5
+    # Sample standard deviation of [0, 50, 100, 100] is 47.87.
+    assert summary["overall"]["ci95"] == [15.59, 100.0]
+    assert summary["test"] == summary["overall"]
+    assert json.loads(snapshot_path.read_text())["overall"] == json.loads(
+        json.dumps(summary["overall"])
+    )
+    assert "test=62.5±" in metrics.format()
+
+
+def test__in_shard():
+    example_ids = [f"vibe-eval/example{i}" for i in range(100)]
+    shards = [
+        {i for i in example_ids if evaluate._in_shard(i, (index, 3))}
+        for index in range(3)
+    ]
+    assert sum(len(shard) for shard in shards) == 100
+    assert set.union(*shards) == set(example_ids)
+    assert all(shards)
+
+
+def test__merge_shards(tmp_path):
+    def _write(path, example_ids):
+        with path.open("w") as fh:
+            for example_id in example_ids:
+                fh.write(json.dumps({"example_id": example_id}) + "\n")
+
+    _write(tmp_path / "shard0.jsonl", ["a", "b"])
+    _write(tmp_path / "shard1.jsonl", ["c"])
+    output = tmp_path / "out.jsonl"
+    shards = [tmp_path / "shard0.jsonl", tmp_path / "shard1.jsonl"]
+    assert evaluate._merge_shards(shards, output, ["a", "b", "c"])
+    assert [json.loads(line)["example_id"] for line in output.open()] == [
+        "a",
+        "b",
+        "c",
+    ]
+
+    _write(tmp_path / "shard1.jsonl", ["b"])
+    assert not evaluate._merge_shards(shards, output, ["a", "b", "c"])
+    assert len(output.read_text().splitlines()) == 2
+
+
+def test__evaluate_in_parallel_with_retries__cascade(monkeypatch):
+    # First-stage ratings per example, for each sample.
+    flash_ratings = {
+        "sure": ["5", "5"],
+        "uncertain": ["3"],
+        "disagree": ["5", "1"],
+        "unparsable": ["no rating"],
+    }
+    calls = []
+
+    class _FakeChat:
+        async def create(self, model, messages, temperature):
+            example_id = next(
+                i for i in flash_ratings if f"Answer {i}." in str(messages)
+            )
+            calls.append((model, example_id))
+            if model == evaluate.Evaluator.REKA_CORE.value:
+                return _fake_response("Explanation: core\nRating: 2")
+            sample = sum(call == (model, example_id) for call in calls) - 1
+            rating = flash_ratings[example_id][sample]
+            return _fake_response(f"Explanation: flash\nRating: {rating}")
+
+    monkeypatch.setattr(
+        evaluate, "ASYNC_CLIENT", SimpleNamespace(chat=_FakeChat())
+    )
+    cascade = evaluate.Cascade(evaluate.Evaluator.REKA_FLASH)
+    out = evaluate.evaluate_in_parallel_with_retries(
+        [_make_example(i, f"Answer {i}.") for i in flash_ratings],
+        evaluator=evaluate.Evaluator.REKA_CORE,
+        cascade=cascade,
+    )
+
+    results = {
+        example.example_id: (
+            example.score,
+            example.evaluator,
+            example.escalation_reason,
+        )
+        for example in out
+    }
+    assert results == {
+        "sure": (5, "reka-flash-20241127", None),
+        "uncertain": (2, "reka-core-20240501", "uncertain"),
+        "disagree": (2, "reka-core-20240501", "disagreement"),
+        "unparsable": (2, "reka-core-20240501", "unparsable"),
+    }
+    assert cascade.judged == 4
+    assert "escalated 3 of 4 examples (75.0%)" in cascade.report()
+
+
+def test__prepare_redrive(tmp_path):
+    def _write(path, example_ids):
+        with path.open("w") as fh:
+            for example_id in example_ids:
+                fh.write(json.dumps({"example_id": example_id}) + "\n")
+
+    def _ids(path):
+        return [json.loads(line)["example_id"] for line in path.open()]
+
+    dead_letter = tmp_path / "out_failed.jsonl"
+    with pytest.raises(FileNotFoundError):
+        evaluate._prepare_redrive(dead_letter)
+
+    _write(dead_letter, ["a", "b", "c"])
+    redrive = evaluate._prepare_redrive(dead_letter)
+    assert _ids(redrive) == ["a", "b", "c"]
+    assert not dead_letter.exists()
+
+    # Interrupted after "a" failed again: the pending examples are kept.
+    _write(dead_letter, ["a"])
+    assert evaluate._prepare_redrive(dead_letter) == redrive
+    assert _ids(redrive) == ["a", "b", "c"]
+    assert not dead_letter.exists()
+
+    _write(dead_letter, ["d"])
+    evaluate._prepare_redrive(dead_letter)
+    assert _ids(redrive) == ["a", "b", "c", "d"]
+
+
+def test__count_examples(tmp_path):
+    from dataclasses import asdict
+
+    data_path = tmp_path / "data.jsonl"
+    generations_path = tmp_path / "generations.jsonl"
+    with data_path.open("w") as fh:
+        for example_id in ["a", "b", "c", "d"]:
+            fh.write(json.dumps(asdict(_make_example(example_id))) + "\n")
+    with generations_path.open("w") as fh:
+        for example_id in ["a", "a", "b", "unknown", "c", "d"]:
+            fh.write(
+                json.dumps({"example_id": example_id, "generation": "g"})
+                + "\n"
+            )
+
+    def _count(skip_ids=frozenset(), shard=None):
+        examples = evaluate._read_examples(
+            data_path, generations_path, skip_ids
+        )
+        if shard is not None:
+            examples = (
+                e for e in examples if evaluate._in_shard(e.example_id, shard)
+            )
+        assert evaluate._count_examples(
+            data_path, generations_path, skip_ids, shard
+        ) == len(list(examples))
+
+    _count()
+    _count(skip_ids={"b"})
+    _count(skip_ids={"b"}, shard=(0, 2))
+    _count(shard=(1, 2))
+    assert evaluate._count_examples(data_path, generations_path, {"b"}) == 3
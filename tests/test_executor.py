@@ -0,0 +1,212 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from reka.core.api_error import ApiError
+
+from models.executor import (
+    CircuitBreaker,
+    ErrorKind,
+    ParseError,
+    RequestExecutor,
+    RetryPolicy,
+    classify_error,
+    retry_after_seconds,
+)
+
+
+class _HTTPError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.response = SimpleNamespace(
+            status_code=status_code, headers=headers or {}
+        )
+
+
+def test__classify_error():
+    assert classify_error(ApiError(status_code=429)) is ErrorKind.RATE_LIMIT
+    assert classify_error(_HTTPError(503)) is ErrorKind.TRANSIENT
+    assert classify_error(_HTTPError(408)) is ErrorKind.TRANSIENT
+    assert classify_error(_HTTPError(400)) is ErrorKind.PERMANENT
+    assert classify_error(ApiError(status_code=401)) is ErrorKind.PERMANENT
+    assert classify_error(ParseError("no rating")) is ErrorKind.PARSE
+    assert classify_error(ValueError("bad image")) is ErrorKind.PERMANENT
+    assert (
+        classify_error(json.JSONDecodeError("truncated", "{", 1))
+        is ErrorKind.TRANSIENT
+    )
+    assert classify_error(httpx.ConnectError("reset")) is ErrorKind.TRANSIENT
+    assert classify_error(RuntimeError("boom")) is ErrorKind.TRANSIENT
+
+
+def test__retry_after_seconds():
+    assert retry_after_seconds(_HTTPError(429, {"Retry-After": "7"})) == 7
+    assert (
+        retry_after_seconds(_HTTPError(429, {"retry-after-ms": "1500"})) == 1.5
+    )
+    past = {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}
+    assert retry_after_seconds(_HTTPError(503, past)) == 0
+    assert retry_after_seconds(_HTTPError(429)) is None
+    assert retry_after_seconds(RuntimeError()) is None
+
+
+def test__request_executor__retries_and_honours_retry_after():
+    errors = [_HTTPError(429, {"Retry-After": "3"}), _HTTPError(502)]
+    sleeps = []
+
+    def _call():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    policy = RetryPolicy(base_delay=4, max_delay=100)
+    executor = RequestExecutor(policy, sleep=sleeps.append)
+    assert executor.call(_call) == "ok"
+    assert sleeps[0] == 3
+    # Backoff of base_delay doubled for the second attempt, half of it jitter.
+    assert 4 <= sleeps[1] <= 8
+
+
+def test__request_executor__does_not_retry_permanent_errors():
+    calls = []
+
+    def _call():
+        calls.append(1)
+        raise _HTTPError(400)
+
+    executor = RequestExecutor(sleep=lambda _: None)
+    with pytest.raises(_HTTPError):
+        executor.call(_call)
+    assert len(calls) == 1
+
+
+def test__request_executor__gives_up_after_max_attempts():
+    calls = []
+
+    async def _call():
+        calls.append(1)
+        raise ParseError("no rating")
+
+    executor = RequestExecutor(RetryPolicy(max_attempts=3))
+    with pytest.raises(ParseError):
+        asyncio.run(executor.call_async(_call))
+    assert len(calls) == 3
+
+    calls.clear()
+    executor = RequestExecutor(RetryPolicy(retry_parse_errors=False))
+    with pytest.raises(ParseError):
+        asyncio.run(executor.call_async(_call))
+    assert len(calls) == 1
+
+
+def test__circuit_breaker():
+    now = [0.0]
+    breaker = CircuitBreaker(
+        "test", failure_threshold=2, cooldown=10, clock=lambda: now[0]
+    )
+    breaker.record_failure(ErrorKind.PERMANENT)
+    breaker.record_failure(ErrorKind.TRANSIENT)
+    assert breaker.wait_time() == 0
+    breaker.record_failure(ErrorKind.RATE_LIMIT)
+    assert breaker.wait_time() == 10
+
+    # A failure of the first request after the cooldown reopens it for longer.
+    now[0] = 10
+    assert breaker.wait_time() == 0
+    breaker.record_failure(ErrorKind.TRANSIENT)
+    assert breaker.wait_time() == 20
+
+    # A success closes it, resetting the cooldown.
+    now[0] = 30
+    breaker.record_success()
+    breaker.record_failure(ErrorKind.TRANSIENT)
+    assert breaker.wait_time() == 0
+    breaker.record_failure(ErrorKind.TRANSIENT)
+    assert breaker.wait_time() == 10
+
+    breaker.pause(25)
+    assert breaker.wait_time() == 25
+    breaker.reset()
+    assert breaker.wait_time() == 0
+
+
+def test__request_executor__waits_for_open_breaker():
+    now = [0.0]
+    breaker = CircuitBreaker(
+        "test", failure_threshold=1, cooldown=10, clock=lambda: now[0]
+    )
+    sleeps = []
+
+    def _sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    errors = [_HTTPError(500)]
+
+    def _call():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    executor = RequestExecutor(
+        RetryPolicy(base_delay=0), breaker, sleep=_sleep
+    )
+    assert executor.call(_call) == "ok"
+    assert sleeps == [0, 10]
+
+
+def test__request_executor__honours_retry_after_of_reka_errors():
+    from reka.client import AsyncReka, Reka
+
+    from models.executor import keep_error_headers_client
+
+    def _rate_limited(request):
+        return httpx.Response(
+            429, headers={"Retry-After": "0.25"}, json={"detail": "slow down"}
+        )
+
+    transport = httpx.MockTransport(_rate_limited)
+    messages = [{"role": "user", "content": "Describe the image."}]
+    client = Reka(
+        api_key="mock",
+        base_url="http://reka.test/v1",
+        httpx_client=keep_error_headers_client(transport=transport),
+    )
+    sleeps = []
+    executor = RequestExecutor(
+        RetryPolicy(max_attempts=2), sleep=sleeps.append
+    )
+    with pytest.raises(ApiError) as error:
+        executor.call(client.chat.create, model="m", messages=messages)
+    assert error.value.status_code == 429
+    assert retry_after_seconds(error.value) == 0.25
+    assert sleeps == [0.25]
+
+    async_client = AsyncReka(
+        api_key="mock",
+        base_url="http://reka.test/v1",
+        httpx_client=keep_error_headers_client(
+            asynchronous=True, transport=transport
+        ),
+    )
+    with pytest.raises(ApiError) as error:
+        asyncio.run(
+            RequestExecutor(RetryPolicy(max_attempts=1)).call_async(
+                async_client.chat.create, model="m", messages=messages
+            )
+        )
+    assert retry_after_seconds(error.value) == 0.25
+
+    # The headers of an earlier error response aren't attached to later errors.
+    def _fails():
+        raise ApiError(status_code=503)
+
+    sleeps.clear()
+    executor = RequestExecutor(
+        RetryPolicy(max_attempts=2, base_delay=0), sleep=sleeps.append
+    )
+    with pytest.raises(ApiError):
+        executor.call(_fails)
+    assert sleeps == [0]
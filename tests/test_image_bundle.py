@@ -0,0 +1,63 @@
+import base64
+import io
+import json
+
+import pytest
+
+from models import image_processing, utils
+from models.image_bundle import ImageBundle, pack_bundle
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image
+
+
+@pytest.fixture
+def bundle_path(tmp_path):
+    images_dir = tmp_path / "images"
+    images_dir.mkdir()
+    with open(tmp_path / "data.jsonl", "w") as fh:
+        for i, format in enumerate(["PNG", "JPEG"]):
+            out = io.BytesIO()
+            Image.new("RGB", (8 * (i + 1), 8)).save(out, format=format)
+            (images_dir / f"{i}.img").write_bytes(out.getvalue())
+            example = {
+                "example_id": f"id{i}",
+                "media_filename": f"{i}.img",
+                "media_url": f"http://x/{i}.img",
+            }
+            fh.write(json.dumps(example) + "\n")
+    path = str(tmp_path / "images.bundle")
+    pack_bundle(
+        str(tmp_path / "data.jsonl"),
+        path,
+        images_dir=str(images_dir),
+        include_base64=True,
+    )
+    return path
+
+
+def test__image_bundle__lookup(bundle_path, tmp_path):
+    bundle = ImageBundle(bundle_path)
+    entry = bundle.lookup("id1")
+    assert entry is bundle.lookup("1.img") is bundle.lookup("http://x/1.img")
+    assert entry.media_type == "image/jpeg"
+    assert (entry.width, entry.height) == (16, 8)
+    data = bundle.read(entry)
+    assert isinstance(data, memoryview)
+    assert bytes(data) == (tmp_path / "images" / "1.img").read_bytes()
+    assert bytes(bundle.read_base64(entry)) == base64.b64encode(data)
+    assert "id2" not in bundle
+
+
+def test__image_bundle__serves_images(bundle_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "_IMAGE_BUNDLE", None)
+    utils.configure_image_bundle(bundle_path)
+    image = (tmp_path / "images" / "0.img").read_bytes()
+    assert bytes(utils.get_image_data("http://x/0.img")) == image
+    assert utils.get_image_url("http://x/0.img") == (
+        "data:image/png;base64," + base64.b64encode(image).decode()
+    )
+    assert utils.get_image_url("http://x/2.img") == "http://x/2.img"
+    assert image_processing.prepare_image_base64(
+        "http://x/0.img", "anthropic"
+    ) == ("image/png", base64.b64encode(image).decode())
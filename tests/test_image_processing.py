@@ -0,0 +1,60 @@
+import io
+
+import pytest
+
+from models.image_processing import (
+    ImageNormalizer,
+    ImageProfile,
+    normalize_image,
+    sniff_media_type,
+)
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image
+
+
+def _encode(image, format, **kwargs):
+    out = io.BytesIO()
+    image.save(out, format=format, **kwargs)
+    return out.getvalue()
+
+
+def _noise_image(size):
+    return Image.frombytes(
+        "RGB", size, bytes(range(256)) * (size[0] * size[1] * 3 // 256 + 1)
+    )
+
+
+def test__sniff_media_type():
+    image = Image.new("RGB", (4, 4))
+    assert sniff_media_type(_encode(image, "PNG")) == "image/png"
+    assert sniff_media_type(_encode(image, "JPEG")) == "image/jpeg"
+    assert sniff_media_type(_encode(image, "WEBP")) == "image/webp"
+    assert sniff_media_type(b"not an image") is None
+
+
+def test__normalize_image__unchanged_within_limits():
+    data = _encode(Image.new("RGB", (64, 64)), "PNG")
+    profile = ImageProfile(name="test", max_bytes=len(data), max_side=64)
+    assert normalize_image(data, profile) == ("image/png", data)
+
+
+def test__normalize_image__transcodes_and_downscales():
+    data = _encode(_noise_image((512, 256)), "WEBP", lossless=True)
+    profile = ImageProfile(name="test", max_bytes=20_000, max_side=200)
+    media_type, normalized = normalize_image(data, profile)
+    assert media_type == "image/jpeg"
+    assert len(normalized) <= profile.max_bytes
+    assert max(Image.open(io.BytesIO(normalized)).size) <= 200
+
+
+def test__image_normalizer__caches_per_profile(tmp_path):
+    data = _encode(_noise_image((300, 300)), "BMP")
+    normalizer = ImageNormalizer(str(tmp_path), num_workers=1)
+    small = ImageProfile(name="small", max_bytes=10_000_000, max_side=100)
+    large = ImageProfile(name="large", max_bytes=10_000_000, max_side=1000)
+    assert normalizer.normalize(data, small)[0] == "image/jpeg"
+    assert normalizer.normalize(data, large)[0] == "image/jpeg"
+    assert len(list(tmp_path.glob("*/*.jpeg"))) == 2
+    normalizer.shutdown()
+    assert normalizer.normalize(data, small)[0] == "image/jpeg"
@@ -0,0 +1,72 @@
+import json
+
+from models.latency import (
+    LatencyTimer,
+    latency_path,
+    percentile,
+    summarise,
+    to_markdown,
+)
+
+
+def test__latency_path():
+    assert (
+        latency_path("data/generations/gpt-4o.jsonl")
+        == "data/generations/gpt-4o_latency.jsonl"
+    )
+
+
+def test__latency_timer():
+    now = [0.0]
+    timer = LatencyTimer(clock=lambda: now[0])
+    now[0] = 0.5
+    timer.first_token()
+    now[0] = 2.5
+    record = timer.finish(
+        {"example_id": "a", "category": "difficulty-hard"}, "x" * 40
+    )
+    assert record == {
+        "example_id": "a",
+        "category": "difficulty-hard",
+        "ttft_s": 0.5,
+        "latency_s": 2.5,
+        "output_tokens": 10,
+        "output_tokens_estimated": True,
+        "tokens_per_s": 5.0,
+        "retries": 0,
+    }
+
+
+def test__percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50.5
+    assert percentile(values, 99) == 99.01
+    assert percentile([3.0], 95) == 3.0
+
+
+def test__summarise(tmp_path):
+    path = tmp_path / "model-a_latency.jsonl"
+    with open(path, "w") as fh:
+        for i in range(10):
+            record = {
+                "example_id": f"id{i}",
+                "category": (
+                    "difficulty-hard" if i < 5 else "difficulty-normal"
+                ),
+                "ttft_s": None,
+                "latency_s": float(i + 1),
+                "tokens_per_s": 10.0,
+                "retries": i % 2,
+            }
+            fh.write(json.dumps(record) + "\n")
+    (tmp_path / "model-a.jsonl").write_text("")
+
+    summary = summarise([str(tmp_path)])
+    assert list(summary) == ["model-a"]
+    overall = summary["model-a"]["overall"]
+    assert overall["count"] == 10
+    assert overall["retries"] == 5
+    assert overall["ttft_s"] is None
+    assert overall["latency_s"] == {"p50": 5.5, "p95": 9.55, "p99": 9.91}
+    assert summary["model-a"]["difficulty-hard"]["latency_s"]["p50"] == 3.0
+    assert "| model-a | overall | 10 | 5 | - |" in to_markdown(summary)
@@ -0,0 +1,48 @@
+import json
+import os
+
+from leaderboard import LeaderboardIndex, to_markdown
+
+
+def _write_results(path, scores, mtime_ns=None):
+    with path.open("w") as fh:
+        for i, score in enumerate(scores):
+            category = "difficulty-hard" if i % 2 else "difficulty-normal"
+            result = {"example_id": f"ex{i}", "category": category}
+            fh.write(json.dumps({**result, "score": score}) + "\n")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test__leaderboard_index__incremental(tmp_path):
+    a, b = tmp_path / "a.jsonl", tmp_path / "b.jsonl"
+    _write_results(a, [5, 3])
+    _write_results(b, [1, 2])
+    index = LeaderboardIndex(tmp_path / "index.json")
+    assert index.update([a, b]) == [a, b]
+    index.save()
+
+    # A new model only reads the new file, touching a file without changing
+    # it doesn't re-read it.
+    c = tmp_path / "c.jsonl"
+    _write_results(c, [4, 3])
+    os.utime(a, ns=(1, 1))
+    index = LeaderboardIndex(tmp_path / "index.json")
+    assert index.update([a, b, c]) == [c]
+
+    _write_results(b, [5, 5])
+    assert index.update([a, b, c]) == [b]
+    assert index.leaderboard() == [
+        {"model": "b", "all": 100.0, "hard": 100.0, "normal": 100.0},
+        {"model": "a", "all": 75.0, "hard": 50.0, "normal": 100.0},
+        {"model": "c", "all": 62.5, "hard": 50.0, "normal": 75.0},
+    ]
+
+
+def test__to_markdown():
+    rows = [{"model": "m", "all": 55.95, "hard": 52.25, "normal": None}]
+    assert to_markdown(rows).splitlines() == [
+        "| Model | all    | hard  | normal|",
+        "|-------|--------|-------|-------|",
+        "| m     | 56.0   | 52.3  | -     |",
+    ]
@@ -0,0 +1,109 @@
+import random
+
+import httpx
+import pytest
+from reka.client import Reka
+
+from models.mock_server import LatencyDistribution, MockConfig, MockServer
+
+_MESSAGES = [{"role": "user", "content": "Describe the image."}]
+
+
+@pytest.fixture
+def server():
+    with MockServer(MockConfig(output_words=20)) as server:
+        yield server
+
+
+def test__latency_distribution():
+    assert LatencyDistribution.parse("0.5") == LatencyDistribution(
+        "constant", 0.5
+    )
+    assert LatencyDistribution.parse(
+        "lognormal:0.5:0.4"
+    ) == LatencyDistribution("lognormal", 0.5, 0.4)
+    with pytest.raises(ValueError):
+        LatencyDistribution.parse("normal:1")
+
+    rng = random.Random(0)
+    samples = [
+        LatencyDistribution("uniform", 1, 2).sample(rng) for _ in range(100)
+    ]
+    assert all(1 <= sample <= 2 for sample in samples)
+    samples = sorted(
+        LatencyDistribution("lognormal", 1, 0.5).sample(rng)
+        for _ in range(1001)
+    )
+    assert 0.8 < samples[500] < 1.25
+
+
+def test__mock_server__openai(server):
+    openai = pytest.importorskip("openai")
+    client = openai.OpenAI(api_key="mock", base_url=f"{server.url}/v1")
+    response = client.chat.completions.create(model="m", messages=_MESSAGES)
+    text = response.choices[0].message.content
+    assert text.endswith(tuple(f"Rating: {score}" for score in range(1, 6)))
+    assert response.usage.completion_tokens == len(text.split())
+
+    stream = client.chat.completions.create(
+        model="m",
+        messages=_MESSAGES,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    chunks = list(stream)
+    assert (
+        "".join(chunk.choices[0].delta.content or "" for chunk in chunks[:-1])
+        == text
+    )
+    assert chunks[-1].usage.completion_tokens == len(text.split())
+
+
+def test__mock_server__anthropic(server):
+    anthropic = pytest.importorskip("anthropic")
+    client = anthropic.Anthropic(api_key="mock", base_url=server.url)
+    message = client.messages.create(
+        model="m", max_tokens=100, messages=_MESSAGES
+    )
+    text = message.content[0].text
+    with client.messages.stream(
+        model="m", max_tokens=100, messages=_MESSAGES
+    ) as stream:
+        assert "".join(stream.text_stream) == text
+        assert stream.get_final_message().usage.output_tokens == len(
+            text.split()
+        )
+
+
+def test__mock_server__reka(server):
+    client = Reka(api_key="mock", base_url=f"{server.url}/v1")
+    response = client.chat.create(model="m", messages=_MESSAGES)
+    text = response.responses[0].message.content
+    chunks = list(client.chat.create_stream(model="m", messages=_MESSAGES))
+    # Each chunk holds the whole response so far.
+    assert chunks[-1].responses[0].chunk.content == text
+    assert server.stats() == {
+        "requests": 2,
+        "by_api": {"reka": 2},
+        "by_status": {"200": 2},
+    }
+
+    pytest.importorskip("PIL")
+    image = httpx.get(f"{server.url}/images/00001.jpg")
+    assert image.headers["Content-Type"] == "image/jpeg"
+
+
+def test__mock_server__injects_errors(server):
+    server.reset(MockConfig(error_rate_5xx=1.0, retry_after=0.25))
+    response = httpx.post(f"{server.url}/v1/messages", json={})
+    assert response.status_code in (500, 502, 503)
+    assert response.headers["retry-after-ms"] == "250"
+    assert response.json()["error"]["type"] == "api_error"
+
+    server.reset(MockConfig(requests_per_second=1, burst=2))
+    statuses = [
+        httpx.post(f"{server.url}/v1/chat/completions", json={}).status_code
+        for _ in range(3)
+    ]
+    assert statuses == [200, 200, 429]
+    assert server.stats()["by_status"] == {"200": 2, "429": 1}
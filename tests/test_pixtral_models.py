@@ -0,0 +1,94 @@
+import importlib
+import json
+import sys
+import types
+from types import SimpleNamespace
+
+import pytest
+
+from models.telemetry import REQUESTS
+
+
+class _FakeLLM:
+    """Stands in for vllm.LLM, recording the size of each chat call."""
+
+    def __init__(self, **kwargs):
+        self.batch_sizes = []
+        self.fail_prompts = set()
+
+    def chat(self, messages, sampling_params):
+        conversations = (
+            messages if isinstance(messages[0], list) else [messages]
+        )
+        self.batch_sizes.append(len(conversations))
+        prompts = [
+            conversation[0]["content"][0]["text"]
+            for conversation in conversations
+        ]
+        if self.fail_prompts.intersection(prompts):
+            self.fail_prompts.difference_update(prompts)
+            raise RuntimeError("engine error")
+        return [
+            SimpleNamespace(outputs=[SimpleNamespace(text=prompt.upper())])
+            for prompt in prompts
+        ]
+
+
+@pytest.fixture
+def pixtral_model_cls(monkeypatch):
+    vllm = types.ModuleType("vllm")
+    vllm.LLM = _FakeLLM
+    sampling_params = types.ModuleType("vllm.sampling_params")
+    sampling_params.SamplingParams = lambda **kwargs: kwargs
+    monkeypatch.setitem(sys.modules, "vllm", vllm)
+    monkeypatch.setitem(sys.modules, "vllm.sampling_params", sampling_params)
+    monkeypatch.delitem(sys.modules, "models.pixtral_models", raising=False)
+    return importlib.import_module("models.pixtral_models").PixtralModel
+
+
+def _write_dataset(path, num_examples):
+    with open(path, "w") as fh:
+        for i in range(num_examples):
+            example = {
+                "example_id": f"id{i}",
+                "prompt": f"prompt {i}",
+                "media_url": f"http://x/{i}.png",
+            }
+            fh.write(json.dumps(example) + "\n")
+
+
+def test__pixtral_model__batches(pixtral_model_cls, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write_dataset(tmp_path / "data.jsonl", 10)
+    model = pixtral_model_cls("mistralai/Pixtral-12B-2409", batch_size=4)
+    model.process_examples(str(tmp_path / "data.jsonl"), ordered=True)
+    assert model.llm.batch_sizes == [4, 4, 2]
+    with open(model.output_file_path) as fh:
+        assert [json.loads(line) for line in fh] == [
+            {"example_id": f"id{i}", "generation": f"PROMPT {i}"}
+            for i in range(10)
+        ]
+
+
+def test__pixtral_model__retries_failed_batch_individually(
+    pixtral_model_cls, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    _write_dataset(tmp_path / "data.jsonl", 6)
+    model = pixtral_model_cls("mistralai/Pixtral-12B-2409", batch_size=3)
+    model.llm.fail_prompts = {"prompt 4"}
+    before = {
+        outcome: REQUESTS.value(model=model.model_name, outcome=outcome)
+        for outcome in ("ok", "transient")
+    }
+    model.process_examples(str(tmp_path / "data.jsonl"), ordered=True)
+    assert model.llm.batch_sizes == [3, 3, 1, 1, 1]
+    with open(model.output_file_path) as fh:
+        assert len(fh.readlines()) == 6
+    # The first batch, then the examples of the failed one individually.
+    assert REQUESTS.value(model=model.model_name, outcome="ok") == (
+        before["ok"] + 4
+    )
+    assert REQUESTS.value(model=model.model_name, outcome="transient") == (
+        before["transient"] + 1
+    )
@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from models.latency import LatencyTimer
+from models.pixtral_server import PixtralServer
+from models.telemetry import REQUESTS, REQUESTS_IN_FLIGHT
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Imitates vLLM's /v1/chat/completions, echoing the prompt upper-cased."""
+
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        payload = json.loads(
+            self.rfile.read(int(self.headers["Content-Length"]))
+        )
+        time.sleep(0.05)
+        text = payload["messages"][1]["content"][0]["text"].upper()
+        self.send_response(200)
+        if payload.get("stream"):
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for word in text.split(" "):
+                chunk = {"choices": [{"delta": {"content": word + " "}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+        else:
+            body = json.dumps(
+                {"choices": [{"message": {"content": text}}]}
+            ).encode()
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        with server.lock:
+            server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.max_in_flight = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def _make_model(stub_server, tmp_path, **kwargs):
+    system_prompt_path = tmp_path / "SYSTEM_PROMPT.txt"
+    system_prompt_path.write_text("You are {name}, today is {today}.")
+    return PixtralServer(
+        "mistralai/Pixtral-Large-Instruct-2411",
+        server_url="127.0.0.1",
+        server_port=str(stub_server.server_address[1]),
+        system_prompt_path=str(system_prompt_path),
+        **kwargs,
+    )
+
+
+def _examples(num_examples):
+    return [
+        {
+            "example_id": f"id{i}",
+            "prompt": f"prompt number {i}",
+            "media_url": f"http://x/{i}.png",
+        }
+        for i in range(num_examples)
+    ]
+
+
+def test__pixtral_server__concurrent_batch(stub_server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    model = _make_model(stub_server, tmp_path, max_in_flight=8)
+    assert model.system_prompt.startswith(
+        "You are Pixtral-Large-Instruct-2411"
+    )
+    ok_before = REQUESTS.value(model=model.model_name, outcome="ok")
+    responses = model.generate_batch(_examples(32))
+    assert responses == [f"PROMPT NUMBER {i}" for i in range(32)]
+    assert 1 < stub_server.max_in_flight <= 8
+    # Every request of the batch is in the telemetry.
+    assert REQUESTS.value(model=model.model_name, outcome="ok") == (
+        ok_before + 32
+    )
+    assert REQUESTS_IN_FLIGHT.value(model=model.model_name) == 0
+
+
+def test__pixtral_server__stream(stub_server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    model = _make_model(stub_server, tmp_path, stream=True)
+    assert (
+        model.generate_response(_examples(1)[0]).strip() == "PROMPT NUMBER 0"
+    )
+
+
+def test__pixtral_server__stream_records_first_token(
+    stub_server, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    model = _make_model(stub_server, tmp_path, stream=True)
+    timer = LatencyTimer()
+    response = model.stream_response(_examples(1)[0], timer)
+    record = timer.finish(_examples(1)[0], response)
+    assert response.strip() == "PROMPT NUMBER 0"
+    assert 0 < record["ttft_s"] <= record["latency_s"]
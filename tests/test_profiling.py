@@ -0,0 +1,65 @@
+import asyncio
+import json
+import time
+
+from models import profiling
+
+
+def test__stage__is_a_no_op_when_not_profiling():
+    assert profiling.stop_profiling() is None
+    assert profiling.stage("provider_call") is profiling.stage("write_output")
+    with profiling.example("a"), profiling.stage("provider_call"):
+        pass
+
+
+def test__profiler__self_time_and_examples(tmp_path):
+    profiler = profiling.start_profiling(str(tmp_path), sample_interval=0.001)
+    try:
+        with profiling.example("a"):
+            with profiling.stage("provider_call"):
+                with profiling.stage("image_fetch"):
+                    time.sleep(0.02)
+                time.sleep(0.01)
+
+        async def _judge(example_id):
+            with profiling.example(example_id):
+                with profiling.stage("provider_call"):
+                    await asyncio.sleep(0.01)
+
+        async def _run():
+            await asyncio.gather(_judge("b"), _judge("c"))
+
+        asyncio.run(_run())
+    finally:
+        table = profiling.stop_profiling()
+
+    durations = profiler._durations
+    assert len(durations["provider_call"]) == 3
+    ((fetch_total, fetch_self),) = durations["image_fetch"]
+    call_total, call_self = durations["provider_call"][0]
+    # The nested stage counts towards the total but not the self time.
+    assert call_total >= fetch_total + 0.01
+    assert abs(call_self - (call_total - fetch_total)) < 1e-6
+    assert "| provider_call | 3 |" in table
+
+    with open(tmp_path / "stages_by_example.jsonl") as fid:
+        by_example = {
+            record["example_id"]: record for record in map(json.loads, fid)
+        }
+    assert set(by_example) == {"a", "b", "c"}
+    assert set(by_example["a"]) == {
+        "example_id",
+        "provider_call",
+        "image_fetch",
+    }
+    assert by_example["b"]["provider_call"] >= 0.01
+
+    for name in [
+        "stages.md",
+        "cprofile.pstats",
+        "stacks.folded",
+        "tracemalloc.txt",
+    ]:
+        assert (tmp_path / name).exists()
+    assert (tmp_path / "stacks.folded").read_text().strip()
+    assert profiling.stage("provider_call") is profiling._NULL_CONTEXT
@@ -0,0 +1,62 @@
+import json
+
+import numpy as np
+
+from analysis import score_matrix_from_store
+from evaluate import _summarise_metrics
+from results_store import ResultsStore, export, ingest
+
+
+def _write(path, rows):
+    path.parent.mkdir(exist_ok=True)
+    with path.open("w") as fh:
+        for row in rows:
+            fh.write(json.dumps(row) + "\n")
+
+
+def _result(example_id, category, score):
+    return {
+        "example_id": example_id,
+        "category": category,
+        "generation": f"Generation for {example_id} ✓",
+        "score": score,
+        "evaluator_explanation": f"Explanation {score}",
+    }
+
+
+def test__results_store(tmp_path):
+    results = tmp_path / "results" / "model.jsonl"
+    _write(
+        results,
+        [
+            _result("a", "difficulty-hard", 1),
+            _result("b", "difficulty-normal", 5),
+            _result("c", "difficulty-normal", 4),
+        ],
+    )
+    generations = tmp_path / "generations" / "model.jsonl"
+    _write(generations, [{"example_id": "a", "generation": "Unscored"}])
+    ingest(tmp_path / "store", [results, generations])
+
+    # Re-ingesting a run replaces it, keeping the text of the other runs.
+    _write(results, [_result("a", "difficulty-hard", 3)])
+    ingest(tmp_path / "store", [results])
+
+    store = ResultsStore(tmp_path / "store")
+    assert store.runs == ["results/model", "generations/model"]
+    assert list(export(store, "generations/model")) == [
+        {"example_id": "a", "category": "", "generation": "Unscored"}
+    ]
+    assert list(export(store, "results/model")) == [
+        _result("a", "difficulty-hard", 3)
+    ]
+    assert store.mean_scores() == {
+        "results/model": {"difficulty-hard": 50.0, "overall": 50.0}
+    }
+    assert _summarise_metrics(store.records("results/model")) == {
+        "difficulty-hard": 50.0,
+        "overall": 50.0,
+    }
+    matrix = score_matrix_from_store(store)
+    assert matrix.models == ["results/model"]
+    np.testing.assert_array_equal(matrix.scores, [[50, np.nan, np.nan]])
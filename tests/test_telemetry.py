@@ -0,0 +1,94 @@
+import json
+
+import httpx
+import pytest
+
+from models.executor import ParseError, RequestExecutor
+from models.telemetry import (
+    REQUESTS,
+    RETRIES,
+    Registry,
+    serve_metrics,
+    track_request,
+    write_report,
+)
+
+
+def _registry():
+    registry = Registry()
+    requests = registry.counter(
+        "requests_total", "Requests.", ["model", "outcome"]
+    )
+    in_flight = registry.gauge("in_flight", "In flight.", ["model"])
+    latency = registry.histogram(
+        "latency_seconds", "Latency.", ["model"], buckets=(1, 5)
+    )
+    return registry, requests, in_flight, latency
+
+
+def test__registry__render():
+    registry, requests, in_flight, latency = _registry()
+    requests.inc(model="m", outcome="ok")
+    requests.inc(2, model="m", outcome="rate limit")
+    in_flight.inc(model="m")
+    in_flight.dec(model="m")
+    for value in (0.5, 1, 3, 10):
+        latency.observe(value, model="m")
+    lines = registry.render().splitlines()
+    assert 'requests_total{model="m",outcome="ok"} 1' in lines
+    assert 'requests_total{model="m",outcome="rate limit"} 2' in lines
+    assert 'in_flight{model="m"} 0' in lines
+    assert 'latency_seconds_bucket{model="m",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{model="m",le="5"} 3' in lines
+    assert 'latency_seconds_bucket{model="m",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{model="m"} 14.5' in lines
+    assert "# TYPE latency_seconds histogram" in lines
+
+    with pytest.raises(ValueError):
+        requests.inc(model="m")
+
+
+def test__serve_metrics():
+    registry, requests, _, _ = _registry()
+    requests.inc(model="m", outcome="ok")
+    server = serve_metrics(0, registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        response = httpx.get(f"{url}/metrics")
+        assert response.status_code == 200
+        assert 'requests_total{model="m",outcome="ok"} 1' in response.text
+        assert httpx.get(f"{url}/other").status_code == 404
+    finally:
+        server.shutdown()
+
+
+def test__executor_telemetry(tmp_path):
+    errors = [ParseError("no rating")]
+
+    def _call():
+        with track_request("telemetry-test"):
+            if errors:
+                raise errors.pop(0)
+            return "ok"
+
+    executor = RequestExecutor(sleep=lambda _: None, name="telemetry-test")
+    assert executor.call(_call) == "ok"
+    assert REQUESTS.value(model="telemetry-test", outcome="ok") == 1
+    assert REQUESTS.value(model="telemetry-test", outcome="parse") == 1
+    assert RETRIES.value(model="telemetry-test", error="parse") == 1
+
+    write_report(str(tmp_path / "report.json"))
+    with open(tmp_path / "report.json") as fh:
+        report = json.load(fh)
+    assert report["summary"]["models"]["telemetry-test"] == {
+        "requests": 2,
+        "rate_limited": 0,
+        "retries": 1,
+        "rate_limited_fraction": 0.0,
+    }
+    latency = report["metrics"]["vibe_eval_request_latency_seconds"]
+    assert any(
+        sample["labels"] == {"model": "telemetry-test"}
+        and sample["count"] == 2
+        for sample in latency["samples"]
+    )
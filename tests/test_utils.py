@@ -0,0 +1,114 @@
+import threading
+
+import httpx
+
+from models import utils
+from models.utils import RateLimiter, estimate_tokens
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.lock = threading.Lock()
+
+    def monotonic(self):
+        with self.lock:
+            return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += seconds
+
+
+def test__rate_limiter__spreads_requests(monkeypatch):
+    clock = _FakeClock()
+    monkeypatch.setattr(utils, "time", clock)
+    limiter = RateLimiter(requests_per_minute=60)
+    for _ in range(10):
+        limiter.wait_if_needed()
+    # One request is allowed immediately, then one per second.
+    assert clock.now == 9.0
+
+
+def test__rate_limiter__tokens_per_minute(monkeypatch):
+    clock = _FakeClock()
+    monkeypatch.setattr(utils, "time", clock)
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=6000)
+    limiter.wait_if_needed(tokens=100)
+    assert clock.now == 0.0
+    limiter.wait_if_needed(tokens=1000)
+    # The first 100 tokens used up the burst budget, the next 1000 tokens
+    # take 10 seconds to accrue at 100 tokens per second.
+    assert clock.now == 10.0
+
+
+def test__rate_limiter__thread_safe(monkeypatch):
+    clock = _FakeClock()
+    monkeypatch.setattr(utils, "time", clock)
+    limiter = RateLimiter(requests_per_minute=60)
+    delays = []
+
+    def _reserve():
+        delays.append(limiter._reserve(tokens=0))
+
+    threads = [threading.Thread(target=_reserve) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(delays) == [float(i) for i in range(8)]
+
+
+def test__get_rate_limiter__per_budget(monkeypatch):
+    monkeypatch.setattr(utils, "_RATE_LIMITERS", {})
+    monkeypatch.delenv("GEMINI_RPM", raising=False)
+    monkeypatch.delenv("GEMINI_TPM", raising=False)
+    default = utils.get_rate_limiter("gemini")
+    assert default.requests_per_minute == 10
+    # Models of one provider with different budgets get their own limiters.
+    faster = utils.get_rate_limiter("gemini", requests_per_minute=60)
+    assert faster is not default
+    assert faster.requests_per_minute == 60
+    assert utils.get_rate_limiter("gemini", requests_per_minute=10) is default
+
+
+def test__estimate_tokens():
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("abc", num_images=1) == 1001
+
+
+def test__get_image_data__cached(tmp_path, monkeypatch):
+    requested = []
+
+    def _handler(request):
+        requested.append(str(request.url))
+        return httpx.Response(
+            200, content=b"image for " + request.url.path.encode()
+        )
+
+    monkeypatch.setattr(
+        utils,
+        "_HTTP_CLIENT",
+        httpx.Client(transport=httpx.MockTransport(_handler)),
+    )
+    monkeypatch.setattr(utils, "_IMAGE_CACHE", None)
+    utils.configure_image_cache(str(tmp_path))
+
+    prefetcher = utils.ImagePrefetcher()
+    futures = prefetcher.prefetch(
+        ["http://x/a.png", "http://x/b.png", "http://x/a.png"]
+    )
+    assert [future.result() for future in futures] == [
+        b"image for /a.png",
+        b"image for /b.png",
+    ]
+    prefetcher.shutdown()
+
+    assert utils.get_image_data("http://x/a.png") == b"image for /a.png"
+    assert sorted(requested) == ["http://x/a.png", "http://x/b.png"]
+
+    # A new cache on the same directory is served from disk.
+    utils.configure_image_cache(str(tmp_path))
+    assert utils.get_image_data("http://x/b.png") == b"image for /b.png"
+    assert len(requested) == 2
+    assert len(list((tmp_path / "blobs").iterdir())) == 2